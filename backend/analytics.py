@@ -0,0 +1,288 @@
+"""
+ReLocal Analytics
+Buffered writer for analytics_events, keeping analytics writes off the request
+path, and incremental daily rollups of those events
+"""
+
+import os
+import time
+import logging
+import asyncio
+from typing import Dict, List, Optional
+from datetime import datetime, timezone, timedelta
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# ============= CONFIGURATION =============
+
+# A batch is written when it reaches this size or has waited this long
+ANALYTICS_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', '200'))
+ANALYTICS_FLUSH_INTERVAL_SECONDS = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL_SECONDS', '1'))
+# Events buffered in memory; beyond this new events are dropped rather than slowing requests
+ANALYTICS_MAX_BUFFERED_EVENTS = int(os.environ.get('ANALYTICS_MAX_BUFFERED_EVENTS', '10000'))
+# Attempts per batch before it is dropped (e.g. MongoDB unreachable for a while)
+ANALYTICS_MAX_WRITE_ATTEMPTS = int(os.environ.get('ANALYTICS_MAX_WRITE_ATTEMPTS', '3'))
+ANALYTICS_RETRY_SECONDS = 1.0
+
+# Rollups only cover events older than this, so buffered events still being
+# written are not missed when the watermark moves past their timestamp
+ANALYTICS_ROLLUP_LAG_SECONDS = int(os.environ.get('ANALYTICS_ROLLUP_LAG_SECONDS', '120'))
+ANALYTICS_ROLLUP_INTERVAL_SECONDS = int(os.environ.get('ANALYTICS_ROLLUP_INTERVAL_SECONDS', '300'))
+
+ROLLUP_EVENT_TYPES = ['travel_mode_toggled', 'delivery_selected']
+
+# ============= EMITTER =============
+
+class AnalyticsEmitter:
+    """
+    Queues analytics events in memory and writes them with insert_many
+    emit() never waits on MongoDB. The buffer is bounded: when the writer
+    falls behind (or MongoDB is down) and the buffer is full, new events
+    are dropped and counted instead of growing memory or blocking requests.
+    stop() flushes whatever is still buffered.
+    """
+
+    def __init__(
+        self,
+        db,
+        batch_size: int = ANALYTICS_BATCH_SIZE,
+        flush_interval: float = ANALYTICS_FLUSH_INTERVAL_SECONDS,
+        max_buffered: int = ANALYTICS_MAX_BUFFERED_EVENTS
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffered)
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+
+    def emit(self, event: Dict) -> bool:
+        """
+        Buffer one event, returns False if it was dropped because the buffer is full
+        """
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Analytics buffer full, {self.dropped} events dropped so far")
+            return False
+        return True
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the writer and flush the remaining buffer
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        while not self._queue.empty():
+            await self._write(self._take(self.batch_size))
+
+    def _take(self, limit: int) -> List[Dict]:
+        batch = []
+        while len(batch) < limit and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                batch.extend(self._take(self.batch_size - len(batch)))
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._write(batch)
+            except asyncio.CancelledError:
+                # Put the batch back so stop() flushes it
+                for event in batch:
+                    self.emit(event)
+                raise
+
+    async def _write(self, batch: List[Dict]) -> None:
+        if not batch:
+            return
+        for attempt in range(1, ANALYTICS_MAX_WRITE_ATTEMPTS + 1):
+            try:
+                # Unordered, so one bad document does not stop the rest
+                await self.db.analytics_events.insert_many(batch, ordered=False)
+                self.written += len(batch)
+                return
+            except asyncio.CancelledError:
+                raise
+            except BulkWriteError as e:
+                # insert_many keeps the _ids it assigned, so events written by an
+                # earlier attempt come back as duplicates and are not stored twice
+                errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+                if not errors:
+                    self.written += e.details.get("nInserted", 0)
+                    return
+                if attempt == ANALYTICS_MAX_WRITE_ATTEMPTS:
+                    self.failed_batches += 1
+                    self.dropped += len(errors)
+                    logger.error(f"Dropping {len(errors)} analytics events after {attempt} attempts: {errors[0].get('errmsg')}")
+                    return
+                logger.warning(f"Analytics batch write failed (attempt {attempt}): {errors[0].get('errmsg')}")
+                await asyncio.sleep(ANALYTICS_RETRY_SECONDS * attempt)
+            except Exception as e:
+                if attempt == ANALYTICS_MAX_WRITE_ATTEMPTS:
+                    self.failed_batches += 1
+                    self.dropped += len(batch)
+                    logger.error(f"Dropping {len(batch)} analytics events after {attempt} attempts: {e}")
+                    return
+                logger.warning(f"Analytics batch write failed (attempt {attempt}): {e}")
+                await asyncio.sleep(ANALYTICS_RETRY_SECONDS * attempt)
+
+    def stats(self) -> Dict:
+        return {
+            "buffered": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_batches": self.failed_batches
+        }
+
+# ============= DAILY ROLLUPS =============
+
+class AnalyticsRollup:
+    """
+    Per-day aggregates of travel_mode_toggled and delivery_selected events
+    stored in `analytics_daily_rollups`, one document per UTC day
+    Each run only reads events from the day of the last watermark onwards;
+    the days it touches are recomputed from scratch and written with $set,
+    so a run that dies before moving the watermark is simply repeated.
+    """
+
+    STATE_ID = "daily_rollup"
+
+    def __init__(self, db, lag_seconds: int = ANALYTICS_ROLLUP_LAG_SECONDS):
+        self.db = db
+        self.lag_seconds = lag_seconds
+
+    async def ensure_indexes(self) -> None:
+        await self.db.analytics_events.create_index([("timestamp", 1), ("event_type", 1)])
+        await self.db.analytics_daily_rollups.create_index("day", unique=True)
+
+    async def watermark(self) -> Optional[str]:
+        state = await self.db.analytics_rollup_state.find_one({"_id": self.STATE_ID})
+        return state["watermark"] if state else None
+
+    async def run(self) -> Dict:
+        """
+        Roll up events since the last watermark, returns {days, watermark}
+        """
+
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=self.lag_seconds)).isoformat()
+        watermark = await self.watermark()
+
+        time_range: Dict = {"$lte": cutoff}
+        if watermark:
+            # Whole days are recomputed, so start at the watermark's day
+            time_range["$gte"] = f"{watermark[:10]}T00:00:00"
+
+        rows = await self.db.analytics_events.aggregate([
+            {"$match": {"event_type": {"$in": ROLLUP_EVENT_TYPES}, "timestamp": time_range}},
+            {"$group": {
+                "_id": {
+                    "day": {"$substrCP": ["$timestamp", 0, 10]},
+                    "event_type": "$event_type",
+                    "travel_mode": "$travel_mode",
+                    "ship_after_trip": "$ship_after_trip",
+                    "reason": "$reason"
+                },
+                "count": {"$sum": 1},
+                "weight_saved_kg": {"$sum": {"$ifNull": ["$weight_saved_kg", 0]}}
+            }}
+        ]).to_list(None)
+
+        days: Dict[str, Dict] = {}
+        for row in rows:
+            key = row["_id"]
+            day = days.setdefault(key["day"], self._empty_day(key["day"]))
+            if key["event_type"] == "travel_mode_toggled":
+                day["travel_mode"]["enabled" if key.get("travel_mode") else "disabled"] += row["count"]
+                day["travel_mode"]["toggles"] += row["count"]
+            else:
+                delivery = day["delivery"]
+                delivery["selections"] += row["count"]
+                delivery["weight_saved_kg"] += row["weight_saved_kg"]
+                if key.get("ship_after_trip"):
+                    delivery["ship_after_trip"] += row["count"]
+                reason = delivery["by_reason"].setdefault(
+                    key.get("reason") or "unspecified", {"selections": 0, "weight_saved_kg": 0.0}
+                )
+                reason["selections"] += row["count"]
+                reason["weight_saved_kg"] += row["weight_saved_kg"]
+
+        now = datetime.now(timezone.utc).isoformat()
+        for day in days.values():
+            delivery = day["delivery"]
+            delivery["weight_saved_kg"] = round(delivery["weight_saved_kg"], 2)
+            # Reasons are client-supplied, so they are stored as values rather than field names
+            delivery["by_reason"] = sorted(
+                (
+                    {"reason": reason, "selections": totals["selections"], "weight_saved_kg": round(totals["weight_saved_kg"], 2)}
+                    for reason, totals in delivery["by_reason"].items()
+                ),
+                key=lambda entry: -entry["selections"]
+            )
+            delivery["ship_after_trip_share"] = (
+                round(delivery["ship_after_trip"] / delivery["selections"], 4) if delivery["selections"] else 0.0
+            )
+            await self.db.analytics_daily_rollups.update_one(
+                {"day": day["day"]},
+                {"$set": {**day, "updated_at": now}},
+                upsert=True
+            )
+
+        await self.db.analytics_rollup_state.update_one(
+            {"_id": self.STATE_ID},
+            {"$set": {"watermark": cutoff, "updated_at": now}},
+            upsert=True
+        )
+        return {"days": sorted(days), "watermark": cutoff}
+
+    @staticmethod
+    def _empty_day(day: str) -> Dict:
+        return {
+            "day": day,
+            "travel_mode": {"toggles": 0, "enabled": 0, "disabled": 0},
+            "delivery": {
+                "selections": 0,
+                "ship_after_trip": 0,
+                "ship_after_trip_share": 0.0,
+                "weight_saved_kg": 0.0,
+                "by_reason": {}
+            }
+        }
+
+    async def daily(self, start_day: Optional[str] = None, end_day: Optional[str] = None) -> List[Dict]:
+        """
+        Rollups for an inclusive YYYY-MM-DD range, oldest first
+        """
+
+        query: Dict = {}
+        if start_day or end_day:
+            query["day"] = {}
+            if start_day:
+                query["day"]["$gte"] = start_day
+            if end_day:
+                query["day"]["$lte"] = end_day
+        return await self.db.analytics_daily_rollups.find(query, {"_id": 0}).sort("day", 1).to_list(None)
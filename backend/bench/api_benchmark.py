@@ -0,0 +1,320 @@
+"""
+API benchmark
+Boots server.app in-process against a local MongoDB (or mongomock-motor),
+seeds a shop with bench.seed_data and drives the hot endpoints at controlled
+concurrency, reporting throughput and latency percentiles per endpoint.
+A saved report can be used as a baseline to flag regressions.
+
+Run from backend/:
+    python -m bench.api_benchmark --requests 500 --concurrency 20
+    python -m bench.api_benchmark --save-baseline bench/baseline.json
+    python -m bench.api_benchmark --baseline bench/baseline.json --threshold 0.2
+Use --mongomock to run without a mongod (needs `pip install mongomock-motor`).
+Background workers (label queue, webhook inbox, schedulers) are not started;
+only the analytics writer runs so buffered events are flushed.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List
+
+from bench.shipping_benchmark import percentile
+from bench.seed_data import (
+    SeedConfig, seed_database, shop_doc, product_doc, seller_id, buyer_id, buyer_email, session_token
+)
+
+if TYPE_CHECKING:
+    # Imported at run time by run_benchmark, for the Scenario annotation only
+    import httpx
+
+# ============= ENVIRONMENT =============
+
+def prepare_environment(args: argparse.Namespace):
+    """
+    Point server.py at the benchmark database and import it
+    server.py reads its configuration at import time
+    """
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db_name
+    # Rule-based estimates unless a Shippo stand-in is wanted (see bench.fake_shippo)
+    if not args.shippo_url:
+        os.environ.pop("SHIPPO_API_KEY", None)
+    else:
+        os.environ["SHIPPO_API_URL"] = args.shippo_url
+        os.environ["SHIPPO_API_KEY"] = "bench"
+
+    if args.mongomock:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("--mongomock needs mongomock-motor: pip install mongomock-motor")
+        import motor.motor_asyncio
+        motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+
+    import server
+    return server
+
+# ============= SEED DATA =============
+
+BENCH_PASSWORD = "bench-password"
+
+async def seed(server, args: argparse.Namespace) -> Dict:
+    """
+    One shop with products and order history, and a pool of buyers with sessions
+    """
+    config = SeedConfig(
+        seed=args.seed,
+        buyers=args.buyers,
+        shops=1,
+        products_per_shop=args.products,
+        orders=args.orders,
+        password=BENCH_PASSWORD
+    )
+    await seed_database(server.db, config, drop=True)
+    await server.db.analytics_events.delete_many({})
+
+    return {
+        "shop": shop_doc(config, 0),
+        "products": [product_doc(config, 0, p) for p in range(config.products_per_shop)],
+        "seller_token": session_token(seller_id(config, 0)),
+        "buyer_tokens": [session_token(buyer_id(config, i)) for i in range(config.buyers)],
+        "buyer_emails": [buyer_email(i) for i in range(config.buyers)]
+    }
+
+# ============= SCENARIOS =============
+
+DESTINATIONS = [
+    {"street": "5 Marine Dr", "city": "Mumbai", "postal_code": "400001", "country": "IN"},
+    {"street": "9 Hill Rd", "city": "Leh", "postal_code": "194101", "country": "IN"},
+    {"street": "2 Chome", "city": "Tokyo", "postal_code": "100-0001", "country": "JP"},
+    {"street": "10 Broadway", "city": "New York", "postal_code": "10001", "country": "US"}
+]
+
+Scenario = Callable[["httpx.AsyncClient", Dict, int], Awaitable["httpx.Response"]]
+
+def _auth(token: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {token}"}
+
+async def product_page(client, ctx: Dict, i: int):
+    product = ctx["products"][i % len(ctx["products"])]
+    return await client.get(f"/api/products/{product['product_id']}")
+
+async def qr_scan(client, ctx: Dict, i: int):
+    product = ctx["products"][i % len(ctx["products"])]
+    return await client.get(f"/api/qr/scan/{product['qr_code_id']}")
+
+async def login(client, ctx: Dict, i: int):
+    email = ctx["buyer_emails"][i % len(ctx["buyer_emails"])]
+    return await client.post("/api/auth/login", json={"email": email, "password": BENCH_PASSWORD})
+
+async def create_order(client, ctx: Dict, i: int):
+    products = ctx["products"]
+    items = []
+    for offset in range(1 + i % 3):
+        product = products[(i + offset) % len(products)]
+        items.append({
+            "product_id": product["product_id"],
+            "product_name": product["name"],
+            "quantity": 1 + offset,
+            "price": product["price"],
+            "weight_kg": product["estimated_weight_kg"]
+        })
+    return await client.post(
+        "/api/orders",
+        json={
+            "shop_id": ctx["shop"]["shop_id"],
+            "items": items,
+            "delivery_type": "delivery",
+            "delivery_address": DESTINATIONS[i % len(DESTINATIONS)],
+            "ship_after_trip": i % 4 == 0,
+            "delivery_preference_reason": "travel_light"
+        },
+        headers=_auth(ctx["buyer_tokens"][i % len(ctx["buyer_tokens"])])
+    )
+
+async def seller_orders(client, ctx: Dict, i: int):
+    return await client.get("/api/orders/seller", headers=_auth(ctx["seller_token"]))
+
+async def shop_insights(client, ctx: Dict, i: int):
+    return await client.get(f"/api/shops/{ctx['shop']['shop_id']}/insights", headers=_auth(ctx["seller_token"]))
+
+async def shipping_estimate(client, ctx: Dict, i: int):
+    return await client.post(
+        "/api/shipping/estimate",
+        json={
+            "order_id": f"order_bench{i:08d}",
+            "weight_kg": round(0.5 + (i % 8) * 0.5, 1),
+            "from_address": ctx["shop"]["location"],
+            "to_address": DESTINATIONS[i % len(DESTINATIONS)]
+        },
+        headers=_auth(ctx["buyer_tokens"][i % len(ctx["buyer_tokens"])])
+    )
+
+# Ordered so seller_orders and insights run after create_order has added orders
+SCENARIOS: Dict[str, Scenario] = {
+    "product_page": product_page,
+    "qr_scan": qr_scan,
+    "login": login,
+    "create_order": create_order,
+    "seller_orders": seller_orders,
+    "shop_insights": shop_insights,
+    "shipping_estimate": shipping_estimate
+}
+
+# ============= RUNNER =============
+
+async def run_scenario(client, ctx: Dict, name: str, requests: int, concurrency: int) -> Dict:
+    scenario = SCENARIOS[name]
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await scenario(client, ctx, i)
+                status = str(response.status_code)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception as e:
+                status = type(e).__name__
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(latencies[-1], 2) if latencies else 0.0
+        },
+        "statuses": statuses,
+        "errors": errors
+    }
+
+async def run_benchmark(args: argparse.Namespace) -> Dict:
+    import httpx
+
+    server = prepare_environment(args)
+    ctx = await seed(server, args)
+    server.analytics.start()
+
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    results = {}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        for name in names:
+            if args.warmup:
+                await run_scenario(client, ctx, name, args.warmup, args.concurrency)
+            results[name] = await run_scenario(client, ctx, name, args.requests, args.concurrency)
+
+    await server.analytics.stop()
+    await server.shippo_client.close()
+
+    return {
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "products": args.products,
+            "buyers": args.buyers,
+            "orders": args.orders,
+            "database": "mongomock" if args.mongomock else args.mongo_url
+        },
+        "scenarios": results
+    }
+
+# ============= BASELINE =============
+
+def compare_to_baseline(report: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Scenarios whose p95 grew or throughput fell by more than threshold
+    """
+    regressions = []
+    for name, result in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        result["baseline"] = {
+            "p95_ms": base["latency_ms"]["p95"],
+            "throughput_rps": base["throughput_rps"]
+        }
+        p95, base_p95 = result["latency_ms"]["p95"], base["latency_ms"]["p95"]
+        if base_p95 and p95 > base_p95 * (1 + threshold):
+            regressions.append(f"{name}: p95 {base_p95}ms -> {p95}ms")
+        rps, base_rps = result["throughput_rps"], base["throughput_rps"]
+        if base_rps and rps < base_rps * (1 - threshold):
+            regressions.append(f"{name}: throughput {base_rps} -> {rps} req/s")
+    return regressions
+
+def print_report(report: Dict, regressions: List[str]) -> None:
+    config = report["config"]
+    print(f"requests={config['requests']} concurrency={config['concurrency']} database={config['database']}")
+    print(f"  {'scenario':<18} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'errors':>7}  baseline p95")
+    for name, result in report["scenarios"].items():
+        latency = result["latency_ms"]
+        base = result.get("baseline")
+        base_text = f"{base['p95_ms']}ms" if base else "-"
+        print(
+            f"  {name:<18} {result['throughput_rps']:>8} {latency['p50']:>8} {latency['p95']:>8} "
+            f"{latency['p99']:>8} {latency['max']:>8} {result['errors']:>7}  {base_text}"
+        )
+    if regressions:
+        print("REGRESSIONS:")
+        for regression in regressions:
+            print(f"  {regression}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hot API endpoints in-process")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20, help="untimed requests per scenario first")
+    parser.add_argument("--scenarios", help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--buyers", type=int, default=50)
+    parser.add_argument("--orders", type=int, default=1000, help="order history seeded for the shop")
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="relocal_apibench")
+    parser.add_argument("--mongomock", action="store_true", help="in-memory mongomock-motor instead of mongod")
+    parser.add_argument("--shippo-url", help="fake Shippo base URL (python -m bench.fake_shippo)")
+    parser.add_argument("--baseline", help="report JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p95/throughput change vs baseline")
+    parser.add_argument("--save-baseline", help="write this run's report JSON here")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(report, json.load(f), args.threshold)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print_report(report, regressions)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Local Shippo stand-in
+Serves POST /shipments (rates) and POST /transactions (labels) with
+configurable latency, error rate and rate payloads
+
+Run standalone (from backend/):
+    python -m bench.fake_shippo --port 8765 --latency-ms 300 --error-rate 0.05
+then point the backend at it:
+    SHIPPO_API_URL=http://127.0.0.1:8765 SHIPPO_API_KEY=test
+"""
+
+import json
+import uuid
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+DEFAULT_RATES = [
+    {"provider": "India Post", "servicelevel": {"name": "Speed Post", "token": "indiapost_speed"}, "amount": "180.00", "currency": "INR", "estimated_days": 4},
+    {"provider": "Delhivery", "servicelevel": {"name": "Surface", "token": "delhivery_surface"}, "amount": "140.00", "currency": "INR", "estimated_days": 6},
+    {"provider": "Blue Dart", "servicelevel": {"name": "Express", "token": "bluedart_express"}, "amount": "320.00", "currency": "INR", "estimated_days": 2}
+]
+
+@dataclass
+class FakeShippoConfig:
+    latency_ms: float = 200.0
+    jitter_ms: float = 50.0
+    error_rate: float = 0.0  # share of requests answered with 503
+    timeout_rate: float = 0.0  # share of requests that never answer in time
+    timeout_ms: float = 30000.0
+    rates: List[Dict] = field(default_factory=lambda: [dict(rate) for rate in DEFAULT_RATES])
+
+class FakeShippo:
+    """
+    aiohttp app mimicking the Shippo endpoints used by shipping_service
+    """
+
+    def __init__(self, config: Optional[FakeShippoConfig] = None):
+        self.config = config or FakeShippoConfig()
+        self.requests = 0
+        self.errors = 0
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_post("/shipments", self.create_shipment)
+        self.app.router.add_post("/transactions", self.create_transaction)
+
+    async def _simulate_provider(self) -> Optional[web.Response]:
+        self.requests += 1
+        roll = random.random()
+        if roll < self.config.timeout_rate:
+            await asyncio.sleep(self.config.timeout_ms / 1000)
+        else:
+            latency = max(0.0, random.gauss(self.config.latency_ms, self.config.jitter_ms))
+            await asyncio.sleep(latency / 1000)
+        if roll >= 1 - self.config.error_rate:
+            self.errors += 1
+            return web.json_response({"detail": "Service unavailable"}, status=503)
+        return None
+
+    async def create_shipment(self, request: web.Request) -> web.Response:
+        error = await self._simulate_provider()
+        if error:
+            return error
+
+        payload = await request.json()
+        weight = float(payload.get("parcels", [{}])[0].get("weight", 1))
+        rates = []
+        for rate in self.config.rates:
+            rates.append({
+                **rate,
+                "object_id": f"rate_{uuid.uuid4().hex[:16]}",
+                "amount": f"{float(rate['amount']) * max(weight, 0.5):.2f}"
+            })
+        return web.json_response({
+            "object_id": f"shp_{uuid.uuid4().hex[:16]}",
+            "status": "SUCCESS",
+            "rates": rates
+        }, status=201)
+
+    async def create_transaction(self, request: web.Request) -> web.Response:
+        error = await self._simulate_provider()
+        if error:
+            return error
+
+        payload = await request.json()
+        tracking_number = f"FAKE{uuid.uuid4().hex[:12].upper()}"
+        return web.json_response({
+            "object_id": f"txn_{uuid.uuid4().hex[:16]}",
+            "status": "SUCCESS",
+            "rate": payload.get("rate"),
+            "tracking_number": tracking_number,
+            "label_url": f"https://labels.invalid/{tracking_number}.pdf",
+            "messages": []
+        }, status=201)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Start serving in the current event loop, returns the base URL
+        """
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{bound_port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--rates-file", help="JSON list of Shippo rate objects to serve")
+
+def config_from_args(args: argparse.Namespace) -> FakeShippoConfig:
+    config = FakeShippoConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate
+    )
+    if args.rates_file:
+        with open(args.rates_file) as f:
+            config.rates = json.load(f)
+    return config
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Shippo stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    fake = FakeShippo(config_from_args(args))
+    web.run_app(fake.app, host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+JSON response benchmark
+Times serializing list-endpoint payloads (seeded orders and products) the
+way FastAPI did before, with ISO string dates parsed per document and
+encoded through jsonable_encoder and JSONResponse, against
+fast_json.MongoJSONResponse on the same documents with BSON dates, and
+checks both produce the same JSON
+
+Run from backend/:
+    python -m bench.json_benchmark --docs 1000 --repeat 50
+"""
+
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from bench.shipping_benchmark import percentile
+from bench.seed_data import SeedConfig, order_docs, product_doc
+from fast_json import MongoJSONResponse
+
+ORDER_DATE_FIELDS = ("created_at", "scheduled_delivery")
+PRODUCT_DATE_FIELDS = ("created_at",)
+
+# ============= PAYLOADS =============
+
+def orders_payload(config: SeedConfig, count: int) -> List[Dict]:
+    return [order_docs(config, i)[0] for i in range(count)]
+
+def products_payload(config: SeedConfig, count: int) -> List[Dict]:
+    return [
+        product_doc(config, i // config.products_per_shop, i % config.products_per_shop)
+        for i in range(count)
+    ]
+
+def legacy_payload(docs: List[Dict]) -> List[Dict]:
+    """
+    The documents as stored before the date migration, dates as ISO strings
+    """
+    return [
+        {key: value.isoformat() if isinstance(value, datetime) else value for key, value in doc.items()}
+        for doc in docs
+    ]
+
+# ============= SERIALIZERS =============
+
+def encoder_path(docs: List[Dict], date_fields) -> bytes:
+    """
+    What the list endpoints did: parse dates in Python, then FastAPI's encoding
+    """
+    docs = [dict(doc) for doc in docs]
+    for doc in docs:
+        for field in date_fields:
+            if doc.get(field) and isinstance(doc[field], str):
+                doc[field] = datetime.fromisoformat(doc[field])
+    return JSONResponse(content=jsonable_encoder(docs)).body
+
+def fast_path(docs: List[Dict], date_fields) -> bytes:
+    return MongoJSONResponse(docs).body
+
+def time_serializer(serialize: Callable, docs: List[Dict], date_fields, repeat: int) -> Dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = serialize(docs, date_fields)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "bytes": len(body)
+    }
+
+# ============= RUNNER =============
+
+def run_benchmark(args: argparse.Namespace) -> Dict:
+    config = SeedConfig(seed=args.seed, products_per_shop=max(args.docs, 1))
+    payloads = {
+        "orders": (orders_payload(config, args.docs), ORDER_DATE_FIELDS),
+        "products": (products_payload(config, args.docs), PRODUCT_DATE_FIELDS)
+    }
+
+    results = {}
+    for name, (docs, date_fields) in payloads.items():
+        legacy = legacy_payload(docs)
+        if json.loads(encoder_path(legacy, date_fields)) != json.loads(fast_path(docs, date_fields)):
+            sys.exit(f"{name}: fast path output differs from the encoder path")
+        for _ in range(args.warmup):
+            encoder_path(legacy, date_fields)
+            fast_path(docs, date_fields)
+        encoder = time_serializer(encoder_path, legacy, date_fields, args.repeat)
+        fast = time_serializer(fast_path, docs, date_fields, args.repeat)
+        results[name] = {
+            "encoder": encoder,
+            "fast": fast,
+            "speedup": round(encoder["p50_ms"] / fast["p50_ms"], 1) if fast["p50_ms"] else None
+        }
+    return results
+
+def print_report(results: Dict, docs: int) -> None:
+    print(f"{docs} documents per response")
+    print(f"  {'payload':<10} {'encoder p50':>12} {'fast p50':>10} {'encoder p95':>12} {'fast p95':>10} {'speedup':>8}")
+    for name, result in results.items():
+        print(
+            f"  {name:<10} {result['encoder']['p50_ms']:>10}ms {result['fast']['p50_ms']:>8}ms "
+            f"{result['encoder']['p95_ms']:>10}ms {result['fast']['p95_ms']:>8}ms {result['speedup']:>7}x"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare list response serialization paths")
+    parser.add_argument("--docs", type=int, default=1000, help="documents per response")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print_report(run_benchmark(args), args.docs)
+
+if __name__ == "__main__":
+    sys.exit(main())
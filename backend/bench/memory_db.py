@@ -0,0 +1,265 @@
+"""
+In-memory MongoDB stand-in
+Just enough of motor's collection API for the benchmarks and the offline
+tests to drive the services without a database: inserts, finds, updates,
+find_one_and_update and bulk_write, with the query operators the services
+use ($or, $in, $nin, $exists, $ne, $regex, $lt/$lte/$gt/$gte) and the update
+operators ($set, $setOnInsert, $inc, $push with $each/$sort/$slice).
+Unique keys are enforced per collection when declared.
+"""
+
+import re
+import copy
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from pymongo import DeleteOne, ReturnDocument, UpdateMany
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_MISSING = object()
+
+class Result:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+# ============= QUERIES =============
+
+def _compare(value: Any, operator: str, operand: Any) -> bool:
+    if operator == "$in":
+        return value in operand
+    if operator == "$nin":
+        return value not in operand
+    if operator == "$ne":
+        return value != operand
+    if operator == "$exists":
+        return (value is not _MISSING) == bool(operand)
+    if operator == "$regex":
+        return isinstance(value, str) and re.search(operand, value) is not None
+    # Range operators only match values of a comparable type, as in MongoDB
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if operator == "$lt":
+            return value < operand
+        if operator == "$lte":
+            return value <= operand
+        if operator == "$gt":
+            return value > operand
+        if operator == "$gte":
+            return value >= operand
+    except TypeError:
+        return False
+    raise NotImplementedError(f"Query operator {operator} not supported")
+
+def matches(doc: Dict, query: Dict) -> bool:
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+            continue
+        if field == "$and":
+            if not all(matches(doc, branch) for branch in condition):
+                return False
+            continue
+        value = doc.get(field, _MISSING)
+        if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+            if not all(_compare(value, operator, operand) for operator, operand in condition.items()):
+                return False
+        elif (None if value is _MISSING else value) != condition:
+            return False
+    return True
+
+def apply_update(doc: Dict, update: Dict, inserting: bool = False) -> None:
+    for field, value in update.get("$set", {}).items():
+        doc[field] = copy.deepcopy(value)
+    if inserting:
+        for field, value in update.get("$setOnInsert", {}).items():
+            doc[field] = copy.deepcopy(value)
+    for field, amount in update.get("$inc", {}).items():
+        doc[field] = doc.get(field, 0) + amount
+    for field, spec in update.get("$push", {}).items():
+        items = doc.setdefault(field, [])
+        if isinstance(spec, dict) and "$each" in spec:
+            items.extend(copy.deepcopy(spec["$each"]))
+            for sort_field, direction in reversed(list(spec.get("$sort", {}).items())):
+                items.sort(key=lambda item: item.get(sort_field), reverse=direction < 0)
+            if "$slice" in spec:
+                del items[spec["$slice"]:]
+        else:
+            items.append(copy.deepcopy(spec))
+
+def _sort_docs(docs: List[Dict], sort: Iterable[Tuple[str, int]]) -> None:
+    for field, direction in reversed(list(sort)):
+        docs.sort(key=lambda doc: (doc.get(field) is not None, doc.get(field)), reverse=direction < 0)
+
+def _project(doc: Dict, projection: Optional[Dict]) -> Dict:
+    doc = copy.deepcopy(doc)
+    if projection and projection.get("_id") == 0:
+        doc.pop("_id", None)
+    return doc
+
+# ============= COLLECTIONS =============
+
+class MemoryCursor:
+    def __init__(self, docs: List[Dict]):
+        self.docs = docs
+        self._limit = 0
+
+    def sort(self, key: Union[str, List[Tuple[str, int]]], direction: int = 1) -> "MemoryCursor":
+        _sort_docs(self.docs, [(key, direction)] if isinstance(key, str) else key)
+        return self
+
+    def limit(self, count: int) -> "MemoryCursor":
+        self._limit = count
+        return self
+
+    def _results(self) -> List[Dict]:
+        return self.docs[:self._limit] if self._limit else self.docs
+
+    async def to_list(self, length: Optional[int]) -> List[Dict]:
+        results = self._results()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        self._iter = iter(self._results())
+        return self
+
+    async def __anext__(self) -> Dict:
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+class MemoryCollection:
+    def __init__(self, name: str = "", unique: Optional[str] = None):
+        self.name = name
+        self.docs: List[Dict] = []
+        self.unique = unique
+        self._next_id = 1
+
+    def _check_unique(self, doc: Dict) -> None:
+        if self.unique and doc.get(self.unique) is not None and any(
+            existing.get(self.unique) == doc[self.unique] for existing in self.docs
+        ):
+            raise DuplicateKeyError(f"E11000 duplicate key {self.unique}: {doc[self.unique]!r}")
+
+    def _store(self, doc: Dict) -> Any:
+        self._check_unique(doc)
+        # Like motor, the caller's document gets its _id
+        doc.setdefault("_id", self._next_id)
+        self._next_id += 1
+        self.docs.append(copy.deepcopy(doc))
+        return doc["_id"]
+
+    def _upsert(self, query: Dict, update: Dict) -> Any:
+        doc = {field: value for field, value in query.items() if not field.startswith("$") and not isinstance(value, dict)}
+        apply_update(doc, update, inserting=True)
+        return self._store(doc)
+
+    async def insert_one(self, doc: Dict) -> Result:
+        return Result(inserted_id=self._store(doc))
+
+    async def insert_many(self, docs: List[Dict], ordered: bool = True) -> Result:
+        inserted, errors = [], []
+        for index, doc in enumerate(docs):
+            try:
+                inserted.append(self._store(doc))
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+        return Result(inserted_ids=inserted)
+
+    def find(self, query: Optional[Dict] = None, projection: Optional[Dict] = None) -> MemoryCursor:
+        return MemoryCursor([_project(doc, projection) for doc in self.docs if matches(doc, query or {})])
+
+    async def find_one(self, query: Optional[Dict] = None, projection: Optional[Dict] = None, sort=None) -> Optional[Dict]:
+        docs = [doc for doc in self.docs if matches(doc, query or {})]
+        _sort_docs(docs, sort or [])
+        return _project(docs[0], projection) if docs else None
+
+    async def count_documents(self, query: Dict) -> int:
+        return sum(1 for doc in self.docs if matches(doc, query))
+
+    async def update_one(self, query: Dict, update: Dict, upsert: bool = False) -> Result:
+        for doc in self.docs:
+            if matches(doc, query):
+                apply_update(doc, update)
+                return Result(matched_count=1, modified_count=1, upserted_id=None)
+        upserted_id = self._upsert(query, update) if upsert else None
+        return Result(matched_count=0, modified_count=0, upserted_id=upserted_id)
+
+    async def update_many(self, query: Dict, update: Dict, upsert: bool = False) -> Result:
+        matched = [doc for doc in self.docs if matches(doc, query)]
+        for doc in matched:
+            apply_update(doc, update)
+        upserted_id = self._upsert(query, update) if upsert and not matched else None
+        return Result(matched_count=len(matched), modified_count=len(matched), upserted_id=upserted_id)
+
+    async def find_one_and_update(
+        self,
+        query: Dict,
+        update: Dict,
+        sort=None,
+        projection: Optional[Dict] = None,
+        return_document=ReturnDocument.BEFORE,
+        upsert: bool = False
+    ) -> Optional[Dict]:
+        candidates = [doc for doc in self.docs if matches(doc, query)]
+        _sort_docs(candidates, sort or [])
+        if not candidates:
+            if upsert:
+                self._upsert(query, update)
+                if return_document == ReturnDocument.AFTER:
+                    return _project(self.docs[-1], projection)
+            return None
+        doc = candidates[0]
+        before = _project(doc, projection)
+        apply_update(doc, update)
+        return _project(doc, projection) if return_document == ReturnDocument.AFTER else before
+
+    async def delete_many(self, query: Dict) -> Result:
+        kept = [doc for doc in self.docs if not matches(doc, query)]
+        deleted = len(self.docs) - len(kept)
+        self.docs = kept
+        return Result(deleted_count=deleted)
+
+    async def bulk_write(self, operations: List, ordered: bool = True) -> Result:
+        matched = modified = deleted = 0
+        for operation in operations:
+            # pymongo's operations keep their arguments on these attributes
+            if isinstance(operation, DeleteOne):
+                for index, doc in enumerate(self.docs):
+                    if matches(doc, operation._filter):
+                        del self.docs[index]
+                        deleted += 1
+                        break
+                continue
+            method = self.update_many if isinstance(operation, UpdateMany) else self.update_one
+            result = await method(operation._filter, operation._doc, upsert=bool(operation._upsert))
+            matched += result.matched_count
+            modified += result.modified_count
+        return Result(matched_count=matched, modified_count=modified, deleted_count=deleted)
+
+    async def create_index(self, keys, **kwargs) -> str:
+        return str(keys)
+
+class MemoryDB:
+    """
+    Collections are created on first access; `unique` maps collection -> unique key field
+    """
+
+    def __init__(self, unique: Optional[Dict[str, str]] = None):
+        self._unique = unique or {}
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name, unique=self._unique.get(name))
+        return self._collections[name]
@@ -0,0 +1,441 @@
+"""
+Synthetic marketplace data
+Generates users, sessions, shops, products, QR codes, orders, shipments and
+tracking events shaped like the documents server.py and shipping_service.py
+write, at any scale, with parallel insert_many batches.
+
+Every document is derived from (seed, kind, index) alone, so the same seed
+gives the same data whatever the batch size or parallelism, and benchmarks
+can rebuild ids and tokens without reading the database back.
+
+Run from backend/:
+    python -m bench.seed_data --drop --orders 1000000 --buyers 100000 --shops 500
+Every user can log in with --password; each has a session token
+`session_seed_<user_id>` usable as a Bearer token.
+"""
+
+import sys
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timezone, timedelta
+
+# ============= CONFIGURATION =============
+
+@dataclass
+class SeedConfig:
+    seed: int = 42
+    buyers: int = 1000
+    shops: int = 20
+    products_per_shop: int = 50
+    orders: int = 10000
+    # Share of orders that are deliveries, and of those that already have a shipment
+    delivery_share: float = 0.7
+    shipped_share: float = 0.6
+    max_events_per_shipment: int = 5
+    # Orders are spread over this many days before reference_date
+    days: int = 365
+    reference_date: datetime = field(
+        default_factory=lambda: datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    )
+    password: str = "seed-password"
+    batch_size: int = 5000
+    parallelism: int = 4
+
+SEEDED_COLLECTIONS = [
+    "users", "user_sessions", "shops", "products", "qr_codes",
+    "orders", "shipments", "tracking_events"
+]
+
+CITIES = [
+    ("Jaipur", "302001", "IN"), ("Mumbai", "400001", "IN"), ("Delhi", "110001", "IN"),
+    ("Leh", "194101", "IN"), ("Port Blair", "744101", "IN"), ("Kyoto", "600-8216", "JP"),
+    ("Tokyo", "100-0001", "JP"), ("New York", "10001", "US"), ("London", "SW1A 1AA", "GB"),
+    ("Berlin", "10115", "DE"), ("Paris", "75001", "FR"), ("Sydney", "2000", "AU")
+]
+
+PRODUCT_KINDS = [
+    ("Block-print scarf", 0.2), ("Brass lamp", 1.8), ("Ceramic bowl", 0.9), ("Spice box", 0.6),
+    ("Hand-woven rug", 3.5), ("Tea set", 1.4), ("Silver earrings", 0.1), ("Wooden elephant", 1.1),
+    ("Leather journal", 0.4), ("Marble coaster set", 1.0)
+]
+
+DELIVERY_REASONS = ["travel_light", "fragile_item", "gift", "weight_limit", None]
+CARRIERS = ["India Post", "Delhivery", "Blue Dart", "Japan Post", "DHL"]
+TRACKING_PROGRESS = ["label_created", "in_transit", "in_transit", "out_for_delivery", "delivered"]
+
+def _rng(config: SeedConfig, kind: str, index: int) -> random.Random:
+    return random.Random(f"{config.seed}:{kind}:{index}")
+
+def _hex_id(config: SeedConfig, kind: str, index: int, length: int = 12) -> str:
+    return hashlib.sha1(f"{config.seed}:{kind}:{index}".encode("utf-8")).hexdigest()[:length]
+
+def _address(rng: random.Random) -> Dict[str, str]:
+    city, postal_code, country = rng.choice(CITIES)
+    return {"street": f"{rng.randint(1, 999)} Seed Street", "city": city, "postal_code": postal_code, "country": country}
+
+# ============= DOCUMENT FACTORIES =============
+
+def buyer_id(config: SeedConfig, index: int) -> str:
+    return f"user_{_hex_id(config, 'buyer', index)}"
+
+def seller_id(config: SeedConfig, shop_index: int) -> str:
+    return f"user_{_hex_id(config, 'seller', shop_index)}"
+
+def shop_id(config: SeedConfig, shop_index: int) -> str:
+    return f"shop_{_hex_id(config, 'shop', shop_index)}"
+
+def buyer_email(index: int) -> str:
+    return f"buyer{index}@seed.relocal"
+
+def session_token(user_id: str) -> str:
+    return f"session_seed_{user_id}"
+
+def buyer_doc(config: SeedConfig, index: int, password_hash: str) -> Dict:
+    rng = _rng(config, "buyer", index)
+    created = config.reference_date - timedelta(days=config.days + rng.randint(0, 365))
+    return {
+        "user_id": buyer_id(config, index),
+        "email": buyer_email(index),
+        "name": f"Seed Buyer {index}",
+        "picture": None,
+        "role": "tourist",
+        "addresses": [],
+        "travel_mode": rng.random() < 0.8,
+        "default_delivery_address": _address(rng) if rng.random() < 0.5 else None,
+        "password_hash": password_hash,
+        "created_at": created
+    }
+
+def seller_doc(config: SeedConfig, shop_index: int, password_hash: str) -> Dict:
+    created = config.reference_date - timedelta(days=config.days + 30)
+    return {
+        "user_id": seller_id(config, shop_index),
+        "email": f"seller{shop_index}@seed.relocal",
+        "name": f"Seed Seller {shop_index}",
+        "picture": None,
+        "role": "shopkeeper",
+        "addresses": [],
+        "travel_mode": False,
+        "default_delivery_address": None,
+        "password_hash": password_hash,
+        "created_at": created
+    }
+
+def session_doc(config: SeedConfig, user_id: str) -> Dict:
+    return {
+        "user_id": user_id,
+        "session_token": session_token(user_id),
+        "expires_at": config.reference_date + timedelta(days=3650),
+        "created_at": config.reference_date
+    }
+
+def shop_doc(config: SeedConfig, shop_index: int) -> Dict:
+    rng = _rng(config, "shop", shop_index)
+    city, postal_code, country = rng.choice(CITIES[:7])
+    return {
+        "shop_id": shop_id(config, shop_index),
+        "owner_id": seller_id(config, shop_index),
+        "name": f"Seed Crafts {shop_index}",
+        "description": "Generated shop",
+        "location": {"street": f"{rng.randint(1, 99)} Market Rd", "city": city, "postal_code": postal_code, "country": country},
+        "categories": ["crafts"],
+        "verified": rng.random() < 0.9,
+        "payout_setup": True,
+        "created_at": config.reference_date - timedelta(days=config.days + 30)
+    }
+
+def product_doc(config: SeedConfig, shop_index: int, product_index: int) -> Dict:
+    index = shop_index * config.products_per_shop + product_index
+    rng = _rng(config, "product", index)
+    kind, weight = rng.choice(PRODUCT_KINDS)
+    return {
+        "product_id": f"product_{_hex_id(config, 'product', index)}",
+        "shop_id": shop_id(config, shop_index),
+        "name": f"{kind} #{product_index}",
+        "description": f"Generated {kind.lower()}",
+        "price": round(rng.uniform(5, 250), 2),
+        "currency": "usd",
+        "images": [],
+        "qr_code_id": f"qr_{_hex_id(config, 'qr', index)}",
+        "verified": rng.random() < 0.9,
+        "authenticity_badge": rng.random() < 0.3,
+        "estimated_weight_kg": round(weight * rng.uniform(0.7, 1.3), 2),
+        "is_fragile": kind in ("Ceramic bowl", "Tea set", "Marble coaster set"),
+        "is_liquid": False,
+        "created_at": config.reference_date - timedelta(days=config.days + 7)
+    }
+
+def qr_code_doc(config: SeedConfig, shop_index: int, product_index: int) -> Dict:
+    product = product_doc(config, shop_index, product_index)
+    rng = _rng(config, "qr", shop_index * config.products_per_shop + product_index)
+    scans = int(rng.paretovariate(1.5)) - 1
+    return {
+        "qr_code_id": product["qr_code_id"],
+        "product_id": product["product_id"],
+        "scans_count": scans,
+        "last_scanned": config.reference_date - timedelta(hours=rng.randint(1, 24 * 30)) if scans else None,
+        "analytics": {},
+        "created_at": product["created_at"]
+    }
+
+def order_docs(config: SeedConfig, index: int) -> Tuple[Dict, Optional[Dict], List[Dict]]:
+    """
+    One order with, when shipped, its shipment and tracking events
+    """
+    rng = _rng(config, "order", index)
+    # Skewed so a few shops and buyers carry most orders, as in production
+    shop_index = int(config.shops * rng.random() ** 2)
+    buyer_index = int(config.buyers * rng.random() ** 1.5)
+    shop = shop_doc(config, shop_index)
+    created = config.reference_date - timedelta(seconds=rng.randint(0, config.days * 86400))
+
+    items = []
+    for _ in range(rng.choice([1, 1, 1, 2, 2, 3])):
+        product = product_doc(config, shop_index, rng.randrange(config.products_per_shop))
+        items.append({
+            "product_id": product["product_id"],
+            "product_name": product["name"],
+            "quantity": rng.choice([1, 1, 1, 2]),
+            "price": product["price"],
+            "weight_kg": product["estimated_weight_kg"]
+        })
+    total = round(sum(item["price"] * item["quantity"] for item in items), 2)
+    total_weight = round(sum(item["weight_kg"] * item["quantity"] for item in items), 2)
+
+    is_delivery = rng.random() < config.delivery_share
+    ship_after_trip = is_delivery and rng.random() < 0.3
+    trip_end = created + timedelta(days=rng.randint(2, 21)) if ship_after_trip else None
+    order_id = f"order_{_hex_id(config, 'order', index)}"
+
+    order = {
+        "order_id": order_id,
+        "buyer_id": buyer_id(config, buyer_index),
+        "shop_id": shop["shop_id"],
+        "shop_name": shop["name"],
+        "items": items,
+        "total": total,
+        "currency": "usd",
+        "delivery_type": "delivery" if is_delivery else "pickup",
+        "status": "confirmed" if rng.random() < 0.85 else "pending",
+        "delivery_address": _address(rng) if is_delivery else None,
+        "tracking_id": None,
+        "gift_message": "Enjoy!" if rng.random() < 0.05 else None,
+        "scheduled_delivery": None,
+        "ship_after_trip": ship_after_trip,
+        "trip_end_date": trip_end,
+        "total_weight_kg": total_weight,
+        "delivery_preference_reason": rng.choice(DELIVERY_REASONS) if is_delivery else "immediate_pickup",
+        "is_tourist_delivery": is_delivery,
+        "created_at": created
+    }
+
+    if not (is_delivery and order["status"] == "confirmed" and rng.random() < config.shipped_share):
+        return order, None, []
+
+    shipment_id = f"ship_{created.strftime('%Y%m%d')}_{order_id[-8:]}"
+    tracking_number = f"SEED{_hex_id(config, 'tracking', index, 12).upper()}"
+    from_address = {**shop["location"], "name": shop["name"]}
+    to_address = {**order["delivery_address"], "name": "Customer"}
+    is_international = from_address["country"] != to_address["country"]
+    estimated_cost = round(100 + 50 * total_weight * (3 if is_international else 1), 2)
+
+    event_count = rng.randint(1, config.max_events_per_shipment)
+    events = []
+    occurred = created + timedelta(hours=rng.randint(2, 48))
+    for step in range(event_count):
+        status = TRACKING_PROGRESS[min(step, len(TRACKING_PROGRESS) - 1)]
+        events.append({
+            "event_id": f"evt_{_hex_id(config, f'event{step}', index, 24)}",
+            "shipment_id": shipment_id,
+            "status": status,
+            "status_details": f"Seeded {status.replace('_', ' ')}",
+            "location": f"{to_address['city']}, {to_address['country']}",
+            "occurred_at": occurred.isoformat(),
+            "carrier_status_code": status[:2].upper(),
+            "created_at": occurred.isoformat()
+        })
+        occurred += timedelta(hours=rng.randint(6, 72))
+
+    latest = events[-1]
+    shipment_status = {"delivered": "delivered", "label_created": "label_created"}.get(latest["status"], "in_transit")
+    embedded = [
+        {key: event[key] for key in ("event_id", "status", "status_details", "location", "occurred_at", "carrier_status_code")}
+        for event in reversed(events)
+    ]
+    shipment = {
+        "shipment_id": shipment_id,
+        "order_id": order_id,
+        "order_ids": [order_id],
+        "courier_provider": rng.choice(CARRIERS),
+        "rate_id": None,
+        "tracking_number": tracking_number,
+        "label_url": f"https://labels.invalid/{tracking_number}.pdf",
+        "label_status": "created",
+        "from_address": from_address,
+        "to_address": to_address,
+        "weight_kg": total_weight,
+        "estimated_cost": estimated_cost,
+        "final_cost": None,
+        "currency": "INR",
+        "service_level": "standard",
+        "status": shipment_status,
+        "carrier_tracking_status": latest["status"],
+        "customs_info": None,
+        "ship_date": None,
+        "estimated_delivery": None,
+        "actual_delivery": latest["occurred_at"] if shipment_status == "delivered" else None,
+        "last_event_at": latest["occurred_at"],
+        "latest_event": embedded[0],
+        "recent_events": embedded,
+        "metadata": {
+            "is_international": is_international,
+            "is_remote_area": False,
+            "delivery_days_min": 7 if is_international else 2,
+            "delivery_days_max": 14 if is_international else 5
+        },
+        "created_at": created.isoformat()
+    }
+
+    order["shipment_id"] = shipment_id
+    order["tracking_id"] = tracking_number
+    order["status"] = "delivered" if shipment_status == "delivered" else "shipped"
+    return order, shipment, events
+
+# ============= WRITER =============
+
+class BatchWriter:
+    """
+    Runs insert_many batches with at most `parallelism` in flight
+    Generation waits for a free slot, so memory stays at a few batches
+    """
+
+    def __init__(self, db, parallelism: int):
+        self.db = db
+        self._slots = asyncio.Semaphore(parallelism)
+        self._tasks: List[asyncio.Task] = []
+        self.counts: Dict[str, int] = {}
+
+    async def submit(self, collection: str, docs: List[Dict]) -> None:
+        if not docs:
+            return
+        await self._slots.acquire()
+        self._tasks.append(asyncio.create_task(self._insert(collection, docs)))
+
+    async def _insert(self, collection: str, docs: List[Dict]) -> None:
+        try:
+            await self.db[collection].insert_many(docs, ordered=False)
+            self.counts[collection] = self.counts.get(collection, 0) + len(docs)
+        finally:
+            self._slots.release()
+
+    async def drain(self) -> None:
+        # Surfaces the first insert error
+        await asyncio.gather(*self._tasks)
+        self._tasks = []
+
+def _chunks(start: int, stop: int, size: int) -> Iterable[range]:
+    for begin in range(start, stop, size):
+        yield range(begin, min(begin + size, stop))
+
+async def seed_database(db, config: SeedConfig, drop: bool = False) -> Dict[str, int]:
+    """
+    Write the whole dataset, returns documents written per collection
+    """
+    import bcrypt
+
+    if drop:
+        for collection in SEEDED_COLLECTIONS:
+            await db[collection].drop()
+
+    # One hash for everyone: bcrypt is deliberately slow
+    password_hash = bcrypt.hashpw(config.password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    writer = BatchWriter(db, config.parallelism)
+
+    sellers = [seller_doc(config, s, password_hash) for s in range(config.shops)]
+    await writer.submit("users", sellers)
+    await writer.submit("user_sessions", [session_doc(config, user["user_id"]) for user in sellers])
+    await writer.submit("shops", [shop_doc(config, s) for s in range(config.shops)])
+
+    for chunk in _chunks(0, config.buyers, config.batch_size):
+        buyers = [buyer_doc(config, i, password_hash) for i in chunk]
+        await writer.submit("users", buyers)
+        await writer.submit("user_sessions", [session_doc(config, user["user_id"]) for user in buyers])
+
+    product_refs = [(s, p) for s in range(config.shops) for p in range(config.products_per_shop)]
+    for begin in range(0, len(product_refs), config.batch_size):
+        refs = product_refs[begin:begin + config.batch_size]
+        await writer.submit("products", [product_doc(config, s, p) for s, p in refs])
+        await writer.submit("qr_codes", [qr_code_doc(config, s, p) for s, p in refs])
+
+    for chunk in _chunks(0, config.orders, config.batch_size):
+        orders, shipments, events = [], [], []
+        for i in chunk:
+            order, shipment, tracking = order_docs(config, i)
+            orders.append(order)
+            if shipment:
+                shipments.append(shipment)
+                events.extend(tracking)
+        await writer.submit("orders", orders)
+        await writer.submit("shipments", shipments)
+        await writer.submit("tracking_events", events)
+
+    await writer.drain()
+    return writer.counts
+
+# ============= CLI =============
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a database with synthetic ReLocal data")
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="relocal_seed")
+    parser.add_argument("--drop", action="store_true", help="drop the seeded collections first")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--buyers", type=int, default=1000)
+    parser.add_argument("--shops", type=int, default=20)
+    parser.add_argument("--products-per-shop", type=int, default=50)
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--reference-date", help="YYYY-MM-DD the order history ends on (default: today)")
+    parser.add_argument("--password", default="seed-password")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--parallelism", type=int, default=4)
+    args = parser.parse_args()
+
+    config = SeedConfig(
+        seed=args.seed,
+        buyers=args.buyers,
+        shops=args.shops,
+        products_per_shop=args.products_per_shop,
+        orders=args.orders,
+        days=args.days,
+        password=args.password,
+        batch_size=args.batch_size,
+        parallelism=args.parallelism
+    )
+    if args.reference_date:
+        config.reference_date = datetime.strptime(args.reference_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+    async def run() -> Dict[str, int]:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(args.mongo_url)
+        try:
+            return await seed_database(client[args.db_name], config, drop=args.drop)
+        finally:
+            client.close()
+
+    started = time.perf_counter()
+    counts = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+
+    total = sum(counts.values())
+    for collection in SEEDED_COLLECTIONS:
+        print(f"  {collection:<16} {counts.get(collection, 0):>12}")
+    print(f"  {'total':<16} {total:>12} in {elapsed:.1f}s ({total / elapsed:.0f} docs/s)")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Shipping pipeline benchmark
+Drives ShippingEstimator and ShipmentService against the local Shippo
+stand-in at controlled concurrency and reports throughput and latency
+percentiles, so fallback, caching and pooling can be measured offline
+
+Run from backend/:
+    python -m bench.shipping_benchmark --requests 2000 --concurrency 50 \\
+        --latency-ms 400 --error-rate 0.2 --routes 50
+Add --mongo-url to use a real MongoDB instead of the in-memory collections.
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+from typing import Dict, List
+
+from bench.fake_shippo import FakeShippo, add_config_arguments, config_from_args
+from bench.memory_db import MemoryDB
+
+# ============= WORKLOAD =============
+
+ORIGIN = {"name": "Bench Shop", "street": "1 Market Rd", "city": "Jaipur", "postal_code": "302001", "country": "IN"}
+
+DESTINATIONS = [
+    ("Mumbai", "400001", "IN"), ("Delhi", "110001", "IN"), ("Leh", "194101", "IN"),
+    ("Port Blair", "744101", "IN"), ("Tokyo", "100-0001", "JP"), ("New York", "10001", "US"),
+    ("London", "SW1A 1AA", "GB"), ("Berlin", "10115", "DE")
+]
+
+def make_routes(count: int) -> List[Dict]:
+    routes = []
+    for i in range(count):
+        city, postal_code, country = DESTINATIONS[i % len(DESTINATIONS)]
+        routes.append({
+            "to_address": {
+                "street": f"{i + 1} Bench Street",
+                "city": city,
+                "postal_code": postal_code,
+                "country": country
+            },
+            "weight_kg": round(0.5 + (i % 10) * 0.5, 1)
+        })
+    return routes
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+async def run_benchmark(args: argparse.Namespace) -> Dict:
+    fake = FakeShippo(config_from_args(args))
+    base_url = await fake.start()
+
+    # shipping_service reads its configuration at import time
+    os.environ["SHIPPO_API_URL"] = base_url
+    if args.no_api:
+        os.environ.pop("SHIPPO_API_KEY", None)
+    else:
+        os.environ["SHIPPO_API_KEY"] = "bench"
+    if args.budget is not None:
+        os.environ["SHIPPING_ESTIMATE_BUDGET_SECONDS"] = str(args.budget)
+    import shipping_service
+
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        db = AsyncIOMotorClient(args.mongo_url)[args.db_name]
+    else:
+        db = MemoryDB()
+
+    estimator = shipping_service.ShippingEstimator(db)
+    shipment_service = shipping_service.ShipmentService(db, estimator=estimator)
+    routes = make_routes(args.routes)
+
+    latencies: List[float] = []
+    methods: Counter = Counter()
+    labels = Counter()
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        route = random.choice(routes)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if args.mode == "estimate":
+                    result = await estimator.estimate_shipping(
+                        ORIGIN, route["to_address"], route["weight_kg"], f"order_bench{i:08d}"
+                    )
+                    methods[result["estimation_method"]] += 1
+                else:
+                    result = await shipment_service.create_shipment(
+                        f"order_bench{i:08d}", ORIGIN, dict(route["to_address"]), route["weight_kg"]
+                    )
+                    labels["label" if result.get("tracking_number") else "no_label"] += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    breaker = shipping_service.shippo_client.status()
+    await shipping_service.shippo_client.close()
+    await fake.stop()
+
+    latencies.sort()
+    return {
+        "mode": args.mode,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(args.requests / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(latencies[-1], 2) if latencies else 0.0
+        },
+        "estimation_methods": dict(methods),
+        "labels": dict(labels),
+        "errors": errors,
+        "provider_requests": fake.requests,
+        "provider_errors": fake.errors,
+        "shippo_client": breaker
+    }
+
+def print_report(report: Dict) -> None:
+    latency = report["latency_ms"]
+    print(f"mode={report['mode']} requests={report['requests']} concurrency={report['concurrency']}")
+    print(f"  elapsed      {report['elapsed_seconds']}s")
+    print(f"  throughput   {report['throughput_rps']} req/s")
+    print(f"  latency ms   p50={latency['p50']} p95={latency['p95']} p99={latency['p99']} max={latency['max']}")
+    if report["estimation_methods"]:
+        print(f"  methods      {report['estimation_methods']}")
+    if report["labels"]:
+        print(f"  labels       {report['labels']}")
+    print(f"  errors       {report['errors']}")
+    print(f"  provider     {report['provider_requests']} requests, {report['provider_errors']} errors")
+    print(f"  breaker      {report['shippo_client']['circuit_breaker']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the shipping pipeline against a fake Shippo")
+    parser.add_argument("--mode", choices=["estimate", "shipment"], default="estimate")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--routes", type=int, default=100, help="distinct destinations (fewer = more cache hits)")
+    parser.add_argument("--budget", type=float, help="override SHIPPING_ESTIMATE_BUDGET_SECONDS")
+    parser.add_argument("--no-api", action="store_true", help="rule-based only, no Shippo key")
+    parser.add_argument("--mongo-url", help="use a real MongoDB instead of in-memory collections")
+    parser.add_argument("--db-name", default="relocal_bench")
+    parser.add_argument("--seed", type=int, default=42)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    print_report(asyncio.run(run_benchmark(args)))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+ReLocal Cache Invalidation Bus
+In-process caches of rarely-changing documents (products, shops, users,
+categories, shipping rate rules), kept coherent across workers and pods by
+tailing a MongoDB change stream: every write, from any process, evicts the
+matching keys in every worker. State that is rebuilt rather than evicted
+(the remote-area index) subscribes with a callback instead.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# ============= CONFIGURATION =============
+
+CACHE_INVALIDATION_ENABLED = os.environ.get('CACHE_INVALIDATION_ENABLED', 'true').lower() == 'true'
+# Safety net: entries expire even if an invalidation is somehow missed
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', '300'))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '10000'))
+CACHE_BUS_RETRY_SECONDS = 5.0
+
+# Change streams need a replica set or sharded cluster
+CHANGE_STREAMS_UNSUPPORTED = 40573
+# Resume token fell off the oplog or is no longer valid
+RESUME_TOKEN_LOST = {260, 280, 286}
+
+# ============= LOCAL CACHE =============
+
+class LocalCache:
+    """
+    TTL cache for one collection in one worker
+    Only serves entries while its invalidation bus is connected; otherwise
+    every get() misses and set() is ignored, so a worker never serves an
+    entry it could not have heard about being changed.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float = CACHE_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.active = False
+        # Bumped on every eviction; set() with an older version is dropped so a
+        # read that raced with a write cannot re-cache the old document
+        self.version = 0
+        self._entries: Dict[Any, Tuple[float, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> Optional[Any]:
+        entry = self._entries.get(key) if self.active else None
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Any, value: Any, version: Optional[int] = None) -> None:
+        if not self.active or (version is not None and version != self.version):
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        while len(self._entries) > self.max_entries:
+            # Oldest insertion first
+            self._entries.pop(next(iter(self._entries)))
+
+    def evict(self, key: Any) -> None:
+        self.version += 1
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self.version += 1
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active": self.active, "entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+# ============= INVALIDATION BUS =============
+
+class CacheInvalidationBus:
+    """
+    Tails one change stream over the cached collections and evicts keys
+    Caches register with the collection they mirror and a function giving
+    the cache key of a document; a change whose document can't be keyed
+    (deletes, drops, key=None) clears that collection's caches. Listeners
+    are called with each change on their collection, and with None whenever
+    changes may have been missed (stream opened fresh, resume token lost).
+    The resume token is kept across reconnects, so a dropped stream picks up
+    where it left off; if the token is no longer resumable every cache is
+    cleared and the stream restarts from now.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._caches: Dict[str, List[Tuple[LocalCache, Optional[Callable[[Dict], Any]]]]] = {}
+        self._listeners: Dict[str, List[Callable[[Optional[Dict]], None]]] = {}
+        self._resume_token: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+        self.events = 0
+
+    def register(self, collection: str, cache: LocalCache, key: Optional[Callable[[Dict], Any]] = None) -> LocalCache:
+        self._caches.setdefault(collection, []).append((cache, key))
+        return cache
+
+    def on_change(self, collection: str, callback: Callable[[Optional[Dict]], None]) -> None:
+        """
+        Call `callback` for every change on `collection`; it must not block
+        """
+        self._listeners.setdefault(collection, []).append(callback)
+
+    def start(self) -> None:
+        if self._task is None and (self._caches or self._listeners):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._set_active(False)
+
+    def apply(self, change: Dict) -> None:
+        """
+        Evict whatever a change event touches
+        """
+        collection = change.get("ns", {}).get("coll")
+        document = change.get("fullDocument")
+        self.events += 1
+        for cache, key in self._caches.get(collection, []):
+            if key is None or document is None:
+                cache.clear()
+                continue
+            try:
+                cache.evict(key(document))
+            except Exception:
+                cache.clear()
+        self._notify(collection, change)
+
+    def _notify(self, collection: str, change: Optional[Dict]) -> None:
+        for callback in self._listeners.get(collection, []):
+            try:
+                callback(change)
+            except Exception as e:
+                logger.error(f"Cache invalidation listener on {collection} failed: {e}")
+
+    async def _run(self) -> None:
+        collections = sorted(set(self._caches) | set(self._listeners))
+        pipeline = [{"$match": {"ns.coll": {"$in": collections}}}]
+        while True:
+            try:
+                async with self.db.watch(
+                    pipeline, full_document="updateLookup", resume_after=self._resume_token
+                ) as stream:
+                    if self._resume_token is None:
+                        # Nothing cached before now can be trusted
+                        self._clear_all()
+                    self._set_active(True)
+                    logger.info(f"Cache invalidation stream open on {', '.join(collections)}")
+                    async for change in stream:
+                        if change.get("operationType") == "invalidate":
+                            # The stream can't be resumed past an invalidate
+                            self._resume_token = None
+                            self._clear_all()
+                            break
+                        self.apply(change)
+                        self._resume_token = stream.resume_token
+                self._set_active(False)
+                continue
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                self._set_active(False)
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.warning("MongoDB does not support change streams; in-process caches disabled")
+                    return
+                if e.code in RESUME_TOKEN_LOST:
+                    logger.warning(f"Cache invalidation resume token lost, clearing caches: {e}")
+                    self._resume_token = None
+                    self._clear_all()
+                else:
+                    logger.error(f"Cache invalidation stream failed: {e}")
+            except PyMongoError as e:
+                self._set_active(False)
+                logger.error(f"Cache invalidation stream disconnected: {e}")
+            await asyncio.sleep(CACHE_BUS_RETRY_SECONDS)
+
+    def _set_active(self, active: bool) -> None:
+        for caches in self._caches.values():
+            for cache, _ in caches:
+                cache.active = active
+
+    def _clear_all(self) -> None:
+        for caches in self._caches.values():
+            for cache, _ in caches:
+                cache.clear()
+        for collection in self._listeners:
+            self._notify(collection, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "events": self.events,
+            "caches": {
+                cache.name: cache.stats()
+                for caches in self._caches.values() for cache, _ in caches
+            }
+        }
@@ -0,0 +1,135 @@
+"""
+ReLocal Checkout Service
+Process-wide Stripe checkout client with a short-lived session status cache
+"""
+
+import os
+import time
+import asyncio
+from typing import Dict, Optional, Tuple
+
+from emergentintegrations.payments.stripe.checkout import (
+    StripeCheckout, CheckoutSessionRequest, CheckoutSessionResponse, CheckoutStatusResponse
+)
+
+# ============= CONFIGURATION =============
+
+# Stripe is asked about an open session at most once per interval, however often it is polled
+CHECKOUT_STATUS_CACHE_SECONDS = float(os.environ.get('CHECKOUT_STATUS_CACHE_SECONDS', '5'))
+# Paid sessions do not change again, keep them longer
+CHECKOUT_STATUS_FINAL_CACHE_SECONDS = float(os.environ.get('CHECKOUT_STATUS_FINAL_CACHE_SECONDS', '3600'))
+CHECKOUT_STATUS_CACHE_MAX_ENTRIES = int(os.environ.get('CHECKOUT_STATUS_CACHE_MAX_ENTRIES', '10000'))
+
+# ============= CHECKOUT SERVICE =============
+
+class CheckoutService:
+    """
+    Shares one StripeCheckout per webhook URL across all requests and workers
+    Session statuses are cached per session_id together with the owning
+    user; the Stripe webhook writes paid statuses into the cache so status
+    polls are answered locally, and concurrent polls for the same session
+    share a single Stripe call.
+    """
+
+    def __init__(self, api_key: Optional[str]):
+        self.api_key = api_key
+        self._clients: Dict[str, StripeCheckout] = {}
+        self._status_cache: Dict[str, Tuple[float, str, Dict]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stripe_calls = 0
+        self.cache_hits = 0
+
+    def client(self, webhook_url: str) -> StripeCheckout:
+        stripe_checkout = self._clients.get(webhook_url)
+        if stripe_checkout is None:
+            stripe_checkout = StripeCheckout(api_key=self.api_key, webhook_url=webhook_url)
+            self._clients[webhook_url] = stripe_checkout
+        return stripe_checkout
+
+    async def create_session(self, webhook_url: str, session_req: CheckoutSessionRequest) -> CheckoutSessionResponse:
+        return await self.client(webhook_url).create_checkout_session(session_req)
+
+    async def handle_webhook(self, webhook_url: str, body: bytes, signature: Optional[str]):
+        return await self.client(webhook_url).handle_webhook(body, signature)
+
+    # ============= STATUS CACHE =============
+
+    def cached_status(self, session_id: str, user_id: str) -> Optional[Dict]:
+        entry = self._status_cache.get(session_id)
+        if entry is None:
+            return None
+        expires_at, owner_id, status = entry
+        if expires_at <= time.monotonic():
+            self._status_cache.pop(session_id, None)
+            return None
+        if owner_id != user_id:
+            return None
+        self.cache_hits += 1
+        return status
+
+    def record_status(self, session_id: str, user_id: str, status: Dict) -> None:
+        ttl = CHECKOUT_STATUS_FINAL_CACHE_SECONDS if status.get("payment_status") == "paid" else CHECKOUT_STATUS_CACHE_SECONDS
+        if len(self._status_cache) >= CHECKOUT_STATUS_CACHE_MAX_ENTRIES:
+            self._prune()
+        self._status_cache[session_id] = (time.monotonic() + ttl, user_id, status)
+
+    def invalidate(self, session_id: str) -> None:
+        self._status_cache.pop(session_id, None)
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for session_id in [key for key, (expires_at, _, _) in self._status_cache.items() if expires_at <= now]:
+            del self._status_cache[session_id]
+        # Still full of live entries: drop the ones closest to expiry
+        overflow = len(self._status_cache) - CHECKOUT_STATUS_CACHE_MAX_ENTRIES + 1
+        if overflow > 0:
+            oldest = sorted(self._status_cache.items(), key=lambda item: item[1][0])[:overflow]
+            for session_id, _ in oldest:
+                del self._status_cache[session_id]
+
+    async def get_status(self, webhook_url: str, session_id: str, user_id: str) -> Dict:
+        """
+        Session status from the cache, or from Stripe at most once per interval
+        """
+
+        cached = self.cached_status(session_id, user_id)
+        if cached is not None:
+            return cached
+
+        inflight = self._inflight.get(session_id)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[session_id] = future
+        try:
+            self.stripe_calls += 1
+            checkout_status: CheckoutStatusResponse = await self.client(webhook_url).get_checkout_status(session_id)
+            status = {
+                "status": checkout_status.status,
+                "payment_status": checkout_status.payment_status,
+                "amount_total": checkout_status.amount_total,
+                "currency": checkout_status.currency
+            }
+            self.record_status(session_id, user_id, status)
+            future.set_result(status)
+            return status
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters receive the error; retrieve it so an unawaited future does not log it
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(session_id, None)
+
+    def stats(self) -> Dict:
+        return {
+            "clients": len(self._clients),
+            "cached_sessions": len(self._status_cache),
+            "inflight": len(self._inflight),
+            "stripe_calls": self.stripe_calls,
+            "cache_hits": self.cache_hits
+        }
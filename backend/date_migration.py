@@ -0,0 +1,184 @@
+"""
+ReLocal Date Migration
+Converts model timestamps stored as ISO strings (created_at, expires_at,
+last_scanned, scheduled_delivery, trip_end_date) to BSON dates.
+Batched and resumable: progress is checkpointed per collection in
+db.migrations, and each update only applies if the field still holds the
+string that was read, so it is safe alongside live traffic and several
+workers. Started in the background at server startup; also runnable alone.
+
+Run from backend/:
+    python -m date_migration
+    python -m date_migration --force   # rescan collections already marked done
+"""
+
+import os
+import sys
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# ============= CONFIGURATION =============
+
+DATE_MIGRATION_ON_STARTUP = os.environ.get('DATE_MIGRATION_ON_STARTUP', 'true').lower() == 'true'
+DATE_MIGRATION_BATCH_SIZE = int(os.environ.get('DATE_MIGRATION_BATCH_SIZE', '1000'))
+MIGRATION_ID = "bson_dates"
+
+# Collection -> fields the API writes as dates
+DATE_FIELDS: Dict[str, tuple] = {
+    "users": ("created_at",),
+    "user_sessions": ("created_at", "expires_at"),
+    "shops": ("created_at",),
+    "products": ("created_at",),
+    "qr_codes": ("created_at", "last_scanned"),
+    "orders": ("created_at", "scheduled_delivery", "trip_end_date"),
+    "payment_transactions": ("created_at",),
+    "categories": ("created_at",),
+    "shipment_estimates": ("created_at",),
+    "shipments": ("created_at",)
+}
+
+# ============= HELPERS =============
+
+def parse_date(value: Any) -> Optional[datetime]:
+    """
+    A timezone-aware UTC datetime from a BSON date or an ISO string
+    Naive values are taken to be UTC, as pymongo stores them.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def on_or_before(field: str, moment: datetime) -> Dict:
+    """
+    Filter for field <= moment, matching documents not yet migrated too
+    Range operators only compare values of the same BSON type, so a date
+    bound alone would skip legacy ISO strings.
+    """
+    return {"$or": [{field: {"$lte": moment}}, {field: {"$lte": moment.isoformat()}}]}
+
+async def ensure_date_indexes(db) -> None:
+    """
+    Indexes for date-ordered order lists, and session expiry now that expires_at is a date
+    """
+    await db.orders.create_index([("buyer_id", 1), ("created_at", -1)])
+    await db.orders.create_index([("shop_id", 1), ("created_at", -1)])
+    await db.user_sessions.create_index("expires_at", expireAfterSeconds=0)
+
+# ============= MIGRATION =============
+
+class DateMigration:
+    """
+    Walks each collection by _id in batches, converting string dates with one bulk_write per batch
+    """
+
+    def __init__(self, db, batch_size: int = DATE_MIGRATION_BATCH_SIZE):
+        self.db = db
+        self.batch_size = batch_size
+
+    async def run(self, force: bool = False) -> Dict[str, int]:
+        """
+        Migrate every collection, returns the documents converted per collection
+        """
+        converted = {}
+        for collection in DATE_FIELDS:
+            converted[collection] = await self.migrate_collection(collection, force=force)
+        return converted
+
+    async def migrate_collection(self, collection: str, force: bool = False) -> int:
+        state_id = f"{MIGRATION_ID}:{collection}"
+        state = await self.db.migrations.find_one({"_id": state_id}) or {}
+        if state.get("completed") and not force:
+            return 0
+        last_id = None if force else state.get("last_id")
+
+        fields = DATE_FIELDS[collection]
+        has_string = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        converted = 0
+
+        while True:
+            query = {**has_string, "_id": {"$gt": last_id}} if last_id is not None else has_string
+            docs = await self.db[collection].find(
+                query, {field: 1 for field in fields}
+            ).sort("_id", 1).limit(self.batch_size).to_list(None)
+            if not docs:
+                break
+
+            operations = []
+            for doc in docs:
+                updates = {}
+                for field in fields:
+                    value = doc.get(field)
+                    if not isinstance(value, str):
+                        continue
+                    try:
+                        updates[field] = parse_date(value)
+                    except ValueError:
+                        logger.warning(f"Unparseable {collection}.{field} on {doc['_id']}: {value!r}")
+                if updates:
+                    # Only if unchanged since read, so a concurrent write wins
+                    match = {"_id": doc["_id"], **{field: doc[field] for field in updates}}
+                    operations.append(UpdateOne(match, {"$set": updates}))
+
+            if operations:
+                result = await self.db[collection].bulk_write(operations, ordered=False)
+                converted += result.modified_count
+
+            last_id = docs[-1]["_id"]
+            await self.db.migrations.update_one(
+                {"_id": state_id},
+                {"$set": {"last_id": last_id, "completed": False, "updated_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+
+        await self.db.migrations.update_one(
+            {"_id": state_id},
+            {
+                "$set": {"completed": True, "updated_at": datetime.now(timezone.utc)},
+                "$inc": {"converted": converted}
+            },
+            upsert=True
+        )
+        if converted:
+            logger.info(f"Converted dates on {converted} {collection} documents")
+        return converted
+
+# ============= CLI =============
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert ISO string dates to BSON dates")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default=os.environ.get("DB_NAME"))
+    parser.add_argument("--batch-size", type=int, default=DATE_MIGRATION_BATCH_SIZE)
+    parser.add_argument("--force", action="store_true", help="rescan collections already marked completed")
+    args = parser.parse_args()
+    if not args.db_name:
+        sys.exit("--db-name or DB_NAME is required")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    async def run():
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(args.mongo_url)
+        try:
+            converted = await DateMigration(client[args.db_name], args.batch_size).run(force=args.force)
+            await ensure_date_indexes(client[args.db_name])
+        finally:
+            client.close()
+        for collection, count in converted.items():
+            print(f"  {collection:<22} {count}")
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+ReLocal Ship-After-Trip Scheduler
+Enqueues shipment creation for orders whose buyer's trip has ended
+"""
+
+import os
+import logging
+import asyncio
+from typing import Optional
+from datetime import datetime, timezone, timedelta
+
+from job_queue import JobQueue
+from date_migration import parse_date, on_or_before
+
+logger = logging.getLogger(__name__)
+
+# ============= CONFIGURATION =============
+
+DISPATCH_WORKER_CONCURRENCY = int(os.environ.get('DISPATCH_WORKER_CONCURRENCY', '2'))
+
+# Upper bound on a single sleep, so orders added by other processes are noticed
+DISPATCH_MAX_SLEEP_SECONDS = float(os.environ.get('DISPATCH_MAX_SLEEP_SECONDS', '300'))
+# A claim that never reached the queue (process died) is retried after this long
+DISPATCH_CLAIM_LEASE_SECONDS = int(os.environ.get('DISPATCH_CLAIM_LEASE_SECONDS', '300'))
+
+# Order trip_dispatch_status: (missing) -> claimed -> enqueued
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+# ============= SCHEDULER =============
+
+class TripDispatchScheduler:
+    """
+    Sleeps until the next trip_end_date instead of polling every order
+    Due orders are claimed with find_one_and_update, so several processes
+    can run the scheduler and each order is enqueued once; the job's
+    dedupe_key covers a claim that is retried after a crash.
+    """
+
+    def __init__(self, db, queue: JobQueue):
+        self.db = db
+        self.queue = queue
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_indexes(self) -> None:
+        await self.db.orders.create_index(
+            [("trip_dispatch_status", 1), ("trip_end_date", 1)],
+            partialFilterExpression={"ship_after_trip": True}
+        )
+
+    def _pending_query(self) -> dict:
+        lease_cutoff = (_now() - timedelta(seconds=DISPATCH_CLAIM_LEASE_SECONDS)).isoformat()
+        return {
+            "ship_after_trip": True,
+            "delivery_type": "delivery",
+            "status": "confirmed",
+            "shipment_id": {"$exists": False},
+            "$or": [
+                {"trip_dispatch_status": None},
+                {"trip_dispatch_status": "claimed", "trip_dispatch_claimed_at": {"$lte": lease_cutoff}}
+            ]
+        }
+
+    def notify(self) -> None:
+        """
+        Wake the scheduler, e.g. after a ship-after-trip order is paid
+        """
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            # Cleared before scanning so a notify() during the scan is not lost
+            self._wakeup.clear()
+            try:
+                await self.dispatch_due()
+                sleep_seconds = await self._seconds_until_next_due()
+            except Exception as e:
+                logger.error(f"Trip dispatch scheduler error: {e}")
+                sleep_seconds = DISPATCH_MAX_SLEEP_SECONDS
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), sleep_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def dispatch_due(self) -> int:
+        """
+        Claim and enqueue every order whose trip has ended, returns the count
+        """
+
+        dispatched = 0
+        while True:
+            now = _now()
+            order = await self.db.orders.find_one_and_update(
+                {**self._pending_query(), "$and": [on_or_before("trip_end_date", now)]},
+                {"$set": {"trip_dispatch_status": "claimed", "trip_dispatch_claimed_at": now.isoformat()}},
+                sort=[("trip_end_date", 1)],
+                projection={"_id": 0, "order_id": 1}
+            )
+            if not order:
+                break
+
+            await self.queue.enqueue(
+                "dispatch_trip_order",
+                {"order_id": order["order_id"]},
+                dedupe_key=f"trip_dispatch:{order['order_id']}"
+            )
+            await self.db.orders.update_one(
+                {"order_id": order["order_id"]},
+                {"$set": {"trip_dispatch_status": "enqueued"}}
+            )
+            dispatched += 1
+
+        if dispatched:
+            logger.info(f"Enqueued shipment creation for {dispatched} ship-after-trip orders")
+        return dispatched
+
+    async def _seconds_until_next_due(self) -> float:
+        next_order = await self.db.orders.find_one(
+            {**self._pending_query(), "trip_end_date": {"$ne": None}},
+            {"_id": 0, "trip_end_date": 1},
+            sort=[("trip_end_date", 1)]
+        )
+        if not next_order:
+            return DISPATCH_MAX_SLEEP_SECONDS
+
+        seconds = (parse_date(next_order["trip_end_date"]) - _now()).total_seconds()
+        return min(max(seconds, 0.0), DISPATCH_MAX_SLEEP_SECONDS)
@@ -0,0 +1,32 @@
+"""
+ReLocal Fast JSON Responses
+List endpoints return MongoDB documents as stored, serialized by orjson:
+no per-document date parsing and no jsonable_encoder pass. Stored ISO date
+strings go out unchanged, and BSON dates are written by orjson in the same
+ISO 8601 form datetime.isoformat() produces, so responses are byte-for-byte
+what the encoder path returned.
+"""
+
+from typing import Any
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import Response
+
+def _default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+class MongoJSONResponse(Response):
+    """
+    JSON response for lists of raw MongoDB documents
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,165 @@
+"""
+ReLocal Idempotency Keys
+Replays the stored response when a client retries a request with the same
+Idempotency-Key, instead of running the handler again
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Optional, Tuple
+from datetime import datetime, timezone, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# ============= CONFIGURATION =============
+
+# Stored responses expire (TTL index) after this long
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+# A request still in progress after this long is assumed dead and may be re-run
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '60'))
+# How long a retry waits for the original request to finish before giving up with 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '5'))
+IDEMPOTENCY_POLL_SECONDS = 0.2
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Record statuses: in_progress -> completed
+# A handler that raises releases its key so the client can retry
+
+class IdempotencyError(Exception):
+    """
+    The key cannot be used for this request; carries the HTTP status to answer with
+    """
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+# ============= STORE =============
+
+class IdempotencyStore:
+    """
+    Idempotency records in the `idempotency_keys` collection
+    Keys are scoped per user and endpoint, so two users (or two endpoints)
+    can use the same key. The record is inserted before the handler runs;
+    the unique _id makes concurrent retries wait for the first request and
+    then receive its stored response. expires_at is a BSON date so the TTL
+    index can remove old records.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def ensure_indexes(self) -> None:
+        await self.db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+
+    @staticmethod
+    def request_hash(payload: Any) -> str:
+        body = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+    async def run(
+        self,
+        scope: str,
+        user_id: str,
+        key: str,
+        payload: Any,
+        handler: Callable[[], Awaitable[Any]],
+        encode: Callable[[Any], Any]
+    ) -> Tuple[Any, bool]:
+        """
+        Run handler once per (scope, user_id, key)
+        Returns (response, replayed); a replayed response is the stored
+        encoded body of the original request. `encode` turns the handler's
+        result into the JSON body that is stored.
+        """
+
+        if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise IdempotencyError(400, f"Idempotency-Key must be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+
+        record_id = f"{scope}:{user_id}:{key}"
+        payload_hash = self.request_hash(payload)
+
+        stored = await self._acquire(record_id, scope, user_id, payload_hash)
+        if stored is not None:
+            return stored, True
+
+        try:
+            result = await handler()
+        except BaseException:
+            await self.db.idempotency_keys.delete_one({"_id": record_id, "status": "in_progress"})
+            raise
+
+        await self.db.idempotency_keys.update_one(
+            {"_id": record_id},
+            {"$set": {
+                "status": "completed",
+                "response": encode(result),
+                "completed_at": _now().isoformat()
+            }}
+        )
+        return result, False
+
+    async def _acquire(self, record_id: str, scope: str, user_id: str, payload_hash: str) -> Optional[Any]:
+        """
+        Lock the key for this request, or return the stored response of an
+        earlier request with the same key
+        """
+
+        now = _now()
+        try:
+            await self.db.idempotency_keys.insert_one({
+                "_id": record_id,
+                "scope": scope,
+                "user_id": user_id,
+                "request_hash": payload_hash,
+                "status": "in_progress",
+                "locked_at": now,
+                "created_at": now.isoformat(),
+                "expires_at": now + timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+
+        deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            record = await self.db.idempotency_keys.find_one({"_id": record_id})
+            if record is None:
+                # Released by a failed request (or expired) in the meantime
+                return await self._acquire(record_id, scope, user_id, payload_hash)
+
+            if record["request_hash"] != payload_hash:
+                raise IdempotencyError(422, "Idempotency-Key was already used with a different request")
+
+            if record["status"] == "completed":
+                return record["response"]
+
+            if await self._take_over_stale(record_id):
+                return None
+
+            if asyncio.get_running_loop().time() >= deadline:
+                raise IdempotencyError(409, "A request with this Idempotency-Key is still in progress")
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+    async def _take_over_stale(self, record_id: str) -> bool:
+        now = _now()
+        taken = await self.db.idempotency_keys.find_one_and_update(
+            {
+                "_id": record_id,
+                "status": "in_progress",
+                "locked_at": {"$lte": now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}
+            },
+            {"$set": {"locked_at": now}}
+        )
+        if taken:
+            logger.warning(f"Re-running stale idempotent request {record_id}")
+        return taken is not None
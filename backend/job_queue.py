@@ -0,0 +1,352 @@
+"""
+ReLocal Background Jobs
+Durable MongoDB-backed job queue and asyncio worker pool
+"""
+
+import os
+import uuid
+import random
+import logging
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timezone, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# ============= CONFIGURATION =============
+
+JOB_VISIBILITY_TIMEOUT_SECONDS = int(os.environ.get('JOB_VISIBILITY_TIMEOUT_SECONDS', '120'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '5'))
+JOB_BACKOFF_BASE_SECONDS = float(os.environ.get('JOB_BACKOFF_BASE_SECONDS', '5'))
+JOB_BACKOFF_MAX_SECONDS = float(os.environ.get('JOB_BACKOFF_MAX_SECONDS', '600'))
+JOB_POLL_INTERVAL_SECONDS = float(os.environ.get('JOB_POLL_INTERVAL_SECONDS', '1'))
+
+# Job statuses: queued -> running -> done
+#                          \-> queued (retry with backoff) -> ... -> dead
+JOB_STATUSES = ['queued', 'running', 'done', 'dead']
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+# ============= JOB QUEUE =============
+
+class JobQueue:
+    """
+    Durable job queue stored in the `jobs` collection
+    Jobs are claimed atomically with find_one_and_update, so any number of
+    workers in any number of processes can drain the same queue. A claimed
+    job is leased for `visibility_timeout` seconds; if the worker dies the
+    lease expires and the job becomes claimable again. Each claim gets a
+    fresh lease_id, and complete() and fail() only apply while the caller
+    still holds that lease, so a worker whose lease expired cannot overwrite
+    the outcome of the worker that re-claimed the job.
+    """
+
+    def __init__(
+        self,
+        db,
+        queue: str,
+        visibility_timeout: int = JOB_VISIBILITY_TIMEOUT_SECONDS,
+        max_attempts: int = JOB_MAX_ATTEMPTS
+    ):
+        self.db = db
+        self.queue = queue
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+
+    async def ensure_indexes(self) -> None:
+        await self.db.jobs.create_index([("queue", 1), ("status", 1), ("run_at", 1)])
+        await self.db.jobs.create_index(
+            [("queue", 1), ("dedupe_key", 1)],
+            unique=True,
+            partialFilterExpression={"dedupe_key": {"$exists": True}}
+        )
+
+    def _new_job_doc(
+        self,
+        job_type: str,
+        payload: Dict,
+        delay_seconds: float,
+        dedupe_key: Optional[str]
+    ) -> Dict:
+        now = _now()
+        job_doc = {
+            "job_id": f"job_{uuid.uuid4().hex[:16]}",
+            "queue": self.queue,
+            "type": job_type,
+            "payload": payload,
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "run_at": (now + timedelta(seconds=delay_seconds)).isoformat(),
+            "lease_expires_at": None,
+            "lease_id": None,
+            "last_error": None,
+            "created_at": now.isoformat(),
+            "updated_at": now.isoformat()
+        }
+        if dedupe_key:
+            job_doc["dedupe_key"] = dedupe_key
+        return job_doc
+
+    async def enqueue(
+        self,
+        job_type: str,
+        payload: Dict,
+        delay_seconds: float = 0,
+        dedupe_key: Optional[str] = None
+    ) -> str:
+        """
+        Add a job, returns its job_id
+        With a dedupe_key, enqueueing the same key twice keeps the first job
+        """
+
+        job_doc = self._new_job_doc(job_type, payload, delay_seconds, dedupe_key)
+        job_id = job_doc["job_id"]
+
+        if dedupe_key:
+            result = await self.db.jobs.update_one(
+                {"queue": self.queue, "dedupe_key": dedupe_key},
+                {"$setOnInsert": job_doc},
+                upsert=True
+            )
+            if result.upserted_id is None:
+                existing = await self.db.jobs.find_one(
+                    {"queue": self.queue, "dedupe_key": dedupe_key},
+                    {"_id": 0, "job_id": 1}
+                )
+                return existing["job_id"]
+        else:
+            await self.db.jobs.insert_one(job_doc)
+
+        if delay_seconds <= 0:
+            self._wakeup.set()
+        return job_id
+
+    async def enqueue_many(self, jobs: List[Tuple[str, Dict, Optional[str]]]) -> int:
+        """
+        Add many (job_type, payload, dedupe_key) jobs with one insert_many
+        Jobs whose dedupe_key is already queued are skipped; returns the number added
+        """
+
+        if not jobs:
+            return 0
+
+        job_docs = [
+            self._new_job_doc(job_type, payload, 0, dedupe_key)
+            for job_type, payload, dedupe_key in jobs
+        ]
+
+        try:
+            result = await self.db.jobs.insert_many(job_docs, ordered=False)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Duplicate dedupe keys are expected, anything else is not
+            errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            if errors:
+                raise
+            inserted = e.details.get("nInserted", 0)
+
+        self._wakeup.set()
+        return inserted
+
+    async def claim(self) -> Optional[Dict]:
+        """
+        Lease the next due job, or a running job whose lease has expired
+        """
+
+        now = _now()
+        now_iso = now.isoformat()
+        return await self.db.jobs.find_one_and_update(
+            {
+                "queue": self.queue,
+                "$or": [
+                    {"status": "queued", "run_at": {"$lte": now_iso}},
+                    {"status": "running", "lease_expires_at": {"$lte": now_iso}}
+                ]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "lease_expires_at": (now + timedelta(seconds=self.visibility_timeout)).isoformat(),
+                    "lease_id": uuid.uuid4().hex,
+                    "updated_at": now_iso
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("run_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _leased(self, job: Dict) -> Dict:
+        """
+        Filter matching the job only while this claim's lease is still held
+        """
+        return {"job_id": job["job_id"], "status": "running", "lease_id": job.get("lease_id")}
+
+    def _lease_lost(self, job: Dict, outcome: str) -> None:
+        logger.warning(f"Job {job['job_id']} ({job['type']}) lease lost, {outcome} not recorded")
+
+    async def complete(self, job: Dict, result: Optional[Dict] = None) -> bool:
+        """
+        Mark the job done, False if the lease was lost to another worker
+        """
+        update = await self.db.jobs.update_one(
+            self._leased(job),
+            {"$set": {
+                "status": "done",
+                "result": result,
+                "lease_expires_at": None,
+                "lease_id": None,
+                "updated_at": _now().isoformat()
+            }}
+        )
+        if not update.matched_count:
+            self._lease_lost(job, "completion")
+            return False
+        return True
+
+    async def fail(self, job: Dict, error: str) -> bool:
+        """
+        Retry with exponential backoff and jitter, dead-letter after max_attempts
+        Returns False if the lease was lost to another worker.
+        """
+
+        now = _now()
+        if job["attempts"] >= job.get("max_attempts", self.max_attempts):
+            update = await self.db.jobs.update_one(
+                self._leased(job),
+                {"$set": {
+                    "status": "dead",
+                    "last_error": error,
+                    "lease_expires_at": None,
+                    "lease_id": None,
+                    "updated_at": now.isoformat()
+                }}
+            )
+            if not update.matched_count:
+                self._lease_lost(job, "failure")
+                return False
+            await self.db.jobs_dead_letter.insert_one({
+                **{k: v for k, v in job.items() if k != "_id"},
+                "status": "dead",
+                "last_error": error,
+                "dead_at": now.isoformat()
+            })
+            logger.error(f"Job {job['job_id']} ({job['type']}) dead-lettered after {job['attempts']} attempts: {error}")
+            return True
+
+        backoff = min(
+            JOB_BACKOFF_MAX_SECONDS,
+            JOB_BACKOFF_BASE_SECONDS * (2 ** (job["attempts"] - 1))
+        )
+        backoff *= random.uniform(0.8, 1.2)
+        update = await self.db.jobs.update_one(
+            self._leased(job),
+            {"$set": {
+                "status": "queued",
+                "run_at": (now + timedelta(seconds=backoff)).isoformat(),
+                "last_error": error,
+                "lease_expires_at": None,
+                "lease_id": None,
+                "updated_at": now.isoformat()
+            }}
+        )
+        if not update.matched_count:
+            self._lease_lost(job, "failure")
+            return False
+        logger.warning(f"Job {job['job_id']} ({job['type']}) failed, retrying in {backoff:.1f}s: {error}")
+        return True
+
+    async def wait_for_work(self, timeout: float) -> None:
+        """
+        Sleep until a job is enqueued in this process or the timeout passes
+        """
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def stats(self) -> Dict:
+        counts = {status: 0 for status in JOB_STATUSES}
+        async for row in self.db.jobs.aggregate([
+            {"$match": {"queue": self.queue}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]):
+            counts[row["_id"]] = row["count"]
+        return {"queue": self.queue, **counts}
+
+# ============= WORKER POOL =============
+
+JobHandler = Callable[[Dict], Awaitable[Optional[Dict]]]
+
+class JobWorkerPool:
+    """
+    Runs `concurrency` asyncio workers draining a JobQueue
+    Handlers are registered per job type and receive the job payload
+    """
+
+    def __init__(self, queue: JobQueue, concurrency: int):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.handlers: Dict[str, JobHandler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    def register(self, job_type: str, handler: JobHandler) -> None:
+        self.handlers[job_type] = handler
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._stopping = False
+        self._tasks = [
+            asyncio.create_task(self._worker(i))
+            for i in range(self.concurrency)
+        ]
+        logger.info(f"Started {self.concurrency} workers for queue '{self.queue.queue}'")
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, worker_id: int) -> None:
+        while not self._stopping:
+            try:
+                job = await self.queue.claim()
+            except Exception as e:
+                logger.error(f"Worker {worker_id} failed to claim job: {e}")
+                await asyncio.sleep(JOB_POLL_INTERVAL_SECONDS)
+                continue
+
+            if not job:
+                await self.queue.wait_for_work(JOB_POLL_INTERVAL_SECONDS)
+                continue
+
+            await self._run(job)
+
+    async def _run(self, job: Dict) -> None:
+        handler = self.handlers.get(job["type"])
+        if handler is None:
+            await self.queue.fail(job, f"No handler for job type {job['type']}")
+            return
+
+        try:
+            result = await handler(job["payload"])
+        except asyncio.CancelledError:
+            # Lease expires and another worker picks the job up
+            raise
+        except Exception as e:
+            await self.queue.fail(job, str(e))
+            return
+
+        await self.queue.complete(job, result)
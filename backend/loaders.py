@@ -0,0 +1,178 @@
+"""
+ReLocal Data Loaders
+Request-scoped batching of lookups by ID: every product, shop or QR code
+requested in the same event-loop tick is fetched with one $in query, and
+each document is fetched at most once per request
+"""
+
+import asyncio
+import logging
+import contextvars
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# ============= CONFIGURATION =============
+
+LOADER_MAX_BATCH_SIZE = 1000
+
+# ============= BATCH LOADER =============
+
+class BatchLoader:
+    """
+    Loads documents of one collection by a key field
+    load() calls made before the loader next yields to the event loop are
+    coalesced into one find({key: {"$in": [...]}}); results are memoized
+    for the loader's lifetime. Missing documents load as None.
+    Callers get their own shallow copy of each document.
+    With a cache (a cache_bus.LocalCache shared by the worker), documents
+    found there skip the query and fetched ones are added to it.
+    """
+
+    def __init__(self, collection, key_field: str, projection: Optional[Dict] = None,
+                 max_batch_size: int = LOADER_MAX_BATCH_SIZE, cache=None):
+        self.collection = collection
+        self.key_field = key_field
+        self.projection = projection or {"_id": 0}
+        self.max_batch_size = max_batch_size
+        self.cache = cache
+        self._memo: Dict[Any, asyncio.Future] = {}
+        self._pending: List[Any] = []
+        self._dispatch_task: Optional[asyncio.Task] = None
+
+    async def load(self, key: Any) -> Optional[Dict]:
+        if key is None:
+            return None
+        doc = await asyncio.shield(self._future(key))
+        return dict(doc) if doc is not None else None
+
+    async def load_many(self, keys: Iterable[Any]) -> List[Optional[Dict]]:
+        """
+        Documents for keys, in order (None where missing)
+        """
+        keys = list(keys)
+        futures = {key: self._future(key) for key in keys if key is not None}
+        results = {}
+        for key, future in futures.items():
+            results[key] = await asyncio.shield(future)
+        return [dict(results[key]) if results.get(key) is not None else None for key in keys]
+
+    def prime(self, doc: Dict) -> None:
+        """
+        Memoize a document fetched some other way (e.g. a shop looked up by owner)
+        """
+        key = doc.get(self.key_field)
+        if key is None or key in self._memo:
+            return
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(dict(doc))
+        self._memo[key] = future
+
+    def clear(self, key: Any) -> None:
+        """
+        Forget a memoized document after writing to it
+        """
+        future = self._memo.get(key)
+        if future is not None and future.done():
+            del self._memo[key]
+
+    def _future(self, key: Any) -> asyncio.Future:
+        future = self._memo.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._memo[key] = loop.create_future()
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                future.set_result(cached)
+                return future
+            self._pending.append(key)
+            if self._dispatch_task is None:
+                # Runs after every callback already queued, so concurrent
+                # load() calls from gather() land in the same batch
+                self._dispatch_task = loop.create_task(self._dispatch())
+        return future
+
+    async def _dispatch(self) -> None:
+        keys, self._pending = self._pending, []
+        self._dispatch_task = None
+
+        for start in range(0, len(keys), self.max_batch_size):
+            chunk = keys[start:start + self.max_batch_size]
+            version = self.cache.version if self.cache is not None else None
+            try:
+                docs = await self.collection.find(
+                    {self.key_field: {"$in": chunk}}, self.projection
+                ).to_list(None)
+            except Exception as e:
+                logger.warning(f"Batch load of {len(chunk)} {self.collection.name} failed: {e}")
+                for key in chunk:
+                    future = self._memo.pop(key, None)
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+                continue
+
+            found = {doc.get(self.key_field): doc for doc in docs}
+            if self.cache is not None:
+                for key, doc in found.items():
+                    self.cache.set(key, doc, version)
+            for key in chunk:
+                future = self._memo.get(key)
+                if future is not None and not future.done():
+                    future.set_result(found.get(key))
+
+class Loaders:
+    """
+    The loaders for one request
+    """
+
+    def __init__(self, db, caches: Optional[Dict] = None):
+        caches = caches or {}
+        self.products = BatchLoader(db.products, "product_id", cache=caches.get("products"))
+        self.shops = BatchLoader(db.shops, "shop_id", cache=caches.get("shops"))
+        self.qr_codes = BatchLoader(db.qr_codes, "qr_code_id")
+
+async def ensure_loader_indexes(db) -> None:
+    """
+    Indexes backing the loaders' $in lookups
+    """
+    await db.products.create_index("product_id")
+    await db.shops.create_index("shop_id")
+    await db.qr_codes.create_index("qr_code_id")
+
+# ============= REQUEST SCOPE =============
+
+current_loaders: contextvars.ContextVar[Optional[Loaders]] = contextvars.ContextVar(
+    "current_loaders", default=None
+)
+
+def request_loaders(db, caches: Optional[Dict] = None) -> Loaders:
+    """
+    The current request's loaders
+    Outside a request (background workers) each call gets fresh loaders,
+    so nothing is memoized between jobs.
+    """
+    loaders = current_loaders.get()
+    if loaders is None:
+        loaders = Loaders(db, caches)
+    return loaders
+
+class LoaderMiddleware:
+    """
+    ASGI middleware giving every HTTP request its own Loaders
+    """
+
+    def __init__(self, app, db, caches: Optional[Dict] = None):
+        self.app = app
+        self.db = db
+        self.caches = caches
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = current_loaders.set(Loaders(self.db, self.caches))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_loaders.reset(token)
@@ -0,0 +1,225 @@
+"""
+ReLocal Metrics
+Per-route request metrics and MongoDB command metrics in Prometheus text format
+"""
+
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+# ============= CONFIGURATION =============
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COMMANDS_PER_REQUEST_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+LabelValues = Tuple[str, ...]
+
+# ============= METRIC TYPES =============
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, label_values: LabelValues, amount: float = 1.0) -> None:
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {_number(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count], sum
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, label_values: LabelValues, value: float) -> None:
+        counts = self._counts.get(label_values)
+        if counts is None:
+            counts = self._counts[label_values] = [0] * (len(self.buckets) + 1)
+            self._sums[label_values] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[label_values] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, counts in sorted(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (_number(bound),))} {cumulative}"
+                )
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + ('+Inf',))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {_number(self._sums[label_values])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+# ============= REQUEST SCOPE =============
+
+class RequestStats:
+    """
+    MongoDB work done while serving one request
+    """
+
+    __slots__ = ("commands", "mongo_seconds")
+
+    def __init__(self):
+        self.commands = 0
+        self.mongo_seconds = 0.0
+
+# Set by the metrics middleware; motor copies the context into its executor
+# threads, so the command listener sees the request that issued the command
+current_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request_stats", default=None
+)
+
+# ============= REGISTRY =============
+
+class MetricsRegistry:
+    """
+    Process-wide metrics, rendered for Prometheus at /metrics
+    Updates take one lock; the command listener runs in motor's threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.http_requests = Counter(
+            "relocal_http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]
+        )
+        self.http_latency = Histogram(
+            "relocal_http_request_duration_seconds", "HTTP request latency", ["method", "route"], LATENCY_BUCKETS
+        )
+        self.request_commands = Histogram(
+            "relocal_http_request_mongo_commands", "MongoDB commands issued per request",
+            ["method", "route"], COMMANDS_PER_REQUEST_BUCKETS
+        )
+        self.request_mongo_time = Histogram(
+            "relocal_http_request_mongo_seconds", "Time spent in MongoDB per request",
+            ["method", "route"], LATENCY_BUCKETS
+        )
+        self.mongo_commands = Counter(
+            "relocal_mongo_commands_total", "MongoDB commands by name and outcome", ["command", "outcome"]
+        )
+        self.mongo_latency = Histogram(
+            "relocal_mongo_command_duration_seconds", "MongoDB command latency", ["command"], MONGO_LATENCY_BUCKETS
+        )
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+        with self._lock:
+            self.http_requests.inc((method, route, str(status)))
+            self.http_latency.observe((method, route), seconds)
+            self.request_commands.observe((method, route), stats.commands)
+            self.request_mongo_time.observe((method, route), stats.mongo_seconds)
+
+    def observe_command(self, command: str, outcome: str, seconds: float) -> None:
+        with self._lock:
+            self.mongo_commands.inc((command, outcome))
+            self.mongo_latency.observe((command,), seconds)
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                "# HELP relocal_process_start_time_seconds Start time of the process",
+                "# TYPE relocal_process_start_time_seconds gauge",
+                f"relocal_process_start_time_seconds {_number(self.started_at)}"
+            ]
+            for metric in (
+                self.http_requests, self.http_latency, self.request_commands,
+                self.request_mongo_time, self.mongo_commands, self.mongo_latency
+            ):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Counts every command the MongoDB client runs, globally and per request
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._record(event.command_name, "ok", event.duration_micros)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._record(event.command_name, "error", event.duration_micros)
+
+    def _record(self, command: str, outcome: str, duration_micros: int) -> None:
+        seconds = duration_micros / 1_000_000
+        self.registry.observe_command(command, outcome, seconds)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.commands += 1
+            stats.mongo_seconds += seconds
+
+# ============= MIDDLEWARE =============
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording count, latency, status and MongoDB work per route
+    Routes are labelled by their template (/api/products/{product_id}), so
+    label cardinality stays bounded; unmatched paths share one label.
+    """
+
+    def __init__(self, app, registry: Optional[MetricsRegistry] = None):
+        self.app = app
+        self.registry = registry or metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_request_stats.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            self.registry.observe_request(scope["method"], route, status, time.perf_counter() - started, stats)
+
+# Process-wide registry and listener; the listener is passed to AsyncIOMotorClient
+metrics = MetricsRegistry()
+mongo_command_listener = MongoCommandListener(metrics)
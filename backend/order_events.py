@@ -0,0 +1,138 @@
+"""
+ReLocal Order Events
+In-process pub/sub of order status transitions for the SSE stream
+"""
+
+import os
+import json
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# ============= CONFIGURATION =============
+
+# Events buffered per connection; a client that falls this far behind loses the oldest
+ORDER_EVENT_QUEUE_SIZE = int(os.environ.get('ORDER_EVENT_QUEUE_SIZE', '100'))
+# Comment line sent on idle streams so proxies keep the connection open
+ORDER_EVENT_HEARTBEAT_SECONDS = float(os.environ.get('ORDER_EVENT_HEARTBEAT_SECONDS', '15'))
+
+def user_channel(user_id: str) -> str:
+    return f"user:{user_id}"
+
+def shop_channel(shop_id: str) -> str:
+    return f"shop:{shop_id}"
+
+# ============= EVENT BUS =============
+
+class OrderEventBus:
+    """
+    Fans order status transitions out to subscribed connections
+    An order event is published to its buyer's channel and its shop's
+    channel. Publishing never blocks the write path: each subscriber has a
+    bounded queue and a slow one drops its oldest events.
+    Subscribers only see transitions written by this process.
+    """
+
+    def __init__(self, queue_size: int = ORDER_EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, channels: Iterable[str]) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        for channel in channels:
+            self._subscribers.setdefault(channel, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue, channels: Iterable[str]) -> None:
+        for channel in channels:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is None:
+                continue
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[channel]
+
+    def has_subscribers(self, channels: Iterable[str]) -> bool:
+        return any(channel in self._subscribers for channel in channels)
+
+    @staticmethod
+    def order_channels(order: Dict) -> List[str]:
+        channels = []
+        if order.get("buyer_id"):
+            channels.append(user_channel(order["buyer_id"]))
+        if order.get("shop_id"):
+            channels.append(shop_channel(order["shop_id"]))
+        return channels
+
+    def publish(self, order: Dict, status: str, **details) -> int:
+        """
+        Publish one order's new status, returns the number of connections reached
+        `order` needs order_id, buyer_id and shop_id
+        """
+
+        channels = self.order_channels(order)
+        queues = set()
+        for channel in channels:
+            queues.update(self._subscribers.get(channel, ()))
+        if not queues:
+            return 0
+
+        event = {
+            "type": "order_status",
+            "order_id": order["order_id"],
+            "shop_id": order.get("shop_id"),
+            "status": status,
+            "at": datetime.now(timezone.utc).isoformat(),
+            **details
+        }
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(event)
+        self.published += 1
+        return len(queues)
+
+    async def publish_orders(self, db, order_ids: List[str], status: str, **details) -> int:
+        """
+        Publish a status for orders known only by id, looking up their
+        buyer and shop in one query when anyone could be listening
+        """
+
+        if not order_ids or not self._subscribers:
+            return 0
+
+        reached = 0
+        try:
+            async for order in db.orders.find(
+                {"order_id": {"$in": order_ids}},
+                {"_id": 0, "order_id": 1, "buyer_id": 1, "shop_id": 1}
+            ):
+                reached += self.publish(order, status, **details)
+        except Exception as e:
+            # The status is already written; a missed notification must not fail the write path
+            logger.error(f"Failed to publish order status {status}: {e}")
+        return reached
+
+    def stats(self) -> Dict:
+        return {
+            "channels": len(self._subscribers),
+            "connections": len({id(queue) for queues in self._subscribers.values() for queue in queues}),
+            "published": self.published,
+            "dropped": self.dropped
+        }
+
+def format_sse(event: Dict, event_name: Optional[str] = None) -> str:
+    lines = []
+    if event_name:
+        lines.append(f"event: {event_name}")
+    lines.append(f"data: {json.dumps(event)}")
+    return "\n".join(lines) + "\n\n"
+
+# Process-wide bus shared by the API and the background workers
+order_events = OrderEventBus()
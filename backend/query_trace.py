@@ -0,0 +1,172 @@
+"""
+ReLocal Query Tracer
+Records the MongoDB commands each request issues and flags N+1 patterns:
+the same query shape repeated many times within one request
+Meant for development and staging; off unless QUERY_TRACE_ENABLED is set
+"""
+
+import os
+import json
+import logging
+import contextvars
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# ============= CONFIGURATION =============
+
+QUERY_TRACE_ENABLED = os.environ.get('QUERY_TRACE_ENABLED', 'false').lower() == 'true'
+# Also return the report in X-Query-Report / X-Query-Count response headers
+QUERY_TRACE_HEADER = os.environ.get('QUERY_TRACE_HEADER', 'false').lower() == 'true'
+# A shape issued at least this many times in one request is reported
+QUERY_TRACE_REPEAT_THRESHOLD = int(os.environ.get('QUERY_TRACE_REPEAT_THRESHOLD', '5'))
+QUERY_TRACE_HEADER_MAX_LENGTH = 1024
+
+# Commands that are not queries an endpoint chose to run
+IGNORED_COMMANDS = {'getMore', 'endSessions', 'killCursors', 'hello', 'isMaster', 'ping', 'saslStart', 'saslContinue'}
+
+# ============= QUERY SHAPES =============
+
+def _shape(value: Any) -> Any:
+    """
+    Keep field names and operators, replace values with "?"
+    """
+    if isinstance(value, dict):
+        return {key: _shape(inner) for key, inner in value.items()}
+    if isinstance(value, (list, tuple)) and value and all(isinstance(item, dict) for item in value):
+        return [_shape(item) for item in value]
+    return "?"
+
+def command_shape(command_name: str, command: Dict) -> Tuple[str, str, str]:
+    """
+    (command, collection, filter shape) for a command document
+    """
+    collection = command.get(command_name)
+    if not isinstance(collection, str):
+        collection = ""
+
+    query: Any = None
+    if command_name in ("find", "delete", "update"):
+        query = command.get("filter")
+        if command_name == "update" and command.get("updates"):
+            query = command["updates"][0].get("q")
+        if command_name == "delete" and command.get("deletes"):
+            query = command["deletes"][0].get("q")
+    elif command_name in ("findAndModify", "count", "distinct"):
+        query = command.get("query")
+    elif command_name == "aggregate":
+        pipeline = command.get("pipeline") or []
+        query = [{stage_name: _shape(stage_body) if stage_name == "$match" else "..."}
+                 for stage in pipeline for stage_name, stage_body in stage.items()]
+        return command_name, collection, json.dumps(query, sort_keys=True)
+
+    return command_name, collection, json.dumps(_shape(query or {}), sort_keys=True)
+
+# ============= REQUEST TRACE =============
+
+class QueryTrace:
+    """
+    Commands issued while serving one request, in order
+    """
+
+    def __init__(self):
+        self.commands: List[Tuple[str, str, str]] = []
+
+    def repeated(self, threshold: int = QUERY_TRACE_REPEAT_THRESHOLD) -> List[Dict]:
+        counts: Dict[Tuple[str, str, str], int] = {}
+        for shape in self.commands:
+            counts[shape] = counts.get(shape, 0) + 1
+        return sorted(
+            (
+                {"command": command, "collection": collection, "filter": query, "count": count}
+                for (command, collection, query), count in counts.items()
+                if count >= threshold
+            ),
+            key=lambda entry: -entry["count"]
+        )
+
+    def report(self, threshold: int = QUERY_TRACE_REPEAT_THRESHOLD) -> Dict:
+        return {"commands": len(self.commands), "repeated": self.repeated(threshold)}
+
+current_query_trace: contextvars.ContextVar[Optional[QueryTrace]] = contextvars.ContextVar(
+    "current_query_trace", default=None
+)
+
+class QueryTraceListener(monitoring.CommandListener):
+    """
+    Adds every command started during a traced request to its QueryTrace
+    """
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        trace = current_query_trace.get()
+        if trace is None or event.command_name in IGNORED_COMMANDS:
+            return
+        try:
+            trace.commands.append(command_shape(event.command_name, event.command))
+        except Exception as e:
+            logger.debug(f"Could not shape {event.command_name} command: {e}")
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        pass
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        pass
+
+# ============= MIDDLEWARE =============
+
+def format_report_header(report: Dict) -> str:
+    parts = [f"commands={report['commands']}"]
+    for entry in report["repeated"]:
+        parts.append(f"{entry['command']} {entry['collection']} {entry['filter']} x{entry['count']}")
+    header = "; ".join(parts)
+    if len(header) > QUERY_TRACE_HEADER_MAX_LENGTH:
+        header = header[:QUERY_TRACE_HEADER_MAX_LENGTH - 3] + "..."
+    return header
+
+class QueryTraceMiddleware:
+    """
+    ASGI middleware tracing each request's MongoDB commands
+    Repeated shapes are logged as warnings; with QUERY_TRACE_HEADER the
+    report is also returned in X-Query-Count and X-Query-Report.
+    """
+
+    def __init__(self, app, threshold: int = QUERY_TRACE_REPEAT_THRESHOLD, header: bool = QUERY_TRACE_HEADER):
+        self.app = app
+        self.threshold = threshold
+        self.header = header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = QueryTrace()
+        token = current_query_trace.set(trace)
+
+        async def send_with_report(message):
+            if message["type"] == "http.response.start" and self.header:
+                report = trace.report(self.threshold)
+                headers = list(message.get("headers", []))
+                headers.append((b"x-query-count", str(report["commands"]).encode("latin-1")))
+                headers.append((b"x-query-report", format_report_header(report).encode("latin-1", "replace")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_report)
+        finally:
+            current_query_trace.reset(token)
+            repeated = trace.repeated(self.threshold)
+            if repeated:
+                route = getattr(scope.get("route"), "path", None) or scope.get("path")
+                details = ", ".join(
+                    f"{entry['command']} {entry['collection']} {entry['filter']} x{entry['count']}"
+                    for entry in repeated
+                )
+                logger.warning(
+                    f"Possible N+1 in {scope['method']} {route}: {len(trace.commands)} commands, repeated: {details}"
+                )
+
+query_trace_listener = QueryTraceListener()
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Header
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, PlainTextResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -9,29 +10,92 @@ from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional, Dict, Any
 import uuid
+import asyncio
 from datetime import datetime, timezone, timedelta
 import io
 import qrcode
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+from emergentintegrations.payments.stripe.checkout import CheckoutSessionResponse, CheckoutSessionRequest
 import bcrypt
-from shipping_service import ShippingEstimator, ShipmentService, TrackingService
 
 ROOT_DIR = Path(__file__).parent
+# Before the local modules below, which read their settings at import time
 load_dotenv(ROOT_DIR / '.env')
 
+from shipping_service import ShippingEstimator, ShipmentService, TrackingService, shippo_client, remote_areas, BATCH_ESTIMATE_MAX_ITEMS, LABEL_WORKER_CONCURRENCY
+from job_queue import JobQueue, JobWorkerPool
+from webhook_inbox import WebhookInbox
+from dispatch_scheduler import TripDispatchScheduler, DISPATCH_WORKER_CONCURRENCY
+from checkout_service import CheckoutService
+from idempotency import IdempotencyStore, IdempotencyError
+from metrics import metrics, mongo_command_listener, MetricsMiddleware
+from query_trace import query_trace_listener, QueryTraceMiddleware, QUERY_TRACE_ENABLED
+from loaders import Loaders, LoaderMiddleware, request_loaders, ensure_loader_indexes
+from cache_bus import CacheInvalidationBus, LocalCache, CACHE_INVALIDATION_ENABLED
+from fast_json import MongoJSONResponse
+from date_migration import DateMigration, parse_date, on_or_before, ensure_date_indexes, DATE_MIGRATION_ON_STARTUP
+from analytics import AnalyticsEmitter, AnalyticsRollup, ANALYTICS_ROLLUP_INTERVAL_SECONDS
+from order_events import order_events, user_channel, shop_channel, format_sse, ORDER_EVENT_HEARTBEAT_SECONDS
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+mongo_listeners = [mongo_command_listener]
+if QUERY_TRACE_ENABLED:
+    mongo_listeners.append(query_trace_listener)
+# tz_aware: BSON dates come back as UTC datetimes and serialize with +00:00
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=mongo_listeners)
 db = client[os.environ['DB_NAME']]
 
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 stripe_api_key = os.environ.get('STRIPE_API_KEY')
+# One Stripe client per process; checkout status polls are served from its cache
+checkout_service = CheckoutService(stripe_api_key)
+# Retried POST /orders and /checkout/session with the same Idempotency-Key replay the first response
+idempotency_store = IdempotencyStore(db)
+
+# Analytics events are buffered and written in batches, off the request path
+analytics = AnalyticsEmitter(db)
+analytics_rollup = AnalyticsRollup(db)
 
 # Initialize shipping services
+label_queue = JobQueue(db, "shipping_labels")
 shipping_estimator = ShippingEstimator(db)
-shipment_service = ShipmentService(db)
-tracking_service = TrackingService(db)
+shipment_service = ShipmentService(db, estimator=shipping_estimator, label_queue=label_queue, order_events=order_events)
+tracking_service = TrackingService(db, order_events=order_events)
+
+label_workers = JobWorkerPool(label_queue, LABEL_WORKER_CONCURRENCY)
+label_workers.register("create_label", shipment_service.process_label_job)
+
+# Ship-after-trip orders are shipped by the dispatch scheduler when the trip ends
+dispatch_queue = JobQueue(db, "trip_dispatch")
+dispatch_scheduler = TripDispatchScheduler(db, dispatch_queue)
+dispatch_workers = JobWorkerPool(dispatch_queue, DISPATCH_WORKER_CONCURRENCY)
+
+# Webhooks are acknowledged once stored; handlers are registered with the endpoints
+webhook_inbox = WebhookInbox(db)
+
+# Per-worker caches, evicted from a change stream when any worker writes
+cache_bus = CacheInvalidationBus(db)
+lookup_caches = {
+    "products": cache_bus.register("products", LocalCache("products"), key=lambda doc: doc.get("product_id")),
+    "shops": cache_bus.register("shops", LocalCache("shops"), key=lambda doc: doc.get("shop_id"))
+}
+user_cache = cache_bus.register("users", LocalCache("users"), key=lambda doc: doc.get("user_id"))
+category_cache = cache_bus.register("categories", LocalCache("categories"))
+cache_bus.register("shipping_rate_rules", shipping_estimator.rule_cache)
+# Every worker rebuilds its remote-area index when remote_areas is written
+cache_bus.on_change("remote_areas", lambda change: remote_areas.schedule_reload(db))
+
+# Products, shops and QR codes by ID: batched and memoized per request
+def loaders() -> Loaders:
+    return request_loaders(db, lookup_caches)
+
+# Converts legacy ISO string dates to BSON dates in the background
+date_migration = DateMigration(db)
+
+# Long-running loops started at startup, cancelled at shutdown
+background_tasks: List[asyncio.Task] = []
+TRACKING_COMPACTION_INTERVAL_SECONDS = int(os.environ.get('TRACKING_COMPACTION_INTERVAL_SECONDS', '3600'))
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -172,6 +236,7 @@ class ShipmentEstimate(BaseModel):
     is_international: bool
     is_remote_area: bool
     estimation_method: str  # api, rule_based
+    options: List[Dict[str, Any]] = []  # all service levels, ranked by cost
     created_at: datetime
 
 class Shipment(BaseModel):
@@ -232,6 +297,13 @@ class ShippingRateRule(BaseModel):
     is_active: bool
     created_at: datetime
 
+class RemoteArea(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    country: str
+    postal_prefixes: List[str] = []
+    cities: List[str] = []
+    is_active: bool = True
+
 # ============= INPUT MODELS =============
 
 class LoginRequest(BaseModel):
@@ -291,10 +363,26 @@ class ShippingEstimateRequest(BaseModel):
     from_address: Dict[str, str]
     to_address: Dict[str, str]
 
+class ShippingEstimateBatchItem(BaseModel):
+    order_id: Optional[str] = None
+    weight_kg: float
+    from_address: Dict[str, str]
+    to_address: Dict[str, str]
+
+class ShippingEstimateBatchRequest(BaseModel):
+    items: List[ShippingEstimateBatchItem]
+
 class ShipmentCreateRequest(BaseModel):
     order_id: str
     customs_declaration: Optional[Dict[str, Any]] = None
 
+class BulkShipmentCreateRequest(BaseModel):
+    order_ids: List[str] = []
+    all_confirmed: bool = False  # every confirmed delivery order without a shipment
+    shop_id: Optional[str] = None  # admin only
+    customs_declarations: Dict[str, Dict[str, Any]] = {}  # order_id -> declaration
+    consolidate: bool = False  # one shipment per buyer, address and ship-after-trip date
+
 class CheckoutRequest(BaseModel):
     order_id: str
     origin_url: str
@@ -302,6 +390,11 @@ class CheckoutRequest(BaseModel):
 class TrackingUpdate(BaseModel):
     tracking_id: str
 
+class WebhookReplayRequest(BaseModel):
+    inbox_ids: List[str] = []
+    source: Optional[str] = None  # tracking, stripe
+    status: str = "failed"
+
 # ============= AUTH HELPERS =============
 
 async def get_current_user(request: Request, authorization: Optional[str] = Header(None)) -> User:
@@ -317,20 +410,16 @@ async def get_current_user(request: Request, authorization: Optional[str] = Head
     if not session_doc:
         raise HTTPException(status_code=401, detail="Invalid session")
     
-    expires_at = session_doc["expires_at"]
-    if isinstance(expires_at, str):
-        expires_at = datetime.fromisoformat(expires_at)
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
-    if expires_at < datetime.now(timezone.utc):
+    if parse_date(session_doc["expires_at"]) < datetime.now(timezone.utc):
         raise HTTPException(status_code=401, detail="Session expired")
     
-    user_doc = await db.users.find_one({"user_id": session_doc["user_id"]}, {"_id": 0})
-    if not user_doc:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    if isinstance(user_doc["created_at"], str):
-        user_doc["created_at"] = datetime.fromisoformat(user_doc["created_at"])
+    user_doc = user_cache.get(session_doc["user_id"])
+    if user_doc is None:
+        version = user_cache.version
+        user_doc = await db.users.find_one({"user_id": session_doc["user_id"]}, {"_id": 0})
+        if not user_doc:
+            raise HTTPException(status_code=404, detail="User not found")
+        user_cache.set(session_doc["user_id"], user_doc, version)
     
     return User(**user_doc)
 
@@ -357,6 +446,7 @@ async def process_session(session_req: SessionRequest, response: Response):
             {"user_id": user_id},
             {"$set": {"name": data["name"], "picture": data["picture"]}}
         )
+        user_cache.evict(user_id)
     else:
         user_doc = {
             "user_id": user_id,
@@ -367,7 +457,7 @@ async def process_session(session_req: SessionRequest, response: Response):
             "addresses": [],
             "travel_mode": True,  # Default ON for tourists
             "default_delivery_address": None,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
         await db.users.insert_one(user_doc)
     
@@ -377,8 +467,8 @@ async def process_session(session_req: SessionRequest, response: Response):
     session_doc = {
         "user_id": user_id,
         "session_token": session_token,
-        "expires_at": expires_at.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "expires_at": expires_at,
+        "created_at": datetime.now(timezone.utc)
     }
     await db.user_sessions.insert_one(session_doc)
     
@@ -393,8 +483,6 @@ async def process_session(session_req: SessionRequest, response: Response):
     )
     
     user_doc = await db.users.find_one({"user_id": user_id}, {"_id": 0})
-    if isinstance(user_doc["created_at"], str):
-        user_doc["created_at"] = datetime.fromisoformat(user_doc["created_at"])
     
     return User(**user_doc)
 
@@ -435,7 +523,7 @@ async def register(registration: RegistrationRequest, response: Response):
         "travel_mode": True,  # Default ON for tourists
         "default_delivery_address": None,
         "password_hash": password_hash,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.users.insert_one(user_doc)
     
@@ -446,8 +534,8 @@ async def register(registration: RegistrationRequest, response: Response):
     session_doc = {
         "user_id": user_id,
         "session_token": session_token,
-        "expires_at": expires_at.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "expires_at": expires_at,
+        "created_at": datetime.now(timezone.utc)
     }
     await db.user_sessions.insert_one(session_doc)
     
@@ -464,8 +552,6 @@ async def register(registration: RegistrationRequest, response: Response):
     
     # Return user without password_hash
     user_doc_clean = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password_hash": 0})
-    if isinstance(user_doc_clean["created_at"], str):
-        user_doc_clean["created_at"] = datetime.fromisoformat(user_doc_clean["created_at"])
     
     return User(**user_doc_clean)
 
@@ -491,8 +577,8 @@ async def login(credentials: LoginRequest, response: Response):
     session_doc = {
         "user_id": user_doc["user_id"],
         "session_token": session_token,
-        "expires_at": expires_at.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "expires_at": expires_at,
+        "created_at": datetime.now(timezone.utc)
     }
     await db.user_sessions.insert_one(session_doc)
     
@@ -509,8 +595,6 @@ async def login(credentials: LoginRequest, response: Response):
     
     # Return user without password_hash
     user_doc_clean = {k: v for k, v in user_doc.items() if k != "password_hash"}
-    if isinstance(user_doc_clean["created_at"], str):
-        user_doc_clean["created_at"] = datetime.fromisoformat(user_doc_clean["created_at"])
     
     return User(**user_doc_clean)
 
@@ -524,6 +608,7 @@ async def update_travel_mode(travel_update: TravelModeUpdate, request: Request,
         {"user_id": user.user_id},
         {"$set": {"travel_mode": travel_update.travel_mode}}
     )
+    user_cache.evict(user.user_id)
     
     # Track analytics event
     event_doc = {
@@ -532,7 +617,7 @@ async def update_travel_mode(travel_update: TravelModeUpdate, request: Request,
         "travel_mode": travel_update.travel_mode,
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
-    await db.analytics_events.insert_one(event_doc)
+    analytics.emit(event_doc)
     
     return {"message": "Travel mode updated", "travel_mode": travel_update.travel_mode}
 
@@ -554,14 +639,14 @@ async def get_luggage_savings(request: Request, authorization: Optional[str] = H
     liquid_items_saved = 0
     
     # Count fragile and liquid items
-    for order in orders:
-        for item in order.get("items", []):
-            product = await db.products.find_one({"product_id": item["product_id"]}, {"_id": 0})
-            if product:
-                if product.get("is_fragile"):
-                    fragile_items_saved += item["quantity"]
-                if product.get("is_liquid"):
-                    liquid_items_saved += item["quantity"]
+    items = [item for order in orders for item in order.get("items", [])]
+    products = await loaders().products.load_many(item["product_id"] for item in items)
+    for item, product in zip(items, products):
+        if product:
+            if product.get("is_fragile"):
+                fragile_items_saved += item["quantity"]
+            if product.get("is_liquid"):
+                liquid_items_saved += item["quantity"]
     
     return {
         "total_weight_kg": round(total_weight_saved, 2),
@@ -573,21 +658,18 @@ async def get_luggage_savings(request: Request, authorization: Optional[str] = H
 
 @api_router.get("/products/{product_id}")
 async def get_product(product_id: str):
-    product_doc = await db.products.find_one({"product_id": product_id}, {"_id": 0})
+    product_doc = await loaders().products.load(product_id)
     if not product_doc:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    shop_doc = await db.shops.find_one({"shop_id": product_doc["shop_id"]}, {"_id": 0})
-    
-    if isinstance(product_doc["created_at"], str):
-        product_doc["created_at"] = datetime.fromisoformat(product_doc["created_at"])
+    shop_doc = await loaders().shops.load(product_doc["shop_id"])
     
     product = Product(**product_doc)
     return {**product.model_dump(), "shop": shop_doc}
 
 @api_router.get("/qr/scan/{qr_code_id}")
 async def scan_qr_code(qr_code_id: str, request: Request):
-    qr_doc = await db.qr_codes.find_one({"qr_code_id": qr_code_id}, {"_id": 0})
+    qr_doc = await loaders().qr_codes.load(qr_code_id)
     if not qr_doc:
         raise HTTPException(status_code=404, detail="QR code not found")
     
@@ -595,11 +677,13 @@ async def scan_qr_code(qr_code_id: str, request: Request):
         {"qr_code_id": qr_code_id},
         {
             "$inc": {"scans_count": 1},
-            "$set": {"last_scanned": datetime.now(timezone.utc).isoformat()}
+            "$set": {"last_scanned": datetime.now(timezone.utc)}
         }
     )
     
-    product_doc = await db.products.find_one({"product_id": qr_doc["product_id"]}, {"_id": 0})
+    loaders().qr_codes.clear(qr_code_id)
+    
+    product_doc = await loaders().products.load(qr_doc["product_id"])
     if not product_doc:
         raise HTTPException(status_code=404, detail="Product not found")
     
@@ -610,11 +694,40 @@ async def scan_qr_code(qr_code_id: str, request: Request):
     from fastapi.responses import RedirectResponse
     return RedirectResponse(url=f"{frontend_url}/products/{qr_doc['product_id']}", status_code=303)
 
+async def run_idempotent(scope: str, user: User, idempotency_key: Optional[str], payload: Any, handler):
+    """
+    Run handler, or replay the stored response of an earlier request with the same Idempotency-Key
+    """
+    if idempotency_key is None:
+        return await handler()
+    
+    try:
+        response, replayed = await idempotency_store.run(
+            scope, user.user_id, idempotency_key, payload, handler, encode=jsonable_encoder
+        )
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    if replayed:
+        return JSONResponse(content=response, headers={"Idempotent-Replayed": "true"})
+    return response
+
 @api_router.post("/orders")
-async def create_order(order_data: OrderCreate, request: Request, authorization: Optional[str] = Header(None)):
+async def create_order(
+    order_data: OrderCreate,
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
+):
     user = await get_current_user(request, authorization)
     
-    shop_doc = await db.shops.find_one({"shop_id": order_data.shop_id}, {"_id": 0})
+    return await run_idempotent(
+        "create_order", user, idempotency_key, order_data.model_dump(),
+        lambda: place_order(order_data, user)
+    )
+
+async def place_order(order_data: OrderCreate, user: User) -> Order:
+    shop_doc = await loaders().shops.load(order_data.shop_id)
     if not shop_doc:
         raise HTTPException(status_code=404, detail="Shop not found")
     
@@ -623,20 +736,15 @@ async def create_order(order_data: OrderCreate, request: Request, authorization:
     total_weight = 0.0
     
     # Get product weights
-    for item in order_data.items:
-        product_doc = await db.products.find_one({"product_id": item.product_id}, {"_id": 0})
+    product_docs = await loaders().products.load_many(item.product_id for item in order_data.items)
+    for item, product_doc in zip(order_data.items, product_docs):
         if product_doc:
             weight = product_doc.get("estimated_weight_kg", 0.5)
             total_weight += weight * item.quantity
     
     order_id = f"order_{uuid.uuid4().hex[:12]}"
-    scheduled_delivery = None
-    if order_data.scheduled_delivery:
-        scheduled_delivery = datetime.fromisoformat(order_data.scheduled_delivery)
-    
-    trip_end_date = None
-    if order_data.trip_end_date:
-        trip_end_date = datetime.fromisoformat(order_data.trip_end_date)
+    scheduled_delivery = parse_date(order_data.scheduled_delivery)
+    trip_end_date = parse_date(order_data.trip_end_date)
     
     # Determine if this is a tourist delivery
     is_tourist_delivery = order_data.delivery_type == "delivery" and user.role == "tourist"
@@ -654,13 +762,13 @@ async def create_order(order_data: OrderCreate, request: Request, authorization:
         "delivery_address": order_data.delivery_address,
         "tracking_id": None,
         "gift_message": order_data.gift_message,
-        "scheduled_delivery": scheduled_delivery.isoformat() if scheduled_delivery else None,
+        "scheduled_delivery": scheduled_delivery,
         "ship_after_trip": order_data.ship_after_trip,
-        "trip_end_date": trip_end_date.isoformat() if trip_end_date else None,
+        "trip_end_date": trip_end_date,
         "total_weight_kg": total_weight,
         "delivery_preference_reason": order_data.delivery_preference_reason,
         "is_tourist_delivery": is_tourist_delivery,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.orders.insert_one(order_doc)
     
@@ -675,14 +783,7 @@ async def create_order(order_data: OrderCreate, request: Request, authorization:
             "reason": order_data.delivery_preference_reason,
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
-        await db.analytics_events.insert_one(event_doc)
-    
-    if isinstance(order_doc["created_at"], str):
-        order_doc["created_at"] = datetime.fromisoformat(order_doc["created_at"])
-    if order_doc.get("scheduled_delivery") and isinstance(order_doc["scheduled_delivery"], str):
-        order_doc["scheduled_delivery"] = datetime.fromisoformat(order_doc["scheduled_delivery"])
-    if order_doc.get("trip_end_date") and isinstance(order_doc["trip_end_date"], str):
-        order_doc["trip_end_date"] = datetime.fromisoformat(order_doc["trip_end_date"])
+        analytics.emit(event_doc)
     
     return Order(**order_doc)
 
@@ -693,13 +794,7 @@ async def get_user_orders(request: Request, authorization: Optional[str] = Heade
     orders_cursor = db.orders.find({"buyer_id": user.user_id}, {"_id": 0}).sort("created_at", -1)
     orders = await orders_cursor.to_list(1000)
     
-    for order in orders:
-        if isinstance(order["created_at"], str):
-            order["created_at"] = datetime.fromisoformat(order["created_at"])
-        if order.get("scheduled_delivery") and isinstance(order["scheduled_delivery"], str):
-            order["scheduled_delivery"] = datetime.fromisoformat(order["scheduled_delivery"])
-    
-    return orders
+    return MongoJSONResponse(orders)
 
 @api_router.post("/orders/{order_id}/reorder")
 async def reorder(order_id: str, request: Request, authorization: Optional[str] = Header(None)):
@@ -724,13 +819,10 @@ async def reorder(order_id: str, request: Request, authorization: Optional[str]
         "tracking_id": None,
         "gift_message": None,
         "scheduled_delivery": None,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.orders.insert_one(new_order)
     
-    if isinstance(new_order["created_at"], str):
-        new_order["created_at"] = datetime.fromisoformat(new_order["created_at"])
-    
     return Order(**new_order)
 
 @api_router.post("/users/addresses")
@@ -741,6 +833,7 @@ async def add_address(address: AddressCreate, request: Request, authorization: O
         {"user_id": user.user_id},
         {"$push": {"addresses": address.model_dump()}}
     )
+    user_cache.evict(user.user_id)
     
     return {"message": "Address added successfully"}
 
@@ -764,14 +857,12 @@ async def create_shop(shop_data: ShopCreate, request: Request, authorization: Op
         "categories": shop_data.categories,
         "verified": False,
         "payout_setup": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.shops.insert_one(shop_doc)
     
     await db.users.update_one({"user_id": user.user_id}, {"$set": {"role": "shopkeeper"}})
-    
-    if isinstance(shop_doc["created_at"], str):
-        shop_doc["created_at"] = datetime.fromisoformat(shop_doc["created_at"])
+    user_cache.evict(user.user_id)
     
     return Shop(**shop_doc)
 
@@ -783,9 +874,6 @@ async def get_my_shop(request: Request, authorization: Optional[str] = Header(No
     if not shop_doc:
         raise HTTPException(status_code=404, detail="Shop not found")
     
-    if isinstance(shop_doc["created_at"], str):
-        shop_doc["created_at"] = datetime.fromisoformat(shop_doc["created_at"])
-    
     return Shop(**shop_doc)
 
 @api_router.post("/shops/{shop_id}/products")
@@ -813,7 +901,7 @@ async def create_product(shop_id: str, product_data: ProductCreate, request: Req
         "estimated_weight_kg": product_data.estimated_weight_kg,
         "is_fragile": product_data.is_fragile,
         "is_liquid": product_data.is_liquid,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.products.insert_one(product_doc)
     
@@ -823,13 +911,10 @@ async def create_product(shop_id: str, product_data: ProductCreate, request: Req
         "scans_count": 0,
         "last_scanned": None,
         "analytics": {},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.qr_codes.insert_one(qr_doc)
     
-    if isinstance(product_doc["created_at"], str):
-        product_doc["created_at"] = datetime.fromisoformat(product_doc["created_at"])
-    
     return Product(**product_doc)
 
 @api_router.get("/shops/{shop_id}/products")
@@ -837,11 +922,7 @@ async def get_shop_products(shop_id: str):
     products_cursor = db.products.find({"shop_id": shop_id}, {"_id": 0})
     products = await products_cursor.to_list(1000)
     
-    for product in products:
-        if isinstance(product["created_at"], str):
-            product["created_at"] = datetime.fromisoformat(product["created_at"])
-    
-    return products
+    return MongoJSONResponse(products)
 
 @api_router.get("/qr/generate/{product_id}")
 async def generate_qr_code(product_id: str, request: Request, authorization: Optional[str] = Header(None)):
@@ -882,13 +963,7 @@ async def get_seller_orders(request: Request, authorization: Optional[str] = Hea
     orders_cursor = db.orders.find({"shop_id": shop_doc["shop_id"]}, {"_id": 0}).sort("created_at", -1)
     orders = await orders_cursor.to_list(1000)
     
-    for order in orders:
-        if isinstance(order["created_at"], str):
-            order["created_at"] = datetime.fromisoformat(order["created_at"])
-        if order.get("scheduled_delivery") and isinstance(order["scheduled_delivery"], str):
-            order["scheduled_delivery"] = datetime.fromisoformat(order["scheduled_delivery"])
-    
-    return orders
+    return MongoJSONResponse(orders)
 
 @api_router.put("/orders/{order_id}/tracking")
 async def update_tracking(order_id: str, tracking_data: TrackingUpdate, request: Request, authorization: Optional[str] = Header(None)):
@@ -906,8 +981,45 @@ async def update_tracking(order_id: str, tracking_data: TrackingUpdate, request:
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Order not found")
     
+    await order_events.publish_orders(db, [order_id], "shipped", tracking_id=tracking_data.tracking_id)
+    
     return {"message": "Tracking updated successfully"}
 
+@api_router.get("/events/orders")
+async def stream_order_events(request: Request, authorization: Optional[str] = Header(None)):
+    """
+    Server-sent events of order status transitions for the current user,
+    and for their shop's orders when the user is a seller
+    Replaces polling /checkout/status and /orders; one connection per tab.
+    """
+    user = await get_current_user(request, authorization)
+    
+    channels = [user_channel(user.user_id)]
+    shop_doc = await db.shops.find_one({"owner_id": user.user_id}, {"_id": 0, "shop_id": 1})
+    if shop_doc:
+        channels.append(shop_channel(shop_doc["shop_id"]))
+    
+    queue = order_events.subscribe(channels)
+    
+    async def event_stream():
+        try:
+            yield format_sse({"channels": channels}, "ready")
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), ORDER_EVENT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event, event["type"])
+        finally:
+            order_events.unsubscribe(queue, channels)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api_router.get("/shops/{shop_id}/insights")
 async def get_shop_insights(shop_id: str, request: Request, authorization: Optional[str] = Header(None)):
     user = await get_current_user(request, authorization)
@@ -933,8 +1045,8 @@ async def get_shop_insights(shop_id: str, request: Request, authorization: Optio
     products = await products_cursor.to_list(1000)
     
     qr_scans = 0
-    for product in products:
-        qr_doc = await db.qr_codes.find_one({"qr_code_id": product["qr_code_id"]}, {"_id": 0})
+    qr_docs = await loaders().qr_codes.load_many(product.get("qr_code_id") for product in products)
+    for qr_doc in qr_docs:
         if qr_doc:
             qr_scans += qr_doc.get("scans_count", 0)
     
@@ -957,11 +1069,7 @@ async def get_pending_shops(request: Request, authorization: Optional[str] = Hea
     shops_cursor = db.shops.find({"verified": False}, {"_id": 0})
     shops = await shops_cursor.to_list(1000)
     
-    for shop in shops:
-        if isinstance(shop["created_at"], str):
-            shop["created_at"] = datetime.fromisoformat(shop["created_at"])
-    
-    return shops
+    return MongoJSONResponse(shops)
 
 @api_router.put("/admin/shops/{shop_id}/verify")
 async def verify_shop(shop_id: str, request: Request, authorization: Optional[str] = Header(None)):
@@ -972,6 +1080,7 @@ async def verify_shop(shop_id: str, request: Request, authorization: Optional[st
     result = await db.shops.update_one({"shop_id": shop_id}, {"$set": {"verified": True}})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Shop not found")
+    lookup_caches["shops"].evict(shop_id)
     
     return {"message": "Shop verified successfully"}
 
@@ -984,11 +1093,7 @@ async def get_pending_products(request: Request, authorization: Optional[str] =
     products_cursor = db.products.find({"verified": False}, {"_id": 0})
     products = await products_cursor.to_list(1000)
     
-    for product in products:
-        if isinstance(product["created_at"], str):
-            product["created_at"] = datetime.fromisoformat(product["created_at"])
-    
-    return products
+    return MongoJSONResponse(products)
 
 @api_router.put("/admin/products/{product_id}/verify")
 async def verify_product(product_id: str, request: Request, authorization: Optional[str] = Header(None)):
@@ -999,19 +1104,47 @@ async def verify_product(product_id: str, request: Request, authorization: Optio
     result = await db.products.update_one({"product_id": product_id}, {"$set": {"verified": True}})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    lookup_caches["products"].evict(product_id)
     
     return {"message": "Product verified successfully"}
 
+@api_router.get("/admin/analytics/daily")
+async def get_daily_analytics(
+    request: Request,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    authorization: Optional[str] = Header(None)
+):
+    """
+    Travel-mode and delivery rollups per day (YYYY-MM-DD range, inclusive)
+    Served from analytics_daily_rollups, refreshed every ANALYTICS_ROLLUP_INTERVAL_SECONDS
+    """
+    user = await get_current_user(request, authorization)
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    for day in (start, end):
+        if day:
+            try:
+                datetime.strptime(day, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    
+    return {
+        "days": await analytics_rollup.daily(start, end),
+        "watermark": await analytics_rollup.watermark()
+    }
+
 @api_router.get("/admin/categories")
 async def get_categories():
-    categories_cursor = db.categories.find({}, {"_id": 0})
-    categories = await categories_cursor.to_list(1000)
-    
-    for category in categories:
-        if isinstance(category["created_at"], str):
-            category["created_at"] = datetime.fromisoformat(category["created_at"])
+    categories = category_cache.get("all")
+    if categories is None:
+        version = category_cache.version
+        categories_cursor = db.categories.find({}, {"_id": 0})
+        categories = await categories_cursor.to_list(1000)
+        category_cache.set("all", categories, version)
     
-    return categories
+    return MongoJSONResponse(categories)
 
 @api_router.post("/admin/categories")
 async def create_category(name: str, description: Optional[str] = None, request: Request = None, authorization: Optional[str] = Header(None)):
@@ -1024,17 +1157,57 @@ async def create_category(name: str, description: Optional[str] = None, request:
         "category_id": category_id,
         "name": name,
         "description": description,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.categories.insert_one(category_doc)
-    
-    if isinstance(category_doc["created_at"], str):
-        category_doc["created_at"] = datetime.fromisoformat(category_doc["created_at"])
+    category_cache.clear()
     
     return Category(**category_doc)
 
 # ============= SHIPPING & LOGISTICS ENDPOINTS =============
 
+def fallback_shipping_estimate() -> Dict[str, Any]:
+    """
+    Estimate returned when estimation fails - never block checkout
+    """
+    return {
+        "estimate_id": "fallback",
+        "estimated_cost": 10.0,
+        "currency": "USD",
+        "service_level": "standard",
+        "delivery_days_min": 5,
+        "delivery_days_max": 10,
+        "is_international": False,
+        "is_remote_area": False,
+        "estimation_method": "fallback",
+        "options": [],
+        "note": "Estimated cost - final cost may vary"
+    }
+
+def shop_from_address(shop_doc: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Shipping origin for a shop
+    """
+    return {
+        "name": shop_doc["name"],
+        "street": shop_doc["location"].get("street", ""),
+        "city": shop_doc["location"].get("city", ""),
+        "state": shop_doc["location"].get("state", ""),
+        "postal_code": shop_doc["location"].get("postal_code", ""),
+        "country": shop_doc["location"].get("country", "IN"),
+        "phone": shop_doc.get("phone", ""),
+        "email": shop_doc.get("email", "")
+    }
+
+def order_to_address(order_doc: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Shipping destination for an order
+    """
+    to_address = order_doc.get("delivery_address") or {}
+    to_address["name"] = order_doc.get("buyer_name", "Customer")
+    to_address["country"] = to_address.get("country", "IN")
+    return to_address
+
 @api_router.post("/shipping/estimate")
 async def estimate_shipping_cost(estimate_req: ShippingEstimateRequest, request: Request, authorization: Optional[str] = Header(None)):
     """
@@ -1068,7 +1241,8 @@ async def estimate_shipping_cost(estimate_req: ShippingEstimateRequest, request:
             "is_international": estimate['is_international'],
             "is_remote_area": estimate['is_remote_area'],
             "estimation_method": estimate['estimation_method'],
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "options": estimate.get('options', []),
+            "created_at": datetime.now(timezone.utc)
         }
         await db.shipment_estimates.insert_one(estimate_doc)
         
@@ -1080,24 +1254,70 @@ async def estimate_shipping_cost(estimate_req: ShippingEstimateRequest, request:
     except Exception as e:
         logger.error(f"Shipping estimation error: {e}")
         # Never block checkout - return fallback estimate
-        return {
-            "estimate_id": "fallback",
-            "estimated_cost": 10.0,
-            "currency": "USD",
-            "service_level": "standard",
-            "delivery_days_min": 5,
-            "delivery_days_max": 10,
-            "is_international": False,
-            "is_remote_area": False,
-            "estimation_method": "fallback",
-            "note": "Estimated cost - final cost may vary"
-        }
+        return fallback_shipping_estimate()
+
+@api_router.post("/shipping/estimate/batch")
+async def estimate_shipping_cost_batch(batch_req: ShippingEstimateBatchRequest, request: Request, authorization: Optional[str] = Header(None)):
+    """
+    Estimate shipping cost for many (from, to, weight) routes in one call
+    Identical routes are estimated once, all estimates are saved with one insert
+    """
+    await get_current_user(request, authorization)
+    
+    if len(batch_req.items) > BATCH_ESTIMATE_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_ESTIMATE_MAX_ITEMS} items per batch")
+    
+    if not batch_req.items:
+        return {"estimates": []}
+    
+    results = await shipping_estimator.estimate_shipping_batch([
+        (item.from_address, item.to_address, item.weight_kg)
+        for item in batch_req.items
+    ])
+    
+    created_at = datetime.now(timezone.utc)
+    estimates = []
+    estimate_docs = []
+    
+    for item, estimate in zip(batch_req.items, results):
+        if isinstance(estimate, Exception):
+            logger.error(f"Shipping estimation error: {estimate}")
+            estimates.append(fallback_shipping_estimate())
+            continue
+        
+        estimate_id = f"est_{uuid.uuid4().hex[:12]}"
+        estimate_docs.append({
+            "estimate_id": estimate_id,
+            "order_id": item.order_id,
+            "from_address": item.from_address,
+            "to_address": item.to_address,
+            "weight_kg": item.weight_kg,
+            "estimated_cost": estimate['estimated_cost'],
+            "currency": estimate['currency'],
+            "service_level": estimate['service_level'],
+            "delivery_days_min": estimate['delivery_days_min'],
+            "delivery_days_max": estimate['delivery_days_max'],
+            "is_international": estimate['is_international'],
+            "is_remote_area": estimate['is_remote_area'],
+            "estimation_method": estimate['estimation_method'],
+            "options": estimate.get('options', []),
+            "created_at": created_at
+        })
+        estimates.append({"estimate_id": estimate_id, **estimate})
+    
+    if estimate_docs:
+        try:
+            await db.shipment_estimates.insert_many(estimate_docs, ordered=False)
+        except Exception as e:
+            logger.error(f"Failed to save batch shipping estimates: {e}")
+    
+    return {"estimates": estimates}
 
 @api_router.post("/shipping/create")
 async def create_shipment(ship_req: ShipmentCreateRequest, request: Request, authorization: Optional[str] = Header(None)):
     """
-    Create shipment and generate shipping label
-    Called after payment is complete
+    Create shipment and queue shipping label generation
+    Called after payment is complete; the label is produced by background workers
     """
     user = await get_current_user(request, authorization)
     
@@ -1111,57 +1331,142 @@ async def create_shipment(ship_req: ShipmentCreateRequest, request: Request, aut
         shop_doc = await db.shops.find_one({"owner_id": user.user_id}, {"_id": 0})
         if not shop_doc or shop_doc["shop_id"] != order_doc["shop_id"]:
             raise HTTPException(status_code=403, detail="Not authorized")
+        loaders().shops.prime(shop_doc)
     elif user.role != "admin":
         raise HTTPException(status_code=403, detail="Not authorized")
     
     # Get shop address
-    shop_doc = await db.shops.find_one({"shop_id": order_doc["shop_id"]}, {"_id": 0})
+    shop_doc = await loaders().shops.load(order_doc["shop_id"])
     if not shop_doc:
         raise HTTPException(status_code=404, detail="Shop not found")
     
-    from_address = {
-        "name": shop_doc["name"],
-        "street": shop_doc["location"].get("street", ""),
-        "city": shop_doc["location"].get("city", ""),
-        "state": shop_doc["location"].get("state", ""),
-        "postal_code": shop_doc["location"].get("postal_code", ""),
-        "country": shop_doc["location"].get("country", "IN"),
-        "phone": shop_doc.get("phone", ""),
-        "email": shop_doc.get("email", "")
-    }
-    
-    to_address = order_doc.get("delivery_address", {})
-    to_address["name"] = order_doc.get("buyer_name", "Customer")
-    to_address["country"] = to_address.get("country", "IN")
-    
-    weight_kg = order_doc.get("total_weight_kg", 1.0)
-    
     # Create shipment
     try:
-        shipment = await shipment_service.create_shipment(
-            order_id=ship_req.order_id,
-            from_address=from_address,
-            to_address=to_address,
-            weight_kg=weight_kg,
-            customs_info=ship_req.customs_declaration
-        )
-        
-        # Update order with shipment info
-        await db.orders.update_one(
-            {"order_id": ship_req.order_id},
-            {"$set": {
-                "shipment_id": shipment["shipment_id"],
-                "tracking_id": shipment.get("tracking_number"),
-                "status": "shipped" if shipment.get("tracking_number") else "confirmed"
-            }}
-        )
-        
-        return shipment
+        return await ship_order(order_doc, shop_doc, ship_req.customs_declaration)
     
     except Exception as e:
         logger.error(f"Shipment creation error: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to create shipment: {str(e)}")
 
+async def ship_order(order_doc: Dict[str, Any], shop_doc: Dict[str, Any], customs_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Create the shipment for one order
+    The service links it on the order, and the label step marks the order
+    shipped and publishes it, so nothing here writes after the label worker.
+    """
+    return await shipment_service.create_shipment(
+        order_id=order_doc["order_id"],
+        from_address=shop_from_address(shop_doc),
+        to_address=order_to_address(order_doc),
+        weight_kg=order_doc.get("total_weight_kg", 1.0),
+        customs_info=customs_info
+    )
+
+async def process_trip_dispatch_job(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Job handler for "dispatch_trip_order": ship an order once the trip has ended
+    """
+    order_doc = await db.orders.find_one({"order_id": payload["order_id"]}, {"_id": 0})
+    if not order_doc or order_doc.get("shipment_id"):
+        return None
+    
+    shop_doc = await loaders().shops.load(order_doc["shop_id"])
+    if not shop_doc:
+        raise ValueError(f"Shop not found: {order_doc['shop_id']}")
+    
+    shipment = await ship_order(order_doc, shop_doc)
+    return {"shipment_id": shipment["shipment_id"]}
+
+dispatch_workers.register("dispatch_trip_order", process_trip_dispatch_job)
+
+@api_router.post("/shipping/create/bulk")
+async def create_shipments_bulk(bulk_req: BulkShipmentCreateRequest, request: Request, authorization: Optional[str] = Header(None)):
+    """
+    Create shipments for many of a shop's orders in one call
+    Takes explicit order_ids or all_confirmed for every confirmed delivery order
+    not yet shipped. Returns one result per order.
+    """
+    user = await get_current_user(request, authorization)
+    
+    if user.role == "shopkeeper":
+        shop_doc = await db.shops.find_one({"owner_id": user.user_id}, {"_id": 0})
+        if not shop_doc:
+            raise HTTPException(status_code=403, detail="Not authorized")
+    elif user.role == "admin":
+        if not bulk_req.shop_id:
+            raise HTTPException(status_code=400, detail="shop_id is required")
+        shop_doc = await loaders().shops.load(bulk_req.shop_id)
+        if not shop_doc:
+            raise HTTPException(status_code=404, detail="Shop not found")
+    else:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    if not bulk_req.order_ids and not bulk_req.all_confirmed:
+        raise HTTPException(status_code=400, detail="Provide order_ids or set all_confirmed")
+    
+    requested_ids = list(dict.fromkeys(bulk_req.order_ids))
+    order_query = {"shop_id": shop_doc["shop_id"]}
+    if requested_ids:
+        order_query["order_id"] = {"$in": requested_ids}
+    else:
+        # Ship-after-trip orders are left to the dispatch scheduler until the trip ends
+        order_query.update({
+            "status": "confirmed",
+            "delivery_type": "delivery",
+            "shipment_id": {"$exists": False},
+            "$or": [
+                {"ship_after_trip": {"$ne": True}},
+                on_or_before("trip_end_date", datetime.now(timezone.utc))
+            ]
+        })
+    
+    order_docs = await db.orders.find(order_query, {"_id": 0}).to_list(None)
+    found = {order["order_id"]: order for order in order_docs}
+    order_ids = requested_ids or list(found)
+    
+    results = {}
+    to_ship = []
+    for order_id in order_ids:
+        order_doc = found.get(order_id)
+        if not order_doc:
+            results[order_id] = {"order_id": order_id, "error": "Order not found"}
+        elif order_doc.get("shipment_id"):
+            results[order_id] = {"order_id": order_id, "error": "Shipment already created", "shipment_id": order_doc["shipment_id"]}
+        else:
+            to_ship.append({
+                "order_id": order_id,
+                "buyer_id": order_doc["buyer_id"],
+                "to_address": order_to_address(order_doc),
+                "weight_kg": order_doc.get("total_weight_kg", 1.0),
+                "customs_info": bulk_req.customs_declarations.get(order_id),
+                "ship_after_trip": order_doc.get("ship_after_trip", False),
+                "trip_end_date": order_doc.get("trip_end_date")
+            })
+    
+    try:
+        if bulk_req.consolidate:
+            created = await shipment_service.create_consolidated_shipments(shop_from_address(shop_doc), to_ship)
+        else:
+            created = await shipment_service.create_shipments_bulk(shop_from_address(shop_doc), to_ship)
+    except Exception as e:
+        logger.error(f"Bulk shipment creation error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to create shipments: {str(e)}")
+    
+    # Orders are linked by the service before their label jobs are queued;
+    # the label workers mark them shipped
+    for result in created:
+        # A consolidated shipment covers several orders
+        for shipped_order_id in result["order_ids"]:
+            results[shipped_order_id] = {**result, "order_id": shipped_order_id}
+    
+    ordered_results = [results[order_id] for order_id in order_ids]
+    return {
+        "created": sum(1 for result in ordered_results if result.get("shipment")),
+        "shipments": sum(1 for result in created if result.get("shipment")),
+        "failed": sum(1 for result in ordered_results if result.get("error")),
+        "results": ordered_results
+    }
+
 @api_router.get("/shipping/shipment/{shipment_id}")
 async def get_shipment(shipment_id: str, request: Request, authorization: Optional[str] = Header(None)):
     """
@@ -1173,11 +1478,9 @@ async def get_shipment(shipment_id: str, request: Request, authorization: Option
     if not shipment:
         raise HTTPException(status_code=404, detail="Shipment not found")
     
-    # Get tracking events
-    tracking_events = await db.tracking_events.find(
-        {"shipment_id": shipment_id},
-        {"_id": 0}
-    ).sort("occurred_at", -1).to_list(100)
+    # Recent tracking events are embedded on the shipment
+    tracking_events = await tracking_service.recent_events(shipment)
+    shipment.pop("recent_events", None)
     
     return {
         **shipment,
@@ -1191,15 +1494,17 @@ async def get_order_shipment(order_id: str, request: Request, authorization: Opt
     """
     user = await get_current_user(request, authorization)
     
-    shipment = await db.shipments.find_one({"order_id": order_id}, {"_id": 0})
+    # Consolidated shipments list every order they carry in order_ids
+    shipment = await db.shipments.find_one(
+        {"$or": [{"order_id": order_id}, {"order_ids": order_id}]},
+        {"_id": 0}
+    )
     if not shipment:
         return {"message": "No shipment created yet"}
     
-    # Get tracking events
-    tracking_events = await db.tracking_events.find(
-        {"shipment_id": shipment["shipment_id"]},
-        {"_id": 0}
-    ).sort("occurred_at", -1).to_list(100)
+    # Recent tracking events are embedded on the shipment
+    tracking_events = await tracking_service.recent_events(shipment)
+    shipment.pop("recent_events", None)
     
     return {
         **shipment,
@@ -1210,28 +1515,84 @@ async def get_order_shipment(order_id: str, request: Request, authorization: Opt
 async def handle_tracking_webhook(request: Request):
     """
     Handle tracking updates from shipping providers
+    Accepts a single event, a list of events or {"events": [...]}
+    Events are stored in the webhook inbox and applied by background workers
     """
     try:
         data = await request.json()
-        
-        # Process tracking event
-        success = await tracking_service.process_tracking_event(data)
-        
-        if success:
-            return {"status": "success"}
-        else:
-            return {"status": "failed", "message": "Shipment not found"}
-    
     except Exception as e:
         logger.error(f"Tracking webhook error: {e}")
-        return {"status": "error", "message": str(e)}
+        return {"status": "error", "message": "Invalid JSON"}
+    
+    if isinstance(data, dict):
+        events = data["events"] if "events" in data else [data]
+    else:
+        events = data
+    if not isinstance(events, list):
+        return {"status": "error", "message": "events must be a list"}
+    
+    # One inbox item per tracking number keeps each shipment's events in order
+    by_tracking_number: Dict[str, List[Dict[str, Any]]] = {}
+    for event in events:
+        tracking_number = event.get("tracking_number") if isinstance(event, dict) else None
+        by_tracking_number.setdefault(tracking_number or "", []).append(event)
+    
+    inbox_ids = await webhook_inbox.record_many("tracking", [
+        {"ordering_key": f"tracking:{tracking_number}", "payload": {"events": grouped}}
+        for tracking_number, grouped in by_tracking_number.items()
+    ])
+    
+    return {"status": "accepted", "received": len(events), "inbox_ids": inbox_ids}
+
+async def process_tracking_inbox_item(payload: Dict[str, Any]):
+    await tracking_service.process_tracking_events(payload["events"])
+
+@api_router.get("/shipping/provider/status")
+async def get_shipping_provider_status(request: Request, authorization: Optional[str] = Header(None)):
+    """
+    Shippo client state: circuit breaker, in-flight calls and limits
+    """
+    user = await get_current_user(request, authorization)
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return {
+        **shippo_client.status(),
+        "label_queue": await label_queue.stats()
+    }
+
+@api_router.post("/admin/shipping/remote-areas/reload")
+async def reload_remote_areas(request: Request, authorization: Optional[str] = Header(None)):
+    """
+    Rebuild the remote-area index from the remote_areas collection
+    Only this worker is rebuilt here; the others already follow every
+    remote_areas write through the cache invalidation bus. Without change
+    streams (standalone MongoDB) each worker keeps its startup index.
+    """
+    user = await get_current_user(request, authorization)
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return await remote_areas.reload(db)
 
 # ============= PAYMENT ENDPOINTS =============
 
 @api_router.post("/checkout/session")
-async def create_checkout_session(checkout_req: CheckoutRequest, request: Request, authorization: Optional[str] = Header(None)):
+async def create_checkout_session(
+    checkout_req: CheckoutRequest,
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
+):
     user = await get_current_user(request, authorization)
+    webhook_url = f"{str(request.base_url)}api/webhook/stripe"
     
+    return await run_idempotent(
+        "checkout_session", user, idempotency_key, checkout_req.model_dump(),
+        lambda: start_checkout(checkout_req, user, webhook_url)
+    )
+
+async def start_checkout(checkout_req: CheckoutRequest, user: User, webhook_url: str) -> Dict[str, str]:
     order_doc = await db.orders.find_one({"order_id": checkout_req.order_id, "buyer_id": user.user_id}, {"_id": 0})
     if not order_doc:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -1240,9 +1601,6 @@ async def create_checkout_session(checkout_req: CheckoutRequest, request: Reques
     success_url = f"{host_url}/checkout/success?session_id={{{{CHECKOUT_SESSION_ID}}}}"
     cancel_url = f"{host_url}/checkout"
     
-    webhook_url = f"{str(request.base_url)}api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
-    
     checkout_session_req = CheckoutSessionRequest(
         amount=order_doc["total"],
         currency=order_doc["currency"],
@@ -1255,7 +1613,7 @@ async def create_checkout_session(checkout_req: CheckoutRequest, request: Reques
         }
     )
     
-    session: CheckoutSessionResponse = await stripe_checkout.create_checkout_session(checkout_session_req)
+    session: CheckoutSessionResponse = await checkout_service.create_session(webhook_url, checkout_session_req)
     
     transaction_id = f"txn_{uuid.uuid4().hex[:12]}"
     transaction_doc = {
@@ -1267,7 +1625,7 @@ async def create_checkout_session(checkout_req: CheckoutRequest, request: Reques
         "currency": order_doc["currency"],
         "payment_status": "pending",
         "metadata": {"order_id": checkout_req.order_id},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.payment_transactions.insert_one(transaction_doc)
     
@@ -1275,66 +1633,130 @@ async def create_checkout_session(checkout_req: CheckoutRequest, request: Reques
 
 @api_router.get("/checkout/status/{session_id}")
 async def get_checkout_status(session_id: str, request: Request, authorization: Optional[str] = Header(None)):
+    """
+    Polled by the success page; answered from the checkout status cache when
+    possible, Stripe is asked at most once per session per cache interval
+    """
     user = await get_current_user(request, authorization)
     
+    cached = checkout_service.cached_status(session_id, user.user_id)
+    if cached is not None:
+        return cached
+    
     transaction_doc = await db.payment_transactions.find_one({"session_id": session_id, "user_id": user.user_id}, {"_id": 0})
     if not transaction_doc:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
     if transaction_doc["payment_status"] == "paid":
-        return {"status": "complete", "payment_status": "paid"}
+        paid_status = {"status": "complete", "payment_status": "paid"}
+        checkout_service.record_status(session_id, user.user_id, paid_status)
+        return paid_status
     
     webhook_url = f"{str(request.base_url)}api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+    checkout_status = await checkout_service.get_status(webhook_url, session_id, user.user_id)
     
-    checkout_status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
+    if checkout_status["payment_status"] == "paid":
+        await mark_checkout_paid(session_id, transaction_doc["order_id"])
     
-    if checkout_status.payment_status == "paid" and transaction_doc["payment_status"] != "paid":
-        await db.payment_transactions.update_one(
-            {"session_id": session_id},
-            {"$set": {"payment_status": "paid"}}
-        )
-        
-        await db.orders.update_one(
-            {"order_id": transaction_doc["order_id"]},
-            {"$set": {"status": "confirmed"}}
-        )
+    return checkout_status
+
+async def mark_checkout_paid(session_id: str, order_id: str):
+    """
+    Confirm the order once, whether the poll or the webhook sees the payment first
+    """
+    result = await db.payment_transactions.update_one(
+        {"session_id": session_id, "payment_status": {"$ne": "paid"}},
+        {"$set": {"payment_status": "paid"}}
+    )
+    if result.modified_count == 0:
+        return
     
-    return {
-        "status": checkout_status.status,
-        "payment_status": checkout_status.payment_status,
-        "amount_total": checkout_status.amount_total,
-        "currency": checkout_status.currency
-    }
+    await db.orders.update_one(
+        {"order_id": order_id},
+        {"$set": {"status": "confirmed"}}
+    )
+    dispatch_scheduler.notify()
+    await order_events.publish_orders(db, [order_id], "confirmed", payment_status="paid", session_id=session_id)
 
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
+    """
+    Verify the Stripe signature, store the event and acknowledge; applied by inbox workers
+    """
     body = await request.body()
     signature = request.headers.get("Stripe-Signature")
     
     webhook_url = f"{str(request.base_url)}api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
     
+    # Only verified events reach the inbox, a forged one is rejected here
     try:
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
-        
-        if webhook_response.payment_status == "paid":
-            order_id = webhook_response.metadata.get("order_id")
-            if order_id:
-                await db.payment_transactions.update_one(
-                    {"session_id": webhook_response.session_id},
-                    {"$set": {"payment_status": "paid"}}
-                )
-                
-                await db.orders.update_one(
-                    {"order_id": order_id},
-                    {"$set": {"status": "confirmed"}}
-                )
-        
-        return {"status": "success"}
+        webhook_response = await checkout_service.handle_webhook(webhook_url, body, signature)
     except Exception as e:
         logger.error(f"Webhook error: {e}")
         raise HTTPException(status_code=400, detail=str(e))
+    
+    # Order events per checkout session
+    session_id = webhook_response.session_id
+    inbox_id = await webhook_inbox.record("stripe", f"stripe:{session_id}", {
+        "session_id": session_id,
+        "payment_status": webhook_response.payment_status,
+        "metadata": dict(webhook_response.metadata or {})
+    })
+    
+    return {"status": "success", "inbox_id": inbox_id}
+
+async def process_stripe_inbox_item(payload: Dict[str, Any]):
+    if "body" in payload:
+        # Stored raw before events were verified on receipt
+        webhook_response = await checkout_service.handle_webhook(
+            payload["webhook_url"], payload["body"].encode("utf-8"), payload["signature"]
+        )
+        payload = {
+            "session_id": webhook_response.session_id,
+            "payment_status": webhook_response.payment_status,
+            "metadata": webhook_response.metadata or {}
+        }
+    
+    session_id = payload["session_id"]
+    if payload["payment_status"] != "paid":
+        checkout_service.invalidate(session_id)
+        return
+    
+    order_id = payload["metadata"].get("order_id")
+    user_id = payload["metadata"].get("user_id")
+    if user_id:
+        checkout_service.record_status(
+            session_id, user_id, {"status": "complete", "payment_status": "paid"}
+        )
+    if order_id:
+        await mark_checkout_paid(session_id, order_id)
+
+webhook_inbox.register("tracking", process_tracking_inbox_item)
+webhook_inbox.register("stripe", process_stripe_inbox_item)
+
+@api_router.get("/admin/webhooks/inbox")
+async def get_webhook_inbox_stats(request: Request, authorization: Optional[str] = Header(None)):
+    user = await get_current_user(request, authorization)
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return await webhook_inbox.stats()
+
+@api_router.post("/admin/webhooks/replay")
+async def replay_webhooks(replay_req: WebhookReplayRequest, request: Request, authorization: Optional[str] = Header(None)):
+    """
+    Re-run stored webhooks, by inbox id or every item with a status (default: failed)
+    """
+    user = await get_current_user(request, authorization)
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    replayed = await webhook_inbox.replay(
+        inbox_ids=replay_req.inbox_ids or None,
+        source=replay_req.source,
+        status=replay_req.status
+    )
+    return {"replayed": replayed}
 
 # ============= GENERAL ENDPOINTS =============
 
@@ -1346,10 +1768,25 @@ async def root():
 async def list_categories():
     categories_cursor = db.categories.find({}, {"_id": 0})
     categories = await categories_cursor.to_list(1000)
-    return categories
+    return MongoJSONResponse(categories)
 
 app.include_router(api_router)
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """
+    Per-route request and MongoDB command metrics in Prometheus text format
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+if QUERY_TRACE_ENABLED:
+    # Development/staging only: flags N+1 query patterns per request
+    app.add_middleware(QueryTraceMiddleware)
+
+app.add_middleware(LoaderMiddleware, db=db, caches=lookup_caches)
+
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1358,6 +1795,115 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def load_remote_areas():
+    try:
+        await remote_areas.reload(db)
+    except Exception as e:
+        logger.error(f"Failed to load remote areas, using built-in list: {e}")
+
+@app.on_event("startup")
+async def ensure_tracking_indexes():
+    try:
+        await shipment_service.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to create shipment indexes: {e}")
+    # Re-keys legacy events, and logs each index it cannot create
+    await tracking_service.ensure_indexes()
+
+async def compact_tracking_events_periodically():
+    while True:
+        try:
+            await tracking_service.compact_events()
+        except Exception as e:
+            logger.error(f"Tracking event compaction failed: {e}")
+        await asyncio.sleep(TRACKING_COMPACTION_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_tracking_compaction():
+    background_tasks.append(asyncio.create_task(compact_tracking_events_periodically()))
+
+@app.on_event("startup")
+async def ensure_lookup_indexes():
+    try:
+        await ensure_loader_indexes(db)
+    except Exception as e:
+        logger.error(f"Failed to create lookup indexes: {e}")
+
+async def migrate_dates():
+    try:
+        converted = await date_migration.run()
+        if any(converted.values()):
+            logger.info(f"Date migration converted {sum(converted.values())} documents")
+    except Exception as e:
+        logger.error(f"Date migration failed, will resume on next start: {e}")
+
+@app.on_event("startup")
+async def start_date_migration():
+    try:
+        await ensure_date_indexes(db)
+    except Exception as e:
+        logger.error(f"Failed to create date indexes: {e}")
+    if DATE_MIGRATION_ON_STARTUP:
+        background_tasks.append(asyncio.create_task(migrate_dates()))
+
+@app.on_event("startup")
+async def ensure_idempotency_indexes():
+    try:
+        await idempotency_store.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to create idempotency indexes: {e}")
+
+@app.on_event("startup")
+async def start_analytics_emitter():
+    analytics.start()
+
+async def roll_up_analytics_periodically():
+    while True:
+        try:
+            await analytics_rollup.run()
+        except Exception as e:
+            logger.error(f"Analytics rollup failed: {e}")
+        await asyncio.sleep(ANALYTICS_ROLLUP_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_analytics_rollup():
+    try:
+        await analytics_rollup.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to create analytics indexes: {e}")
+    background_tasks.append(asyncio.create_task(roll_up_analytics_periodically()))
+
+@app.on_event("startup")
+async def start_webhook_inbox():
+    await webhook_inbox.ensure_indexes()
+    await webhook_inbox.start()
+
+@app.on_event("startup")
+async def start_label_workers():
+    await label_queue.ensure_indexes()
+    label_workers.start()
+
+@app.on_event("startup")
+async def start_cache_bus():
+    if CACHE_INVALIDATION_ENABLED:
+        cache_bus.start()
+
+@app.on_event("startup")
+async def start_dispatch_scheduler():
+    await dispatch_scheduler.ensure_indexes()
+    dispatch_workers.start()
+    dispatch_scheduler.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await webhook_inbox.stop()
+    await dispatch_scheduler.stop()
+    await dispatch_workers.stop()
+    await label_workers.stop()
+    await shippo_client.close()
+    await analytics.stop()
+    await cache_bus.stop()
     client.close()
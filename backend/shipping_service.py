@@ -8,14 +8,26 @@ import logging
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timezone, timedelta
 import asyncio
+import hashlib
+import time
 import aiohttp
+from collections import OrderedDict
+from pymongo import DeleteOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+from cache_bus import LocalCache
 
 logger = logging.getLogger(__name__)
 
 # ============= CONFIGURATION =============
 
 SHIPPO_API_KEY = os.environ.get('SHIPPO_API_KEY', '')
-SHIPPO_API_URL = "https://api.goshippo.com/v1"
+SHIPPO_API_URL = os.environ.get('SHIPPO_API_URL', "https://api.goshippo.com/v1").rstrip('/')
+
+# Shippo client limits
+SHIPPO_TIMEOUT_SECONDS = float(os.environ.get('SHIPPO_TIMEOUT_SECONDS', '10'))
+SHIPPO_MAX_CONCURRENCY = int(os.environ.get('SHIPPO_MAX_CONCURRENCY', '20'))
+SHIPPO_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('SHIPPO_BREAKER_FAILURE_THRESHOLD', '5'))
+SHIPPO_BREAKER_RESET_SECONDS = float(os.environ.get('SHIPPO_BREAKER_RESET_SECONDS', '30'))
 
 # Country coverage
 SUPPORTED_COUNTRIES = {
@@ -29,12 +41,363 @@ SUPPORTED_COUNTRIES = {
     'FR': 'France'
 }
 
-# Remote area detection (simplified)
+# Built-in remote areas, extended by the `remote_areas` collection
 REMOTE_CITIES = {
-    'IN': ['Leh', 'Ladakh', 'Andaman', 'Nicobar', 'Srinagar'],
+    'IN': ['Leh', 'Ladakh', 'Andaman', 'Nicobar', 'Srinagar', 'Port Blair', 'Kargil'],
     'JP': ['Okinawa', 'Hokkaido']
 }
 
+REMOTE_POSTAL_PREFIXES = {
+    'IN': ['194', '744'],  # Ladakh, Andaman & Nicobar
+    'JP': ['900', '901', '902', '903', '904', '905', '906', '907']  # Okinawa
+}
+
+# Quote aggregation
+# Sources that have not answered within the budget are left running in the
+# background and their result is cached for the next request on the same route.
+ESTIMATE_LATENCY_BUDGET_SECONDS = float(os.environ.get('SHIPPING_ESTIMATE_BUDGET_SECONDS', '1.5'))
+ESTIMATE_CACHE_TTL_SECONDS = int(os.environ.get('SHIPPING_ESTIMATE_CACHE_TTL_SECONDS', '900'))
+ESTIMATE_CACHE_MAX_ENTRIES = int(os.environ.get('SHIPPING_ESTIMATE_CACHE_MAX_ENTRIES', '10000'))
+
+# Background label creation
+LABEL_WORKER_CONCURRENCY = int(os.environ.get('LABEL_WORKER_CONCURRENCY', '4'))
+
+# Batch estimation
+BATCH_ESTIMATE_MAX_ITEMS = int(os.environ.get('SHIPPING_BATCH_MAX_ITEMS', '200'))
+BATCH_ESTIMATE_CONCURRENCY = int(os.environ.get('SHIPPING_BATCH_CONCURRENCY', '16'))
+
+# Rule-based service levels: (cost multiplier, delivery days multiplier)
+RULE_SERVICE_LEVELS = {
+    'economy': (0.8, 1.5),
+    'standard': (1.0, 1.0),
+    'express': (1.8, 0.5)
+}
+
+# ============= SHIPPO HTTP CLIENT =============
+
+class ShippoUnavailable(Exception):
+    """
+    Raised when the circuit breaker is open and Shippo is not called
+    """
+    pass
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+    closed -> open after `failure_threshold` failures in a row,
+    open -> half_open after `reset_seconds`, half_open lets one trial call through
+    """
+    
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._state = 'closed'
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._total_failures = 0
+        self._total_rejected = 0
+    
+    @property
+    def state(self) -> str:
+        if self._state == 'open' and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self._state = 'half_open'
+            self._trial_in_flight = False
+        return self._state
+    
+    def is_open(self) -> bool:
+        """
+        Cheap check for callers that want to skip the API path entirely
+        """
+        state = self.state
+        return state == 'open' or (state == 'half_open' and self._trial_in_flight)
+    
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        self._total_rejected += 1
+        return False
+    
+    def record_success(self) -> None:
+        self._state = 'closed'
+        self._consecutive_failures = 0
+        self._trial_in_flight = False
+    
+    def record_failure(self) -> None:
+        self._consecutive_failures += 1
+        self._total_failures += 1
+        self._trial_in_flight = False
+        if self._state == 'half_open' or self._consecutive_failures >= self.failure_threshold:
+            if self._state != 'open':
+                logger.warning(
+                    f"Shippo circuit breaker opened after {self._consecutive_failures} consecutive failures"
+                )
+            self._state = 'open'
+            self._opened_at = time.monotonic()
+    
+    def release_trial(self) -> None:
+        """
+        Free the half-open trial slot when the trial ended without an outcome
+        """
+        self._trial_in_flight = False
+    
+    def snapshot(self) -> Dict:
+        state = self.state
+        retry_in = 0.0
+        if state == 'open':
+            retry_in = max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+        return {
+            'state': state,
+            'consecutive_failures': self._consecutive_failures,
+            'failure_threshold': self.failure_threshold,
+            'reset_seconds': self.reset_seconds,
+            'retry_in_seconds': round(retry_in, 2),
+            'total_failures': self._total_failures,
+            'total_rejected': self._total_rejected
+        }
+
+class ShippoClient:
+    """
+    Process-wide Shippo HTTP client
+    One pooled aiohttp session, bounded concurrency and a circuit breaker
+    """
+    
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore = asyncio.Semaphore(SHIPPO_MAX_CONCURRENCY)
+        self._in_flight = 0
+        self.breaker = CircuitBreaker(
+            SHIPPO_BREAKER_FAILURE_THRESHOLD, SHIPPO_BREAKER_RESET_SECONDS
+        )
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=SHIPPO_MAX_CONCURRENCY,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=30
+                ),
+                timeout=aiohttp.ClientTimeout(total=SHIPPO_TIMEOUT_SECONDS),
+                headers={
+                    "Authorization": f"ShippoToken {SHIPPO_API_KEY}",
+                    "Content-Type": "application/json"
+                }
+            )
+        return self._session
+    
+    def is_available(self) -> bool:
+        return bool(SHIPPO_API_KEY) and not self.breaker.is_open()
+    
+    async def post(self, path: str, payload: Dict) -> Tuple[int, Dict]:
+        """
+        POST to Shippo, returns (status, json body)
+        Any error, including an unparsable body, and 5xx responses count as
+        breaker failures; a 5xx body is not parsed and comes back empty.
+        """
+        
+        if not self.breaker.allow_request():
+            raise ShippoUnavailable("Shippo circuit breaker is open")
+        is_trial = self.breaker.state == 'half_open'
+        
+        try:
+            async with self._semaphore:
+                self._in_flight += 1
+                try:
+                    async with self._get_session().post(
+                        f"{SHIPPO_API_URL}{path}", json=payload
+                    ) as response:
+                        status = response.status
+                        data = None
+                        if status < 500:
+                            data = await response.json(content_type=None)
+                finally:
+                    self._in_flight -= 1
+            
+            if status >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        finally:
+            # A cancelled trial records nothing, it must not hold the slot
+            if is_trial:
+                self.breaker.release_trial()
+        
+        return status, data or {}
+    
+    def status(self) -> Dict:
+        return {
+            'configured': bool(SHIPPO_API_KEY),
+            'in_flight': self._in_flight,
+            'max_concurrency': SHIPPO_MAX_CONCURRENCY,
+            'timeout_seconds': SHIPPO_TIMEOUT_SECONDS,
+            'circuit_breaker': self.breaker.snapshot()
+        }
+    
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+shippo_client = ShippoClient()
+
+# ============= REMOTE AREA INDEX =============
+
+def _normalize_city(city: str) -> str:
+    return ' '.join(city.lower().replace(',', ' ').replace('-', ' ').split())
+
+def _normalize_postal_code(postal_code: str) -> str:
+    return ''.join(postal_code.upper().split()).replace('-', '')
+
+class RemoteAreaIndex:
+    """
+    Remote-area lookup compiled from postal-code prefixes and city names
+    Postal codes are matched against a per-country prefix trie, cities
+    against a hashed set of normalized names - both O(length of input)
+    """
+    
+    # Longest city name (in words) looked up as a phrase inside the address city
+    MAX_CITY_WORDS = 3
+    
+    def __init__(self):
+        self._postal_tries: Dict[str, Dict] = {}
+        self._cities: Dict[str, set] = {}
+        self.loaded_at: Optional[str] = None
+    
+    @classmethod
+    def build(cls, areas: List[Dict]) -> 'RemoteAreaIndex':
+        """
+        Compile [{country, postal_prefixes, cities}] into a new index
+        """
+        index = cls()
+        for area in areas:
+            country = area.get('country', '').upper()
+            if not country:
+                continue
+            trie = index._postal_tries.setdefault(country, {})
+            for prefix in area.get('postal_prefixes', []):
+                prefix = _normalize_postal_code(prefix)
+                if not prefix:
+                    continue
+                node = trie
+                for char in prefix:
+                    node = node.setdefault(char, {})
+                node['$'] = True
+            cities = index._cities.setdefault(country, set())
+            for city in area.get('cities', []):
+                city = _normalize_city(city)
+                if city:
+                    cities.add(city)
+        index.loaded_at = datetime.now(timezone.utc).isoformat()
+        return index
+    
+    @staticmethod
+    def builtin_areas() -> List[Dict]:
+        countries = set(REMOTE_CITIES) | set(REMOTE_POSTAL_PREFIXES)
+        return [
+            {
+                'country': country,
+                'postal_prefixes': REMOTE_POSTAL_PREFIXES.get(country, []),
+                'cities': REMOTE_CITIES.get(country, [])
+            }
+            for country in countries
+        ]
+    
+    def is_remote(self, address: Dict) -> bool:
+        country = address.get('country', '').upper()
+        
+        trie = self._postal_tries.get(country)
+        postal_code = address.get('postal_code') or address.get('zip_code') or address.get('zip') or ''
+        if trie and postal_code:
+            node = trie
+            for char in _normalize_postal_code(postal_code):
+                node = node.get(char)
+                if node is None:
+                    break
+                if '$' in node:
+                    return True
+        
+        cities = self._cities.get(country)
+        city = address.get('city', '')
+        if cities and city:
+            words = _normalize_city(city).split()
+            for size in range(1, min(self.MAX_CITY_WORDS, len(words)) + 1):
+                for start in range(len(words) - size + 1):
+                    if ' '.join(words[start:start + size]) in cities:
+                        return True
+        
+        return False
+    
+    def stats(self) -> Dict:
+        def count_prefixes(node: Dict) -> int:
+            return sum(1 if key == '$' else count_prefixes(child) for key, child in node.items())
+        
+        return {
+            'countries': sorted(set(self._postal_tries) | set(self._cities)),
+            'postal_prefixes': sum(count_prefixes(trie) for trie in self._postal_tries.values()),
+            'cities': sum(len(cities) for cities in self._cities.values()),
+            'loaded_at': self.loaded_at
+        }
+
+class RemoteAreaRegistry:
+    """
+    Holds the active RemoteAreaIndex; reload() swaps in a freshly built one
+    Each worker holds its own index. reload() only rebuilds this process's;
+    schedule_reload() is subscribed to remote_areas changes on the cache
+    invalidation bus so every worker rebuilds when the collection is written.
+    """
+    
+    def __init__(self):
+        self.index = RemoteAreaIndex.build(RemoteAreaIndex.builtin_areas())
+        self._reload_task: Optional[asyncio.Task] = None
+        self._reload_pending = False
+    
+    def schedule_reload(self, db) -> None:
+        """
+        Reload in the background, coalescing a burst of changes into one more rebuild
+        """
+        if self._reload_task is not None and not self._reload_task.done():
+            self._reload_pending = True
+            return
+        self._reload_task = asyncio.create_task(self._reload_until_settled(db))
+    
+    async def _reload_until_settled(self, db) -> None:
+        while True:
+            self._reload_pending = False
+            try:
+                await self.reload(db)
+            except Exception as e:
+                logger.error(f"Failed to reload remote areas: {e}")
+            if not self._reload_pending:
+                return
+    
+    async def reload(self, db) -> Dict:
+        """
+        Rebuild this worker's index from built-in areas plus active `remote_areas` documents
+        """
+        areas = RemoteAreaIndex.builtin_areas()
+        async for area in db.remote_areas.find({"is_active": {"$ne": False}}, {"_id": 0}):
+            areas.append(area)
+        
+        self.index = RemoteAreaIndex.build(areas)
+        stats = self.index.stats()
+        logger.info(
+            f"Loaded remote areas: {stats['postal_prefixes']} postal prefixes, {stats['cities']} cities"
+        )
+        return stats
+    
+    def is_remote(self, address: Dict) -> bool:
+        return self.index.is_remote(address)
+
+remote_areas = RemoteAreaRegistry()
+
 # ============= SHIPPING ESTIMATION ENGINE =============
 
 class ShippingEstimator:
@@ -48,6 +411,11 @@ class ShippingEstimator:
     def __init__(self, db):
         self.db = db
         self.use_api = bool(SHIPPO_API_KEY)
+        # route key -> (expires_at monotonic, options), least recently used first
+        self._quote_cache: "OrderedDict[Tuple, Tuple[float, List[Dict]]]" = OrderedDict()
+        # (from_country, to_country) -> active rate rules; register with the
+        # cache invalidation bus, it serves nothing until connected
+        self.rule_cache = LocalCache("shipping_rate_rules")
     
     async def estimate_shipping(
         self,
@@ -66,40 +434,226 @@ class ShippingEstimator:
             'delivery_days_max': int,
             'is_international': bool,
             'is_remote_area': bool,
-            'estimation_method': str
+            'estimation_method': str,
+            'options': List[Dict]  # every service level, ranked by cost
         }
         """
         
+        options = await self.estimate_options(from_address, to_address, weight_kg)
+        
+        # Rule-based estimates keep quoting standard, API estimates the cheapest rate
+        headline = options[0]
+        if headline['estimation_method'] == 'rule_based':
+            headline = next(
+                (o for o in options if o['service_level'] == 'standard'), headline
+            )
+        
+        result = dict(headline)
+        result['options'] = options
+        return result
+    
+    async def estimate_shipping_batch(
+        self,
+        routes: List[Tuple[Dict, Dict, float]]
+    ) -> List[Dict]:
+        """
+        Estimate many (from_address, to_address, weight_kg) routes at once
+        Identical routes are estimated once; results come back in input order.
+        A route whose estimation raised gets the exception in its slot.
+        """
+        
+        keys = []
+        unique_routes = {}
+        for from_address, to_address, weight_kg in routes:
+            key = self._route_cache_key(from_address, to_address, weight_kg)[:-1] + (weight_kg,)
+            keys.append(key)
+            unique_routes.setdefault(key, (from_address, to_address, weight_kg))
+        
+        semaphore = asyncio.Semaphore(BATCH_ESTIMATE_CONCURRENCY)
+        
+        async def run(from_address: Dict, to_address: Dict, weight_kg: float) -> Dict:
+            async with semaphore:
+                return await self.estimate_shipping(from_address, to_address, weight_kg, order_id="")
+        
+        results = await asyncio.gather(
+            *(run(*route) for route in unique_routes.values()),
+            return_exceptions=True
+        )
+        by_key = dict(zip(unique_routes.keys(), results))
+        
+        return [
+            by_key[key] if isinstance(by_key[key], Exception) else dict(by_key[key])
+            for key in keys
+        ]
+    
+    async def estimate_options(
+        self,
+        from_address: Dict,
+        to_address: Dict,
+        weight_kg: float,
+        budget_seconds: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        Collect service-level options from all sources concurrently
+        API quotes and rule-based options are merged per service level, API
+        quotes winning; returns them ranked API first, then by cost.
+        """
+        
+        if budget_seconds is None:
+            budget_seconds = ESTIMATE_LATENCY_BUDGET_SECONDS
+        
         is_international = from_address['country'] != to_address['country']
         is_remote = self._is_remote_area(to_address)
         
-        # Try real-time API first
+        api_options = None
+        tasks = {}
+        
         if self.use_api:
-            try:
-                result = await self._estimate_via_api(
-                    from_address, to_address, weight_kg
+            cache_key = self._route_cache_key(from_address, to_address, weight_kg)
+            api_options = self._get_cached_quotes(cache_key)
+            # An open breaker skips the provider entirely
+            if api_options is None and shippo_client.is_available():
+                tasks['api'] = asyncio.create_task(
+                    self._estimate_via_api(from_address, to_address, weight_kg)
                 )
-                if result:
-                    result['is_remote_area'] = is_remote
-                    return result
-            except Exception as e:
-                logger.warning(f"API estimation failed: {e}, falling back to rules")
         
-        # Fallback to rule-based estimation
-        result = await self._estimate_via_rules(
-            from_address, to_address, weight_kg, is_international, is_remote
+        tasks['rules'] = asyncio.create_task(
+            self._rule_options(from_address, to_address, weight_kg, is_international, is_remote)
         )
         
-        return result
+        done, pending = await asyncio.wait(tasks.values(), timeout=budget_seconds)
+        
+        api_task = tasks.get('api')
+        if api_task is not None:
+            if api_task in done:
+                api_options = self._task_result(api_task)
+                if api_options:
+                    self._set_cached_quotes(cache_key, api_options)
+            else:
+                # Let the provider finish in the background and warm the cache
+                api_task.add_done_callback(
+                    lambda task, key=cache_key: self._cache_late_quotes(key, task)
+                )
+        
+        if api_options:
+            for option in api_options:
+                option['is_remote_area'] = is_remote
+        
+        rules_task = tasks['rules']
+        if rules_task not in done:
+            # Never block checkout on a slow rules lookup
+            await asyncio.wait([rules_task])
+        
+        rule_options = self._task_result(rules_task)
+        if not rule_options:
+            rule_options = self._default_rule_options(
+                from_address, to_address, weight_kg, is_international, is_remote
+            )
+        
+        return self._rank_options(self._merge_options(api_options or [], rule_options))
+    
+    def _task_result(self, task: asyncio.Task) -> Optional[List[Dict]]:
+        """
+        Result of a finished source task, None if it failed
+        """
+        if task.cancelled():
+            return None
+        exc = task.exception()
+        if exc is not None:
+            logger.warning(f"Shipping quote source failed: {exc}")
+            return None
+        return task.result()
+    
+    def _cache_late_quotes(self, cache_key: Tuple, task: asyncio.Task) -> None:
+        """
+        Store API quotes that arrived after the latency budget
+        """
+        options = self._task_result(task)
+        if options:
+            self._set_cached_quotes(cache_key, options)
+    
+    def _route_cache_key(self, from_address: Dict, to_address: Dict, weight_kg: float) -> Tuple:
+        return (
+            from_address.get('country', ''),
+            from_address.get('postal_code', ''),
+            from_address.get('city', '').lower(),
+            to_address.get('country', ''),
+            to_address.get('postal_code', ''),
+            to_address.get('city', '').lower(),
+            round(weight_kg, 1)
+        )
+    
+    def _get_cached_quotes(self, cache_key: Tuple) -> Optional[List[Dict]]:
+        entry = self._quote_cache.get(cache_key)
+        if not entry:
+            return None
+        expires_at, options = entry
+        if expires_at < time.monotonic():
+            self._quote_cache.pop(cache_key, None)
+            return None
+        self._quote_cache.move_to_end(cache_key)
+        return [dict(option) for option in options]
+    
+    def _set_cached_quotes(self, cache_key: Tuple, options: List[Dict]) -> None:
+        """
+        Cache quotes for a route, bounded to ESTIMATE_CACHE_MAX_ENTRIES
+        When full, expired entries are swept first, then the least recently used evicted.
+        """
+        now = time.monotonic()
+        self._quote_cache[cache_key] = (
+            now + ESTIMATE_CACHE_TTL_SECONDS,
+            [dict(option) for option in options]
+        )
+        self._quote_cache.move_to_end(cache_key)
+        
+        if len(self._quote_cache) <= ESTIMATE_CACHE_MAX_ENTRIES:
+            return
+        expired = [key for key, (expires_at, _) in self._quote_cache.items() if expires_at < now]
+        for key in expired:
+            del self._quote_cache[key]
+        while len(self._quote_cache) > ESTIMATE_CACHE_MAX_ENTRIES:
+            self._quote_cache.popitem(last=False)
+    
+    def _merge_options(self, api_options: List[Dict], rule_options: List[Dict]) -> List[Dict]:
+        """
+        One option per service level: the cheapest API quote, else the rule-based one
+        """
+        merged = {}
+        for option in rule_options:
+            merged[option['service_level'].lower()] = option
+        
+        quoted = set()
+        for option in api_options:
+            level = option['service_level'].lower()
+            current = merged.get(level)
+            if level not in quoted or option['estimated_cost'] < current['estimated_cost']:
+                merged[level] = option
+                quoted.add(level)
+        
+        return list(merged.values())
+    
+    def _rank_options(self, options: List[Dict]) -> List[Dict]:
+        """
+        Rank API quotes ahead of rule-based estimates, then by cost, then by speed
+        """
+        return sorted(
+            options,
+            key=lambda o: (
+                o['estimation_method'] != 'api',
+                o['estimated_cost'],
+                o['delivery_days_max']
+            )
+        )
     
     async def _estimate_via_api(
         self,
         from_address: Dict,
         to_address: Dict,
         weight_kg: float
-    ) -> Optional[Dict]:
+    ) -> Optional[List[Dict]]:
         """
         Use Shippo API for real-time rates
+        Returns one option per carrier service level
         """
         
         if not SHIPPO_API_KEY:
@@ -125,40 +679,52 @@ class ShippingEstimator:
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{SHIPPO_API_URL}/shipments",
-                    headers={
-                        "Authorization": f"ShippoToken {SHIPPO_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    if response.status == 201:
-                        data = await response.json()
-                        
-                        # Get rates
-                        rates = data.get('rates', [])
-                        if rates:
-                            # Pick cheapest standard rate
-                            cheapest = min(rates, key=lambda r: float(r.get('amount', 999999)))
-                            
-                            return {
-                                'estimated_cost': float(cheapest['amount']),
-                                'currency': cheapest['currency'],
-                                'service_level': cheapest.get('servicelevel', {}).get('name', 'standard'),
-                                'delivery_days_min': cheapest.get('estimated_days', 5),
-                                'delivery_days_max': cheapest.get('estimated_days', 7),
-                                'is_international': from_address['country'] != to_address['country'],
-                                'estimation_method': 'api',
-                                'carrier': cheapest.get('provider', 'Unknown')
-                            }
+            status, data = await shippo_client.post("/shipments", payload)
+        except ShippoUnavailable:
+            return None
         except Exception as e:
             logger.error(f"Shippo API error: {e}")
             return None
         
-        return None
+        if status != 201:
+            logger.warning(f"Shippo API returned {status}")
+            return None
+        
+        # Get rates
+        rates = data.get('rates', [])
+        is_international = from_address['country'] != to_address['country']
+        
+        return [
+            {
+                'estimated_cost': float(rate['amount']),
+                'currency': rate['currency'],
+                'service_level': rate.get('servicelevel', {}).get('name', 'standard'),
+                'delivery_days_min': rate.get('estimated_days') or 5,
+                'delivery_days_max': rate.get('estimated_days') or 7,
+                'is_international': is_international,
+                'estimation_method': 'api',
+                'carrier': rate.get('provider', 'Unknown'),
+                'rate_id': rate.get('object_id')
+            }
+            for rate in rates
+            if rate.get('amount') is not None
+        ] or None
+    
+    async def _rate_rules(self, from_country: str, to_country: str) -> List[Dict]:
+        """
+        Active rate rules for a country pair, from the rule cache when possible
+        """
+        key = (from_country, to_country)
+        rules = self.rule_cache.get(key)
+        if rules is None:
+            version = self.rule_cache.version
+            rules = await self.db.shipping_rate_rules.find({
+                "from_country": from_country,
+                "to_country": to_country,
+                "is_active": True
+            }, {"_id": 0}).to_list(None)
+            self.rule_cache.set(key, rules, version)
+        return rules
     
     async def _estimate_via_rules(
         self,
@@ -176,13 +742,13 @@ class ShippingEstimator:
         to_country = to_address['country']
         
         # Try to get rule from database
-        rule = await self.db.shipping_rate_rules.find_one({
-            "from_country": from_country,
-            "to_country": to_country,
-            "weight_min_kg": {"$lte": weight_kg},
-            "weight_max_kg": {"$gte": weight_kg},
-            "is_active": True
-        }, {"_id": 0})
+        rule = next(
+            (
+                rule for rule in await self._rate_rules(from_country, to_country)
+                if rule['weight_min_kg'] <= weight_kg <= rule['weight_max_kg']
+            ),
+            None
+        )
         
         if rule:
             base_rate = rule['base_rate']
@@ -200,15 +766,7 @@ class ShippingEstimator:
         cost = (base_rate + (weight_kg * per_kg_rate)) * remote_multiplier
         
         # Delivery estimate
-        if is_international:
-            delivery_days_min = 7
-            delivery_days_max = 14
-        elif is_remote:
-            delivery_days_min = 5
-            delivery_days_max = 10
-        else:
-            delivery_days_min = 2
-            delivery_days_max = 5
+        delivery_days_min, delivery_days_max = self._rule_delivery_days(is_international, is_remote)
         
         return {
             'estimated_cost': round(cost, 2),
@@ -221,6 +779,71 @@ class ShippingEstimator:
             'estimation_method': 'rule_based'
         }
     
+    async def _rule_options(
+        self,
+        from_address: Dict,
+        to_address: Dict,
+        weight_kg: float,
+        is_international: bool,
+        is_remote: bool
+    ) -> List[Dict]:
+        """
+        Derive economy/standard/express options from the standard rule estimate
+        """
+        
+        standard = await self._estimate_via_rules(
+            from_address, to_address, weight_kg, is_international, is_remote
+        )
+        return self._expand_service_levels(standard)
+    
+    def _default_rule_options(
+        self,
+        from_address: Dict,
+        to_address: Dict,
+        weight_kg: float,
+        is_international: bool,
+        is_remote: bool
+    ) -> List[Dict]:
+        """
+        Hardcoded-rate options, used when the rules lookup itself failed
+        """
+        
+        base_rate, per_kg_rate, currency = self._get_default_rates(
+            from_address['country'], to_address['country']
+        )
+        remote_multiplier = 1.3 if is_remote else 1.0
+        cost = (base_rate + (weight_kg * per_kg_rate)) * remote_multiplier
+        delivery_days_min, delivery_days_max = self._rule_delivery_days(is_international, is_remote)
+        
+        return self._expand_service_levels({
+            'estimated_cost': round(cost, 2),
+            'currency': currency,
+            'service_level': 'standard',
+            'delivery_days_min': delivery_days_min,
+            'delivery_days_max': delivery_days_max,
+            'is_international': is_international,
+            'is_remote_area': is_remote,
+            'estimation_method': 'rule_based'
+        })
+    
+    def _expand_service_levels(self, standard: Dict) -> List[Dict]:
+        options = []
+        for level, (cost_multiplier, days_multiplier) in RULE_SERVICE_LEVELS.items():
+            option = dict(standard)
+            option['service_level'] = level
+            option['estimated_cost'] = round(standard['estimated_cost'] * cost_multiplier, 2)
+            option['delivery_days_min'] = max(1, round(standard['delivery_days_min'] * days_multiplier))
+            option['delivery_days_max'] = max(1, round(standard['delivery_days_max'] * days_multiplier))
+            options.append(option)
+        return options
+    
+    def _rule_delivery_days(self, is_international: bool, is_remote: bool) -> Tuple[int, int]:
+        if is_international:
+            return (7, 14)
+        elif is_remote:
+            return (5, 10)
+        return (2, 5)
+    
     def _get_default_rates(self, from_country: str, to_country: str) -> Tuple[float, float, str]:
         """
         Hardcoded default rates as ultimate fallback
@@ -248,13 +871,7 @@ class ShippingEstimator:
         """
         Detect if address is in a remote area
         """
-        country = address.get('country', '')
-        city = address.get('city', '').lower()
-        
-        if country in REMOTE_CITIES:
-            return any(remote.lower() in city for remote in REMOTE_CITIES[country])
-        
-        return False
+        return remote_areas.is_remote(address)
     
     def _convert_to_shippo_address(self, address: Dict) -> Dict:
         """
@@ -277,11 +894,17 @@ class ShippingEstimator:
 class ShipmentService:
     """
     Handles actual shipment creation, label generation, and tracking
+    With a label_queue, labels are created by background workers instead of
+    inside the request; with order_events, orders moving to shipped are published.
+    Pass the process's shared estimator so label creation reuses its quote
+    cache and its rule cache registered with the invalidation bus.
     """
     
-    def __init__(self, db):
+    def __init__(self, db, estimator=None, label_queue=None, order_events=None):
         self.db = db
-        self.estimator = ShippingEstimator(db)
+        self.estimator = estimator or ShippingEstimator(db)
+        self.label_queue = label_queue
+        self.order_events = order_events
     
     async def create_shipment(
         self,
@@ -293,6 +916,10 @@ class ShipmentService:
     ) -> Dict:
         """
         Create shipment and generate label
+        The order is linked to the shipment before any label work starts, and
+        only the label step (inline or the "create_label" job) writes the
+        order's tracking_id and shipped status, so a fast label worker can
+        never be overwritten by the caller.
         """
         
         # Get estimate first
@@ -301,12 +928,259 @@ class ShipmentService:
         )
         
         # Create shipment record
+        shipment_doc = self._build_shipment_doc(
+            order_id, from_address, to_address, weight_kg, customs_info, estimate
+        )
+        shipment_id = shipment_doc["shipment_id"]
+        
+        if SHIPPO_API_KEY and self.label_queue is not None:
+            shipment_doc["label_status"] = "queued"
+        
+        await self.db.shipments.insert_one(shipment_doc)
+        shipment_doc.pop("_id", None)
+        await self._link_orders([shipment_doc])
+        
+        if not SHIPPO_API_KEY:
+            return shipment_doc
+        
+        # Hand label creation to the workers, the shipment stays pending until then
+        if self.label_queue is not None:
+            await self.label_queue.enqueue(
+                "create_label",
+                {"shipment_id": shipment_id},
+                dedupe_key=f"label:{shipment_id}"
+            )
+            return shipment_doc
+        
+        # Try to create label via API
+        try:
+            label_result = await self._create_label_via_api(shipment_doc)
+            if label_result:
+                await self.db.shipments.update_one(
+                    {"shipment_id": shipment_id},
+                    {"$set": {
+                        "tracking_number": label_result['tracking_number'],
+                        "label_url": label_result['label_url'],
+                        "status": "label_created",
+                        "carrier_tracking_status": "label_created"
+                    }}
+                )
+                shipment_doc.update(label_result)
+                shipment_doc['status'] = 'label_created'
+                await self._mark_orders_shipped(shipment_doc, label_result['tracking_number'])
+        except Exception as e:
+            logger.error(f"Label creation failed: {e}")
+        
+        return shipment_doc
+    
+    async def _link_orders(self, shipment_docs: List[Dict]) -> None:
+        """
+        Set shipment_id on every order the shipments carry, in one bulk_write
+        """
+        if not shipment_docs:
+            return
+        await self.db.orders.bulk_write([
+            UpdateMany(
+                {"order_id": {"$in": doc["order_ids"]}},
+                {"$set": {"shipment_id": doc["shipment_id"]}}
+            )
+            for doc in shipment_docs
+        ], ordered=False)
+    
+    async def _mark_orders_shipped(self, shipment: Dict, tracking_number: str) -> None:
+        order_ids = shipment.get("order_ids") or [shipment["order_id"]]
+        await self.db.orders.update_many(
+            {"order_id": {"$in": order_ids}},
+            {"$set": {
+                "tracking_id": tracking_number,
+                "status": "shipped"
+            }}
+        )
+        if self.order_events:
+            await self.order_events.publish_orders(
+                self.db, order_ids, "shipped", tracking_id=tracking_number
+            )
+    
+    async def ensure_indexes(self) -> None:
+        await self.db.shipments.create_index("shipment_id")
+        await self.db.shipments.create_index("order_ids")
+    
+    async def create_consolidated_shipments(
+        self,
+        from_address: Dict,
+        orders: List[Dict]
+    ) -> List[Dict]:
+        """
+        Consolidation mode: one shipment per group of orders going to the same
+        buyer at the same address on the same ship-after-trip date
+        orders: [{order_id, buyer_id, to_address, weight_kg, customs_info,
+        ship_after_trip, trip_end_date}] all from one shop. A group's customs
+        declarations are merged into one; a group whose declarations can't be
+        merged is shipped order by order instead.
+        Returns one {order_ids, shipment | error} per shipment.
+        """
+        
+        groups: Dict[Tuple, List[Dict]] = {}
+        for order in orders:
+            groups.setdefault(self.consolidation_key(order), []).append(order)
+        
+        grouped_orders = []
+        for group in groups.values():
+            try:
+                customs_info = self.merge_customs_info([order.get('customs_info') for order in group])
+            except ValueError as e:
+                logger.warning(f"Not consolidating orders {[order['order_id'] for order in group]}: {e}")
+                grouped_orders.extend(group)
+                continue
+            grouped_orders.append({
+                "order_id": group[0]['order_id'],
+                "order_ids": [order['order_id'] for order in group],
+                "to_address": group[0]['to_address'],
+                "weight_kg": round(sum(order['weight_kg'] for order in group), 3),
+                "customs_info": customs_info
+            })
+        
+        return await self.create_shipments_bulk(from_address, grouped_orders)
+    
+    @staticmethod
+    def merge_customs_info(declarations: List[Optional[Dict]]) -> Optional[Dict]:
+        """
+        One customs declaration for a parcel holding several orders
+        The orders' items are listed together; every other field (contents
+        type, signer, incoterm, ...) applies to the whole parcel, so it must
+        agree across the declarations or ValueError is raised. So does a mix
+        of declared and undeclared orders, which would leave items off it.
+        """
+        declared = [declaration for declaration in declarations if declaration]
+        if not declared:
+            return None
+        if len(declared) < len(declarations):
+            raise ValueError("only some of the orders have a customs declaration")
+        if len(declared) == 1:
+            return declared[0]
+        
+        merged = {key: value for key, value in declared[0].items() if key != 'items'}
+        items = []
+        for declaration in declared:
+            fields = {key: value for key, value in declaration.items() if key != 'items'}
+            if fields != merged:
+                raise ValueError("customs declarations differ beyond their items")
+            items.extend(declaration.get('items') or [])
+        merged['items'] = items
+        return merged
+    
+    @staticmethod
+    def consolidation_key(order: Dict) -> Tuple:
+        """
+        (buyer, normalized delivery address, ship-after-trip date)
+        """
+        address = order.get('to_address') or {}
+        
+        def normalize(value: Optional[str]) -> str:
+            return ' '.join((value or '').lower().replace(',', ' ').split())
+        
+        ship_date = None
+        if order.get('ship_after_trip') and order.get('trip_end_date'):
+            ship_date = str(order['trip_end_date'])[:10]
+        
+        return (
+            order.get('buyer_id'),
+            normalize(address.get('street')),
+            normalize(address.get('city')),
+            normalize(address.get('state')),
+            (address.get('postal_code') or '').replace(' ', '').upper(),
+            (address.get('country') or '').upper(),
+            ship_date
+        )
+    
+    async def create_shipments_bulk(
+        self,
+        from_address: Dict,
+        orders: List[Dict]
+    ) -> List[Dict]:
+        """
+        Create shipments for many orders from one shop
+        orders: [{order_id, to_address, weight_kg, customs_info, order_ids}]
+        (order_ids when one shipment covers several orders)
+        Estimates run concurrently (identical routes once), shipments are
+        stored with one insert_many, orders linked with one bulk_write, and
+        only then label jobs queued in one batch; the label jobs alone mark
+        orders shipped.
+        Returns one {order_id, order_ids, shipment | error} result per entry, in order.
+        """
+        
+        if not orders:
+            return []
+        
+        estimates = await self.estimator.estimate_shipping_batch([
+            (from_address, order['to_address'], order['weight_kg'])
+            for order in orders
+        ])
+        
+        results = []
+        shipment_docs = []
+        queue_labels = bool(SHIPPO_API_KEY) and self.label_queue is not None
+        
+        for order, estimate in zip(orders, estimates):
+            if isinstance(estimate, Exception):
+                logger.error(f"Bulk shipment estimate failed for {order['order_id']}: {estimate}")
+                results.append({
+                    "order_id": order['order_id'],
+                    "order_ids": order.get('order_ids') or [order['order_id']],
+                    "error": str(estimate)
+                })
+                continue
+            
+            shipment_doc = self._build_shipment_doc(
+                order['order_id'],
+                from_address,
+                order['to_address'],
+                order['weight_kg'],
+                order.get('customs_info'),
+                estimate,
+                order_ids=order.get('order_ids')
+            )
+            if queue_labels:
+                shipment_doc["label_status"] = "queued"
+            shipment_docs.append(shipment_doc)
+            results.append({
+                "order_id": order['order_id'],
+                "order_ids": shipment_doc['order_ids'],
+                "shipment": shipment_doc
+            })
+        
+        if shipment_docs:
+            await self.db.shipments.insert_many(shipment_docs, ordered=False)
+            for shipment_doc in shipment_docs:
+                shipment_doc.pop("_id", None)
+            await self._link_orders(shipment_docs)
+        
+        if queue_labels and shipment_docs:
+            await self.label_queue.enqueue_many([
+                ("create_label", {"shipment_id": doc["shipment_id"]}, f"label:{doc['shipment_id']}")
+                for doc in shipment_docs
+            ])
+        
+        return results
+    
+    def _build_shipment_doc(
+        self,
+        order_id: str,
+        from_address: Dict,
+        to_address: Dict,
+        weight_kg: float,
+        customs_info: Optional[Dict],
+        estimate: Dict,
+        order_ids: Optional[List[str]] = None
+    ) -> Dict:
         shipment_id = f"ship_{datetime.now().strftime('%Y%m%d')}_{order_id[-8:]}"
         
-        shipment_doc = {
+        return {
             "shipment_id": shipment_id,
             "order_id": order_id,
+            "order_ids": order_ids or [order_id],
             "courier_provider": estimate.get('carrier', 'India Post'),
+            "rate_id": estimate.get('rate_id'),
             "tracking_number": None,
             "label_url": None,
             "from_address": from_address,
@@ -322,37 +1196,56 @@ class ShipmentService:
             "ship_date": None,
             "estimated_delivery": None,
             "actual_delivery": None,
+            "latest_event": None,
+            "recent_events": [],
             "metadata": {
                 "is_international": estimate['is_international'],
                 "is_remote_area": estimate['is_remote_area'],
                 "delivery_days_min": estimate['delivery_days_min'],
                 "delivery_days_max": estimate['delivery_days_max']
             },
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
+    
+    async def process_label_job(self, payload: Dict) -> Optional[Dict]:
+        """
+        Job handler for "create_label"
+        Raising makes the queue retry with backoff
+        """
         
-        await self.db.shipments.insert_one(shipment_doc)
+        shipment = await self.db.shipments.find_one(
+            {"shipment_id": payload["shipment_id"]},
+            {"_id": 0}
+        )
+        if not shipment:
+            logger.warning(f"Label job for unknown shipment: {payload['shipment_id']}")
+            return None
         
-        # Try to create label via API
-        if SHIPPO_API_KEY:
-            try:
-                label_result = await self._create_label_via_api(shipment_doc)
-                if label_result:
-                    await self.db.shipments.update_one(
-                        {"shipment_id": shipment_id},
-                        {"$set": {
-                            "tracking_number": label_result['tracking_number'],
-                            "label_url": label_result['label_url'],
-                            "status": "label_created",
-                            "carrier_tracking_status": "label_created"
-                        }}
-                    )
-                    shipment_doc.update(label_result)
-                    shipment_doc['status'] = 'label_created'
-            except Exception as e:
-                logger.error(f"Label creation failed: {e}")
+        # Already labelled by an earlier attempt
+        if shipment.get("tracking_number"):
+            return {"tracking_number": shipment["tracking_number"]}
         
-        return shipment_doc
+        label_result = await self._create_label_via_api(shipment)
+        if not label_result:
+            await self.db.shipments.update_one(
+                {"shipment_id": shipment["shipment_id"]},
+                {"$set": {"label_status": "unavailable"}}
+            )
+            return None
+        
+        await self.db.shipments.update_one(
+            {"shipment_id": shipment["shipment_id"]},
+            {"$set": {
+                "tracking_number": label_result['tracking_number'],
+                "label_url": label_result['label_url'],
+                "status": "label_created",
+                "carrier_tracking_status": "label_created",
+                "label_status": "created"
+            }}
+        )
+        await self._mark_orders_shipped(shipment, label_result['tracking_number'])
+        
+        return {"tracking_number": label_result['tracking_number']}
     
     async def _create_label_via_api(self, shipment: Dict) -> Optional[Dict]:
         """
@@ -362,80 +1255,406 @@ class ShipmentService:
         if not SHIPPO_API_KEY:
             return None
         
-        # This is a simplified version - would need full implementation
-        # For now, return mock data
-        logger.info("Would create label via Shippo API for shipment: " + shipment['shipment_id'])
+        # Labels are bought against the Shippo rate quoted at estimation time
+        rate_id = shipment.get('rate_id')
+        if not rate_id:
+            logger.info(f"No Shippo rate for shipment {shipment['shipment_id']}, skipping label")
+            return None
+        
+        status, data = await shippo_client.post("/transactions", {
+            "rate": rate_id,
+            "label_file_type": "PDF",
+            "async": False
+        })
+        
+        # 5xx, timeouts and an open breaker raise, so queued jobs retry later
+        if status >= 500:
+            raise RuntimeError(f"Shippo transaction failed with {status}")
         
-        return None
+        if status != 201 or data.get('status') != 'SUCCESS':
+            logger.warning(f"Shippo label not created for {shipment['shipment_id']}: {data.get('messages')}")
+            return None
+        
+        return {
+            'tracking_number': data['tracking_number'],
+            'label_url': data.get('label_url')
+        }
 
 # ============= TRACKING SERVICE =============
 
+# Events embedded on the shipment document, newest first
+TRACKING_RECENT_EVENTS = int(os.environ.get('TRACKING_RECENT_EVENTS', '20'))
+# Events older than this move from tracking_events to tracking_events_archive
+TRACKING_EVENT_RETENTION_DAYS = int(os.environ.get('TRACKING_EVENT_RETENTION_DAYS', '90'))
+TRACKING_COMPACTION_BATCH_SIZE = 1000
+# Event ids from before event_key(): evt_<YYYYmmddHHMMSS>_<tracking suffix>, not unique
+LEGACY_EVENT_ID_PATTERN = r'^evt_\d{14}_'
+TRACKING_REKEY_MIGRATION_ID = "tracking_event_keys"
+
+# Carrier status -> shipment status
+TRACKING_STATUS_MAP = {
+    'in_transit': 'in_transit',
+    'delivered': 'delivered',
+    'failed': 'failed',
+    'returned': 'failed'
+}
+
 class TrackingService:
     """
     Handle tracking updates and webhook events
+    Events are keyed deterministically so provider retries are no-ops.
+    Each shipment carries its latest event and the TRACKING_RECENT_EVENTS most
+    recent events, so shipment pages never query tracking_events.
+    With order_events, orders moving to delivered are published.
     """
     
-    def __init__(self, db):
+    def __init__(self, db, order_events=None):
         self.db = db
+        self.order_events = order_events
+    
+    async def ensure_indexes(self) -> None:
+        """
+        Legacy event ids are re-keyed first, or the unique event_id indexes
+        cannot build; each index is created on its own so one failing does
+        not leave the others missing
+        """
+        try:
+            await self.rekey_legacy_events()
+        except Exception as e:
+            logger.error(f"Failed to re-key legacy tracking events: {e}")
+        
+        indexes = [
+            (self.db.tracking_events, "event_id", {"unique": True}),
+            (self.db.tracking_events, [("shipment_id", 1), ("occurred_at", -1)], {}),
+            (self.db.tracking_events, "occurred_at", {}),
+            (self.db.tracking_events_archive, "event_id", {"unique": True}),
+            (self.db.tracking_events_archive, [("shipment_id", 1), ("occurred_at", -1)], {}),
+            (self.db.shipments, "tracking_number", {})
+        ]
+        for collection, keys, options in indexes:
+            try:
+                await collection.create_index(keys, **options)
+            except Exception as e:
+                logger.error(f"Failed to create index {keys} on {collection.name}: {e}")
+    
+    async def rekey_legacy_events(self) -> int:
+        """
+        One-off migration to event_key() ids
+        Events stored with the old timestamp ids get their deterministic id;
+        those that turn out to repeat an event already stored are deleted.
+        Recorded in db.migrations once done; returns the events re-keyed.
+        """
+        
+        state = await self.db.migrations.find_one({"_id": TRACKING_REKEY_MIGRATION_ID})
+        if state and state.get("completed"):
+            return 0
+        
+        rekeyed = 0
+        for collection in (self.db.tracking_events, self.db.tracking_events_archive):
+            rekeyed += await self._rekey_collection(collection)
+        
+        await self.db.migrations.update_one(
+            {"_id": TRACKING_REKEY_MIGRATION_ID},
+            {"$set": {"completed": True, "rekeyed": rekeyed, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        if rekeyed:
+            logger.info(f"Re-keyed {rekeyed} legacy tracking events")
+        return rekeyed
+    
+    async def _rekey_collection(self, collection) -> int:
+        rekeyed = 0
+        
+        # Every event leaves the legacy pattern once handled, so always take the first batch
+        while True:
+            batch = await collection.find(
+                {"event_id": {"$regex": LEGACY_EVENT_ID_PATTERN}}
+            ).limit(TRACKING_COMPACTION_BATCH_SIZE).to_list(None)
+            if not batch:
+                break
+            
+            # Events don't store their tracking number, their shipment does
+            tracking_numbers = {
+                shipment['shipment_id']: shipment.get('tracking_number')
+                async for shipment in self.db.shipments.find(
+                    {"shipment_id": {"$in": list({event['shipment_id'] for event in batch})}},
+                    {"_id": 0, "shipment_id": 1, "tracking_number": 1}
+                )
+            }
+            keys = [
+                self.event_key({**event, 'tracking_number': tracking_numbers.get(event['shipment_id'])})
+                for event in batch
+            ]
+            taken = {
+                event['event_id']
+                async for event in collection.find({"event_id": {"$in": keys}}, {"_id": 0, "event_id": 1})
+            }
+            
+            operations = []
+            for event, key in zip(batch, keys):
+                if key in taken:
+                    operations.append(DeleteOne({"_id": event['_id']}))
+                    continue
+                taken.add(key)
+                operations.append(UpdateOne({"_id": event['_id']}, {"$set": {"event_id": key}}))
+                rekeyed += 1
+            await collection.bulk_write(operations, ordered=False)
+        
+        return rekeyed
+    
+    @staticmethod
+    def event_key(event_data: Dict) -> str:
+        """
+        Deterministic event id: same carrier event -> same id
+        Built only from what the carrier sent, its event object_id when there
+        is one, else the raw status fields; never from values filled in on
+        receipt, which would differ on every redelivery.
+        """
+        tracking_number = event_data.get('tracking_number') or ''
+        if event_data.get('object_id'):
+            parts = [tracking_number, event_data['object_id']]
+        else:
+            parts = [
+                tracking_number,
+                event_data.get('status') or '',
+                event_data.get('occurred_at') or event_data.get('status_date') or '',
+                event_data.get('carrier_status_code') or '',
+                event_data.get('status_details') or '',
+                event_data.get('location') or ''
+            ]
+        digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+        return f"evt_{digest[:24]}"
     
     async def process_tracking_event(self, event_data: Dict) -> bool:
         """
         Process tracking webhook event
+        Returns False when the shipment is unknown
         """
         
-        tracking_number = event_data.get('tracking_number')
-        if not tracking_number:
-            return False
+        summary = await self.process_tracking_events([event_data])
+        return summary['processed'] + summary['duplicates'] > 0
+    
+    async def process_tracking_events(self, events: List[Dict]) -> Dict:
+        """
+        Process a batch of tracking webhook events
+        One shipment lookup, one insert_many of new events, one bulk_write of
+        shipment statuses and one of delivered orders
+        Returns counts: {received, processed, duplicates, unmatched, invalid}
+        """
         
-        # Find shipment
-        shipment = await self.db.shipments.find_one(
-            {"tracking_number": tracking_number},
-            {"_id": 0}
-        )
+        summary = {'received': len(events), 'processed': 0, 'duplicates': 0, 'unmatched': 0, 'invalid': 0}
+        now = datetime.now(timezone.utc).isoformat()
         
-        if not shipment:
-            logger.warning(f"Shipment not found for tracking: {tracking_number}")
-            return False
-        
-        # Create tracking event
-        event_id = f"evt_{datetime.now().strftime('%Y%m%d%H%M%S')}_{tracking_number[-6:]}"
-        
-        tracking_event = {
-            "event_id": event_id,
-            "shipment_id": shipment['shipment_id'],
-            "status": event_data.get('status', 'unknown'),
-            "status_details": event_data.get('status_details'),
-            "location": event_data.get('location'),
-            "occurred_at": event_data.get('occurred_at', datetime.now(timezone.utc).isoformat()),
-            "carrier_status_code": event_data.get('carrier_status_code'),
-            "created_at": datetime.now(timezone.utc).isoformat()
+        # Drop invalid events and repeats within the batch
+        unique_events = {}
+        for event_data in events:
+            if not isinstance(event_data, dict) or not event_data.get('tracking_number'):
+                summary['invalid'] += 1
+                continue
+            event_id = self.event_key(event_data)
+            event_data = dict(event_data)
+            # Undated events are stamped with their receipt time, after keying
+            event_data['occurred_at'] = event_data.get('occurred_at') or event_data.get('status_date') or now
+            if event_id in unique_events:
+                summary['duplicates'] += 1
+                continue
+            unique_events[event_id] = event_data
+        
+        if not unique_events:
+            return summary
+        
+        # Find shipments
+        tracking_numbers = list({e['tracking_number'] for e in unique_events.values()})
+        shipments = {
+            shipment['tracking_number']: shipment
+            async for shipment in self.db.shipments.find(
+                {"tracking_number": {"$in": tracking_numbers}},
+                {
+                    "_id": 0, "shipment_id": 1, "order_id": 1, "order_ids": 1, "tracking_number": 1, "status": 1,
+                    # Empty when embedded, absent on shipments from before events were
+                    "recent_events": {"$slice": 0}
+                }
+            )
         }
         
-        await self.db.tracking_events.insert_one(tracking_event)
+        tracking_docs = []
+        for event_id, event_data in unique_events.items():
+            shipment = shipments.get(event_data['tracking_number'])
+            if not shipment:
+                logger.warning(f"Shipment not found for tracking: {event_data['tracking_number']}")
+                summary['unmatched'] += 1
+                continue
+            tracking_docs.append({
+                "event_id": event_id,
+                "shipment_id": shipment['shipment_id'],
+                "status": event_data.get('status', 'unknown'),
+                "status_details": event_data.get('status_details'),
+                "location": event_data.get('location'),
+                "occurred_at": event_data['occurred_at'],
+                "carrier_status_code": event_data.get('carrier_status_code'),
+                "created_at": now
+            })
+        
+        if not tracking_docs:
+            return summary
+        
+        # Create tracking events, already-seen event ids are rejected by the unique index
+        new_docs = tracking_docs
+        try:
+            await self.db.tracking_events.insert_many(tracking_docs, ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            if any(err.get('code') != 11000 for err in write_errors):
+                raise
+            rejected = {err['index'] for err in write_errors}
+            new_docs = [doc for i, doc in enumerate(tracking_docs) if i not in rejected]
+        
+        summary['duplicates'] += len(tracking_docs) - len(new_docs)
+        summary['processed'] = len(new_docs)
+        
+        # Update shipment status from the latest new event per shipment
+        latest = {}
+        for doc in new_docs:
+            current = latest.get(doc['shipment_id'])
+            if current is None or doc['occurred_at'] >= current['occurred_at']:
+                latest[doc['shipment_id']] = doc
         
-        # Update shipment status
-        status_map = {
-            'in_transit': 'in_transit',
-            'delivered': 'delivered',
-            'failed': 'failed',
-            'returned': 'failed'
+        shipment_updates = []
+        order_updates = []
+        delivered_order_ids = []
+        shipments_by_id = {shipment['shipment_id']: shipment for shipment in shipments.values()}
+        
+        new_by_shipment = {}
+        for doc in new_docs:
+            new_by_shipment.setdefault(doc['shipment_id'], []).append(self._embedded_event(doc))
+        
+        # Legacy shipments get their stored history first, or the $push below
+        # would create recent_events holding only the new events
+        new_event_ids = [doc['event_id'] for doc in new_docs]
+        for shipment_id in new_by_shipment:
+            if 'recent_events' not in shipments_by_id[shipment_id]:
+                await self._backfill_recent_events(shipment_id, exclude_event_ids=new_event_ids)
+        
+        for shipment_id, embedded in new_by_shipment.items():
+            shipment_updates.append(UpdateOne(
+                {"shipment_id": shipment_id},
+                {"$push": {"recent_events": {
+                    "$each": embedded,
+                    "$sort": {"occurred_at": -1},
+                    "$slice": TRACKING_RECENT_EVENTS
+                }}}
+            ))
+        
+        for shipment_id, doc in latest.items():
+            shipment = shipments_by_id[shipment_id]
+            new_status = TRACKING_STATUS_MAP.get(doc['status'], shipment['status'])
+            
+            # Older events arriving late must not overwrite newer state
+            shipment_updates.append(UpdateOne(
+                {
+                    "shipment_id": shipment_id,
+                    "$or": [
+                        {"last_event_at": {"$exists": False}},
+                        {"last_event_at": None},
+                        {"last_event_at": {"$lte": doc['occurred_at']}}
+                    ]
+                },
+                {"$set": {
+                    "status": new_status,
+                    "carrier_tracking_status": doc['status'],
+                    "last_event_at": doc['occurred_at'],
+                    "latest_event": self._embedded_event(doc)
+                }}
+            ))
+            
+            # Update order status
+            if new_status == 'delivered':
+                order_ids = shipment.get('order_ids') or [shipment['order_id']]
+                delivered_order_ids.extend(order_ids)
+                order_updates.append(UpdateMany(
+                    {"order_id": {"$in": order_ids}},
+                    {"$set": {"status": "delivered"}}
+                ))
+        
+        if shipment_updates:
+            await self.db.shipments.bulk_write(shipment_updates, ordered=False)
+        if order_updates:
+            await self.db.orders.bulk_write(order_updates, ordered=False)
+            if self.order_events:
+                await self.order_events.publish_orders(self.db, delivered_order_ids, "delivered")
+        
+        return summary
+    
+    def _embedded_event(self, event: Dict) -> Dict:
+        return {
+            "event_id": event['event_id'],
+            "status": event['status'],
+            "status_details": event.get('status_details'),
+            "location": event.get('location'),
+            "occurred_at": event['occurred_at'],
+            "carrier_status_code": event.get('carrier_status_code')
         }
+    
+    async def recent_events(self, shipment: Dict) -> List[Dict]:
+        """
+        Timeline for a shipment document, newest first
+        Shipments created before events were embedded are backfilled once
+        """
         
-        new_status = status_map.get(event_data.get('status'), shipment['status'])
+        if 'recent_events' in shipment:
+            return shipment['recent_events']
+        
+        return await self._backfill_recent_events(shipment['shipment_id'])
+    
+    async def _backfill_recent_events(self, shipment_id: str, exclude_event_ids: List[str] = ()) -> List[Dict]:
+        """
+        Seed recent_events from tracking_events, unless the shipment already has them
+        exclude_event_ids leaves out events about to be pushed by the caller.
+        """
+        
+        query = {"shipment_id": shipment_id}
+        if exclude_event_ids:
+            query["event_id"] = {"$nin": list(exclude_event_ids)}
+        events = await self.db.tracking_events.find(
+            query,
+            {"_id": 0, "created_at": 0, "shipment_id": 0}
+        ).sort("occurred_at", -1).to_list(TRACKING_RECENT_EVENTS)
         
         await self.db.shipments.update_one(
-            {"shipment_id": shipment['shipment_id']},
-            {"$set": {
-                "status": new_status,
-                "carrier_tracking_status": event_data.get('status')
-            }}
+            {"shipment_id": shipment_id, "recent_events": {"$exists": False}},
+            {"$set": {"recent_events": events}}
         )
+        return events
+    
+    async def compact_events(self, retention_days: int = TRACKING_EVENT_RETENTION_DAYS) -> int:
+        """
+        Move events older than retention_days to tracking_events_archive
+        Safe to re-run after an interruption; returns the number of events moved
+        """
         
-        # Update order status
-        if new_status == 'delivered':
-            await self.db.orders.update_one(
-                {"order_id": shipment['order_id']},
-                {"$set": {"status": "delivered"}}
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).isoformat()
+        moved = 0
+        
+        while True:
+            batch = await self.db.tracking_events.find(
+                {"occurred_at": {"$lt": cutoff}},
+                {"_id": 0}
+            ).sort("occurred_at", 1).to_list(TRACKING_COMPACTION_BATCH_SIZE)
+            if not batch:
+                break
+            
+            try:
+                await self.db.tracking_events_archive.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # Archived by an earlier, interrupted run
+                if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+                    raise
+            
+            await self.db.tracking_events.delete_many(
+                {"event_id": {"$in": [event['event_id'] for event in batch]}}
             )
+            moved += len(batch)
         
-        return True
+        if moved:
+            logger.info(f"Archived {moved} tracking events older than {retention_days} days")
+        return moved
@@ -0,0 +1,8 @@
+"""
+Shared test setup: backend/ on sys.path, so tests import the service
+modules and the in-memory MongoDB stand-in (bench.memory_db) directly
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
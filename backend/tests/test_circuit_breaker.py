@@ -0,0 +1,161 @@
+"""
+Shippo Circuit Breaker Tests - offline, no server or network needed:
+1. Breaker trips after consecutive failures
+2. Cool-down moves it to half-open
+3. Half-open trial success closes it, trial failure reopens it
+4. ShippoClient.post counts 5xx, unparsable bodies and errors as failures
+"""
+import json
+import asyncio
+import pytest
+
+import shipping_service
+from shipping_service import CircuitBreaker, ShippoClient, ShippoUnavailable
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FakeResponse:
+    def __init__(self, status, body=None, delay=0.0):
+        self.status = status
+        self.body = body
+        self.delay = delay
+
+    async def __aenter__(self):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def json(self, content_type=None):
+        if self.body is None:
+            raise AssertionError("body of a 5xx response should not be parsed")
+        return json.loads(self.body)
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+
+    def post(self, url, json=None):
+        return self.response
+
+def make_client(response, threshold=2, reset_seconds=30):
+    client = ShippoClient()
+    client.breaker = CircuitBreaker(threshold, reset_seconds)
+    client._get_session = lambda: FakeSession(response)
+    return client
+
+class TestCircuitBreakerStates:
+    """Test the closed -> open -> half_open -> closed/open transitions"""
+
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        clock = FakeClock()
+        monkeypatch.setattr(shipping_service.time, "monotonic", clock)
+        return clock
+
+    def test_trips_after_consecutive_failures(self, clock):
+        """Breaker should open once the failure threshold is reached"""
+        breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.state == 'closed'
+        breaker.record_failure()
+        assert breaker.state == 'open'
+        assert not breaker.allow_request()
+        assert breaker.snapshot()['total_rejected'] == 1
+
+    def test_success_resets_failure_count(self, clock):
+        """A success in between should keep the breaker closed"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == 'closed'
+
+    def test_cool_down_moves_to_half_open(self, clock):
+        """After reset_seconds the breaker should let one trial through"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+        breaker.record_failure()
+        clock.now += 29
+        assert breaker.state == 'open'
+        clock.now += 1
+        assert breaker.state == 'half_open'
+        assert breaker.allow_request()
+        assert not breaker.allow_request(), "Only one trial call at a time"
+        assert breaker.is_open()
+
+    def test_trial_success_closes(self, clock):
+        """A successful trial should close the breaker"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+        breaker.record_failure()
+        clock.now += 30
+        assert breaker.allow_request()
+        breaker.record_success()
+        assert breaker.state == 'closed'
+        assert breaker.allow_request()
+
+    def test_trial_failure_reopens(self, clock):
+        """A failed trial should reopen the breaker for another cool-down"""
+        breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+        for _ in range(3):
+            breaker.record_failure()
+        clock.now += 30
+        assert breaker.allow_request()
+        breaker.record_failure()
+        assert breaker.state == 'open'
+        clock.now += 29
+        assert breaker.state == 'open'
+        clock.now += 1
+        assert breaker.state == 'half_open'
+
+class TestShippoClientPost:
+    """Test which responses ShippoClient.post counts as breaker failures"""
+
+    def test_2xx_records_success(self):
+        """A parsable 2xx body should be returned and keep the breaker closed"""
+        client = make_client(FakeResponse(201, '{"rates": []}'))
+        status, data = asyncio.run(client.post("/shipments", {}))
+        assert status == 201
+        assert data == {"rates": []}
+        assert client.breaker.snapshot()['total_failures'] == 0
+
+    def test_5xx_is_failure_without_parsing(self):
+        """A 5xx should count as a failure and its body should not be parsed"""
+        client = make_client(FakeResponse(502))
+        status, data = asyncio.run(client.post("/shipments", {}))
+        assert status == 502
+        assert data == {}
+        assert client.breaker.snapshot()['consecutive_failures'] == 1
+
+    def test_unparsable_body_is_failure(self):
+        """An HTML error page should raise and count as a failure"""
+        client = make_client(FakeResponse(200, "<html>bad gateway</html>"), threshold=1)
+        with pytest.raises(json.JSONDecodeError):
+            asyncio.run(client.post("/shipments", {}))
+        assert client.breaker.state == 'open'
+        with pytest.raises(ShippoUnavailable):
+            asyncio.run(client.post("/shipments", {}))
+
+    def test_cancelled_trial_releases_slot(self):
+        """A cancelled half-open trial should not leave the breaker stuck"""
+        client = make_client(FakeResponse(201, "{}", delay=1.0), threshold=1, reset_seconds=0)
+        client.breaker.record_failure()
+
+        async def cancel_trial():
+            task = asyncio.create_task(client.post("/shipments", {}))
+            await asyncio.sleep(0.01)
+            assert client.breaker.is_open(), "Trial should hold the slot while in flight"
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_trial())
+        assert client.breaker.state == 'half_open'
+        assert client.breaker.allow_request()
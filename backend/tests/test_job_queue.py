@@ -0,0 +1,152 @@
+"""
+Job Queue Tests - offline, against an in-memory jobs collection:
+1. Claiming leases due jobs only
+2. Expired leases are re-claimed, and the stale worker cannot record an outcome
+3. Failures back off, then dead-letter after max_attempts
+"""
+import asyncio
+import pytest
+from datetime import timedelta
+
+from bench.memory_db import MemoryDB
+from job_queue import JobQueue, _now
+
+def expire_lease(db, job_id):
+    doc = next(doc for doc in db.jobs.docs if doc["job_id"] == job_id)
+    doc["lease_expires_at"] = (_now() - timedelta(seconds=1)).isoformat()
+
+class TestJobQueueClaim:
+    """Test leasing jobs out to workers"""
+
+    @pytest.fixture
+    def db(self):
+        return MemoryDB()
+
+    def test_claim_leases_due_job(self, db):
+        """A due job should be claimed once, with a lease and an attempt counted"""
+        queue = JobQueue(db, "labels")
+
+        async def run():
+            job_id = await queue.enqueue("create_label", {"order_id": "o1"})
+            job = await queue.claim()
+            assert job["job_id"] == job_id
+            assert job["status"] == "running"
+            assert job["attempts"] == 1
+            assert job["lease_id"]
+            assert await queue.claim() is None, "A leased job should not be claimed twice"
+
+        asyncio.run(run())
+
+    def test_delayed_job_not_claimed(self, db):
+        """A job whose run_at is in the future should wait"""
+        queue = JobQueue(db, "labels")
+
+        async def run():
+            await queue.enqueue("create_label", {}, delay_seconds=60)
+            assert await queue.claim() is None
+
+        asyncio.run(run())
+
+    def test_complete_marks_done(self, db):
+        """Completing under a held lease should finish the job"""
+        queue = JobQueue(db, "labels")
+
+        async def run():
+            await queue.enqueue("create_label", {})
+            job = await queue.claim()
+            assert await queue.complete(job, {"label": "ok"})
+            assert db.jobs.docs[0]["status"] == "done"
+            assert await queue.claim() is None
+
+        asyncio.run(run())
+
+class TestJobQueueLeaseExpiry:
+    """Test that an expired lease hands the job to another worker"""
+
+    @pytest.fixture
+    def db(self):
+        return MemoryDB()
+
+    def test_expired_lease_is_reclaimed(self, db):
+        """A running job past its lease should be claimable again"""
+        queue = JobQueue(db, "labels")
+
+        async def run():
+            await queue.enqueue("create_label", {})
+            first = await queue.claim()
+            expire_lease(db, first["job_id"])
+            second = await queue.claim()
+            assert second["job_id"] == first["job_id"]
+            assert second["attempts"] == 2
+            assert second["lease_id"] != first["lease_id"]
+
+        asyncio.run(run())
+
+    def test_stale_worker_cannot_complete_or_fail(self, db):
+        """The worker that lost its lease should not overwrite the new owner's outcome"""
+        queue = JobQueue(db, "labels", max_attempts=1)
+
+        async def run():
+            await queue.enqueue("create_label", {})
+            stale = await queue.claim()
+            expire_lease(db, stale["job_id"])
+            current = await queue.claim()
+
+            assert not await queue.fail(stale, "timed out")
+            assert not await queue.complete(stale)
+            assert db.jobs.docs[0]["status"] == "running"
+            assert db.jobs_dead_letter.docs == []
+
+            assert await queue.complete(current, {"label": "ok"})
+            assert db.jobs.docs[0]["status"] == "done"
+            assert not await queue.fail(stale, "timed out")
+            assert db.jobs.docs[0]["status"] == "done"
+
+        asyncio.run(run())
+
+class TestJobQueueFailures:
+    """Test retry backoff and dead-lettering"""
+
+    @pytest.fixture
+    def db(self):
+        return MemoryDB()
+
+    def test_failure_requeues_with_backoff(self, db):
+        """A failed job should go back to queued with a future run_at"""
+        queue = JobQueue(db, "labels", max_attempts=3)
+
+        async def run():
+            await queue.enqueue("create_label", {})
+            job = await queue.claim()
+            assert await queue.fail(job, "carrier down")
+            doc = db.jobs.docs[0]
+            assert doc["status"] == "queued"
+            assert doc["last_error"] == "carrier down"
+            assert doc["run_at"] > _now().isoformat()
+            assert await queue.claim() is None, "Backoff should delay the retry"
+
+        asyncio.run(run())
+
+    def test_dead_letter_after_max_attempts(self, db):
+        """The last allowed failure should dead-letter the job"""
+        queue = JobQueue(db, "labels", max_attempts=2)
+
+        async def run():
+            await queue.enqueue("create_label", {"order_id": "o1"})
+            job = await queue.claim()
+            assert await queue.fail(job, "first")
+            db.jobs.docs[0]["run_at"] = _now().isoformat()
+
+            job = await queue.claim()
+            assert job["attempts"] == 2
+            assert await queue.fail(job, "second")
+
+            assert db.jobs.docs[0]["status"] == "dead"
+            assert len(db.jobs_dead_letter.docs) == 1
+            dead = db.jobs_dead_letter.docs[0]
+            assert dead["job_id"] == job["job_id"]
+            assert dead["last_error"] == "second"
+            assert dead["dead_at"]
+            assert await queue.claim() is None
+
+        asyncio.run(run())
@@ -208,5 +208,47 @@ class TestShopProducts:
         assert 'test_product_001' in product_ids
 
 
+class TestShippingEstimateBatch:
+    """Test batch shipping estimation endpoint"""
+    
+    @pytest.fixture
+    def tourist_session(self):
+        """Get tourist session token"""
+        response = requests.post(
+            f"{BASE_URL}/api/auth/login",
+            json={
+                "email": "test.tourist1@relocal.com",
+                "password": "password123"
+            }
+        )
+        return response.cookies
+    
+    def test_batch_estimate_requires_auth(self):
+        """Batch estimation should require authentication"""
+        response = requests.post(f"{BASE_URL}/api/shipping/estimate/batch", json={"items": []})
+        assert response.status_code == 401
+        
+    def test_batch_estimate_returns_estimates_in_order(self, tourist_session):
+        """Batch estimation should return one estimate per item, in input order"""
+        mumbai = {"city": "Mumbai", "postal_code": "400001", "country": "IN"}
+        items = [
+            {"weight_kg": 1.0, "from_address": mumbai, "to_address": {"city": "Delhi", "postal_code": "110001", "country": "IN"}},
+            {"weight_kg": 1.0, "from_address": mumbai, "to_address": {"city": "New York", "postal_code": "10001", "country": "US"}},
+            {"weight_kg": 1.0, "from_address": mumbai, "to_address": {"city": "Delhi", "postal_code": "110001", "country": "IN"}}
+        ]
+        response = requests.post(
+            f"{BASE_URL}/api/shipping/estimate/batch",
+            json={"items": items},
+            cookies=tourist_session
+        )
+        assert response.status_code == 200
+        estimates = response.json()['estimates']
+        assert len(estimates) == 3
+        assert estimates[0]['is_international'] is False
+        assert estimates[1]['is_international'] is True
+        # Duplicate routes get the same quote
+        assert estimates[0]['estimated_cost'] == estimates[2]['estimated_cost']
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -0,0 +1,182 @@
+"""
+Shipment Label Tests - offline, against the in-memory MongoDB stand-in:
+1. Orders are linked to their shipment before the label job can run
+2. A label worker finishing first is not overwritten by the request path
+3. Consolidated shipments carry their orders' customs declarations
+"""
+import asyncio
+import pytest
+
+import shipping_service
+from bench.memory_db import MemoryDB
+from job_queue import JobQueue
+from shipping_service import ShipmentService
+
+ORIGIN = {"name": "Shop", "street": "1 Market Rd", "city": "Jaipur", "postal_code": "302001", "country": "IN"}
+DESTINATION = {"name": "Buyer", "street": "2 Beach Rd", "city": "Mumbai", "postal_code": "400001", "country": "IN"}
+
+class FixedEstimator:
+    async def estimate_shipping(self, from_address, to_address, weight_kg, order_id):
+        return {
+            "estimated_cost": 150.0,
+            "currency": "INR",
+            "service_level": "standard",
+            "delivery_days_min": 3,
+            "delivery_days_max": 5,
+            "is_international": False,
+            "is_remote_area": False,
+            "estimation_method": "api",
+            "carrier": "Test Carrier",
+            "rate_id": "rate_1"
+        }
+
+    async def estimate_shipping_batch(self, routes):
+        return [await self.estimate_shipping(*route, order_id="") for route in routes]
+
+class EagerLabelQueue(JobQueue):
+    """Runs the label worker as soon as the job is queued, the worst case for the caller"""
+
+    def __init__(self, db):
+        super().__init__(db, "shipping_labels")
+        self.service = None
+
+    async def _drain(self):
+        while True:
+            job = await self.claim()
+            if job is None:
+                return
+            await self.complete(job, await self.service.process_label_job(job["payload"]))
+
+    async def enqueue(self, *args, **kwargs):
+        job_id = await super().enqueue(*args, **kwargs)
+        await self._drain()
+        return job_id
+
+    async def enqueue_many(self, jobs):
+        inserted = await super().enqueue_many(jobs)
+        await self._drain()
+        return inserted
+
+class RecordingEvents:
+    def __init__(self):
+        self.published = []
+
+    async def publish_orders(self, db, order_ids, status, **details):
+        self.published.append((sorted(order_ids), status, details))
+        return len(order_ids)
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(shipping_service, "SHIPPO_API_KEY", "test")
+    db = MemoryDB()
+    queue = EagerLabelQueue(db)
+    service = ShipmentService(db, estimator=FixedEstimator(), label_queue=queue, order_events=RecordingEvents())
+    queue.service = service
+
+    labels = iter(range(1, 100))
+
+    async def create_label(shipment):
+        return {"tracking_number": f"TRK{next(labels)}", "label_url": "https://labels.test/1.pdf"}
+
+    monkeypatch.setattr(service, "_create_label_via_api", create_label)
+    return service
+
+class TestLabelWorkerRace:
+    """Test that the label worker is the only writer of an order's shipped state"""
+
+    def test_worker_before_request_path(self, service):
+        """A label job finishing before create_shipment returns should leave the order shipped"""
+        db = service.db
+        asyncio.run(db.orders.insert_one({"order_id": "order_1", "status": "confirmed"}))
+
+        shipment = asyncio.run(service.create_shipment("order_1", ORIGIN, dict(DESTINATION), 1.0))
+
+        order = db.orders.docs[0]
+        assert order["shipment_id"] == shipment["shipment_id"]
+        assert order["status"] == "shipped"
+        assert order["tracking_id"] == "TRK1"
+        assert service.order_events.published == [(["order_1"], "shipped", {"tracking_id": "TRK1"})]
+
+    def test_order_linked_before_label_job(self, service, monkeypatch):
+        """The label job should already see the order linked to its shipment"""
+        db = service.db
+        asyncio.run(db.orders.insert_one({"order_id": "order_1", "status": "confirmed"}))
+        seen = []
+        process_label_job = service.process_label_job
+
+        async def observe(payload):
+            seen.append(db.orders.docs[0].get("shipment_id"))
+            return await process_label_job(payload)
+
+        monkeypatch.setattr(service, "process_label_job", observe)
+        shipment = asyncio.run(service.create_shipment("order_1", ORIGIN, dict(DESTINATION), 1.0))
+        assert seen == [shipment["shipment_id"]]
+
+    def test_bulk_worker_before_request_path(self, service):
+        """Label jobs finishing during create_shipments_bulk should leave every order shipped"""
+        db = service.db
+        for order_id in ("order_1", "order_2"):
+            asyncio.run(db.orders.insert_one({"order_id": order_id, "status": "confirmed"}))
+
+        results = asyncio.run(service.create_shipments_bulk(ORIGIN, [
+            {"order_id": "order_1", "to_address": dict(DESTINATION), "weight_kg": 1.0},
+            {"order_id": "order_2", "to_address": dict(DESTINATION), "weight_kg": 2.0}
+        ]))
+
+        shipment_ids = {result["order_id"]: result["shipment"]["shipment_id"] for result in results}
+        for order in db.orders.docs:
+            assert order["shipment_id"] == shipment_ids[order["order_id"]]
+            assert order["status"] == "shipped"
+            assert order["tracking_id"].startswith("TRK")
+
+def declaration(*items, **fields):
+    return {"contents_type": "MERCHANDISE", "certify_signer": "Shop", **fields, "items": list(items)}
+
+def consolidated_order(order_id, customs_info=None):
+    return {
+        "order_id": order_id,
+        "buyer_id": "buyer_1",
+        "to_address": dict(DESTINATION),
+        "weight_kg": 1.0,
+        "customs_info": customs_info
+    }
+
+class TestConsolidatedCustoms:
+    """Test that consolidating orders doesn't lose their customs declarations"""
+
+    def test_declarations_merged(self, service):
+        """The group's shipment should declare every order's items"""
+        results = asyncio.run(service.create_consolidated_shipments(ORIGIN, [
+            consolidated_order("order_1", declaration({"description": "Scarf"})),
+            consolidated_order("order_2", declaration({"description": "Tea"}, {"description": "Mug"}))
+        ]))
+
+        assert len(results) == 1
+        assert results[0]["order_ids"] == ["order_1", "order_2"]
+        customs_info = service.db.shipments.docs[0]["customs_info"]
+        assert customs_info["contents_type"] == "MERCHANDISE"
+        assert [item["description"] for item in customs_info["items"]] == ["Scarf", "Tea", "Mug"]
+
+    def test_conflicting_declarations_not_consolidated(self, service):
+        """Orders whose declarations disagree should each ship with their own"""
+        first = declaration({"description": "Scarf"})
+        second = declaration({"description": "Tea"}, contents_type="GIFT")
+        results = asyncio.run(service.create_consolidated_shipments(ORIGIN, [
+            consolidated_order("order_1", first),
+            consolidated_order("order_2", second)
+        ]))
+
+        assert [result["order_ids"] for result in results] == [["order_1"], ["order_2"]]
+        assert [doc["customs_info"] for doc in service.db.shipments.docs] == [first, second]
+
+    def test_partly_declared_group_not_consolidated(self, service):
+        """A declared order should not share a parcel with an undeclared one"""
+        results = asyncio.run(service.create_consolidated_shipments(ORIGIN, [
+            consolidated_order("order_1", declaration({"description": "Scarf"})),
+            consolidated_order("order_2")
+        ]))
+        assert [result["order_ids"] for result in results] == [["order_1"], ["order_2"]]
+
+    def test_undeclared_group_consolidated(self):
+        """Domestic orders without declarations should still be merged"""
+        assert ShipmentService.merge_customs_info([None, None]) is None
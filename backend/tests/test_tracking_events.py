@@ -0,0 +1,185 @@
+"""
+Tracking Event Tests - offline, against in-memory collections:
+1. Redelivered webhook payloads are recognised as duplicates
+2. Event keys only depend on carrier-supplied fields
+3. Legacy shipments keep their history when the first new event is embedded
+4. Legacy timestamp event ids are re-keyed before the unique index is built
+"""
+import asyncio
+import pytest
+
+from bench.memory_db import MemoryDB
+from shipping_service import TrackingService
+
+def tracking_db():
+    return MemoryDB(unique={"tracking_events": "event_id"})
+
+EVENT = {
+    "tracking_number": "TRK123",
+    "status": "in_transit",
+    "status_details": "Departed facility",
+    "location": "Jaipur"
+}
+
+class TestTrackingEventDedupe:
+    """Test that carrier retries of the same event are no-ops"""
+
+    @pytest.fixture
+    def db(self):
+        db = tracking_db()
+        db.shipments.docs.append({
+            "shipment_id": "shp_1",
+            "order_id": "order_1",
+            "tracking_number": "TRK123",
+            "status": "label_created"
+        })
+        return db
+
+    def test_same_payload_twice_is_duplicate(self, db):
+        """An undated event posted twice should be stored once"""
+        service = TrackingService(db)
+
+        async def run():
+            first = await service.process_tracking_events([dict(EVENT)])
+            await asyncio.sleep(0.001)
+            second = await service.process_tracking_events([dict(EVENT)])
+            return first, second
+
+        first, second = asyncio.run(run())
+        assert first["processed"] == 1
+        assert second["processed"] == 0
+        assert second["duplicates"] == 1
+        assert len(db.tracking_events.docs) == 1
+        assert db.tracking_events.docs[0]["occurred_at"], "Undated events get their receipt time"
+
+    def test_key_ignores_receipt_time(self):
+        """Filling in occurred_at on receipt should not be what the key is built from"""
+        assert TrackingService.event_key(EVENT) == TrackingService.event_key(dict(EVENT))
+        dated = {**EVENT, "occurred_at": "2026-01-01T10:00:00+00:00"}
+        assert TrackingService.event_key(dated) != TrackingService.event_key(EVENT)
+
+    def test_carrier_object_id_wins(self):
+        """A carrier event object_id should identify the event on its own"""
+        first = {**EVENT, "object_id": "evt_abc"}
+        retried = {**EVENT, "object_id": "evt_abc", "status_details": "Departed facility (resent)"}
+        assert TrackingService.event_key(first) == TrackingService.event_key(retried)
+
+class TestRecentEventsBackfill:
+    """Test that embedding events on a legacy shipment keeps its stored history"""
+
+    @pytest.fixture
+    def db(self):
+        db = tracking_db()
+        db.shipments.docs.append({
+            "shipment_id": "shp_1",
+            "order_id": "order_1",
+            "tracking_number": "TRK123",
+            "status": "in_transit"
+        })
+        db.tracking_events.docs.append({
+            "event_id": "evt_old",
+            "shipment_id": "shp_1",
+            "status": "in_transit",
+            "occurred_at": "2026-01-01T10:00:00+00:00",
+            "created_at": "2026-01-01T10:00:05+00:00"
+        })
+        return db
+
+    def test_legacy_history_seeded_before_push(self, db):
+        """The first new event should not replace the shipment's older events"""
+        service = TrackingService(db)
+        event = {**EVENT, "occurred_at": "2026-01-02T10:00:00+00:00"}
+        asyncio.run(service.process_tracking_events([event]))
+
+        new_id = TrackingService.event_key(event)
+        shipment = db.shipments.docs[0]
+        assert [e["event_id"] for e in shipment["recent_events"]] == [new_id, "evt_old"], \
+            "History should be seeded, then the new event pushed once ahead of it"
+
+    def test_embedded_shipment_not_reseeded(self, db):
+        """A shipment that already embeds events should go straight to the push"""
+        db.shipments.docs[0]["recent_events"] = []
+        service = TrackingService(db)
+        event = {**EVENT, "occurred_at": "2026-01-02T10:00:00+00:00"}
+        asyncio.run(service.process_tracking_events([event]))
+        assert [e["event_id"] for e in db.shipments.docs[0]["recent_events"]] == [TrackingService.event_key(event)]
+
+def legacy_event(event_id, **fields):
+    return {
+        "event_id": event_id,
+        "shipment_id": "shp_1",
+        "status": "in_transit",
+        "status_details": "Departed facility",
+        "location": "Jaipur",
+        "occurred_at": "2026-01-01T10:00:00+00:00",
+        **fields
+    }
+
+class TestLegacyEventRekey:
+    """Test the one-off migration from timestamp event ids to event_key()"""
+
+    @pytest.fixture
+    def db(self):
+        db = MemoryDB()
+        db.shipments.docs.append({"shipment_id": "shp_1", "order_id": "order_1", "tracking_number": "TRK123"})
+        return db
+
+    def test_colliding_ids_get_distinct_keys(self, db):
+        """Two different events saved in the same second should end up with their own ids"""
+        asyncio.run(db.tracking_events.insert_many([
+            legacy_event("evt_20260101100000_TRK123", status="in_transit"),
+            legacy_event("evt_20260101100000_TRK123", status="out_for_delivery"),
+            legacy_event("evt_0123456789abcdef01234567")
+        ]))
+        service = TrackingService(db)
+        assert asyncio.run(service.rekey_legacy_events()) == 2
+
+        event_ids = [doc["event_id"] for doc in db.tracking_events.docs]
+        assert event_ids[:2] == [
+            TrackingService.event_key({**legacy_event(""), "tracking_number": "TRK123"}),
+            TrackingService.event_key({**legacy_event("", status="out_for_delivery"), "tracking_number": "TRK123"})
+        ]
+        assert event_ids[2] == "evt_0123456789abcdef01234567", "Current ids should be left alone"
+        assert db.migrations.docs[0]["completed"]
+
+    def test_duplicates_dropped(self, db):
+        """The same event stored twice, or already stored under its new id, should be kept once"""
+        key = TrackingService.event_key({**legacy_event(""), "tracking_number": "TRK123"})
+        asyncio.run(db.tracking_events.insert_many([
+            legacy_event("evt_20260101100000_TRK123"),
+            legacy_event("evt_20260101100001_TRK123")
+        ]))
+        asyncio.run(db.tracking_events_archive.insert_many([
+            legacy_event(key),
+            legacy_event("evt_20260101100000_TRK123")
+        ]))
+        service = TrackingService(db)
+        asyncio.run(service.rekey_legacy_events())
+
+        assert [doc["event_id"] for doc in db.tracking_events.docs] == [key]
+        assert [doc["event_id"] for doc in db.tracking_events_archive.docs] == [key]
+
+    def test_runs_once(self, db):
+        """A completed migration should not scan again"""
+        db.migrations.docs.append({"_id": "tracking_event_keys", "completed": True})
+        db.tracking_events.docs.append(legacy_event("evt_20260101100000_TRK123"))
+        assert asyncio.run(TrackingService(db).rekey_legacy_events()) == 0
+        assert db.tracking_events.docs[0]["event_id"] == "evt_20260101100000_TRK123"
+
+    def test_failed_index_does_not_skip_the_rest(self, db, monkeypatch):
+        """One index failing to build should not leave the later ones missing"""
+        created = []
+
+        async def create_index(collection, keys, **options):
+            if options.get("unique") and collection.name == "tracking_events":
+                raise RuntimeError("E11000 duplicate key")
+            created.append((collection.name, str(keys)))
+
+        for name in ("tracking_events", "tracking_events_archive", "shipments"):
+            collection = db[name]
+            monkeypatch.setattr(collection, "create_index", lambda keys, _c=collection, **o: create_index(_c, keys, **o))
+
+        asyncio.run(TrackingService(db).ensure_indexes())
+        assert ("tracking_events", "occurred_at") in created
+        assert ("tracking_events_archive", "event_id") in created
+        assert ("shipments", "tracking_number") in created
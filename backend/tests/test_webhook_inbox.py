@@ -0,0 +1,217 @@
+"""
+Webhook Inbox Tests - offline, against an in-memory webhook_inbox collection:
+1. Items held under a live lease are not claimed twice
+2. Recovery picks up expired leases, not items still being worked on, and
+   keeps running while the workers do
+3. Failed items are retried in place, ahead of later items with the same key
+4. Replay leaves items under a live lease to their worker
+"""
+import asyncio
+import pytest
+from datetime import datetime, timezone, timedelta
+
+import webhook_inbox
+from bench.memory_db import MemoryDB
+from webhook_inbox import WebhookInbox
+
+def iso(offset_seconds):
+    return (datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)).isoformat()
+
+def leased_item(inbox, inbox_id, lease_offset):
+    item = inbox._new_item("tracking", "tracking:TRK1", {"n": inbox_id})
+    item.update({
+        "inbox_id": inbox_id,
+        "status": "processing",
+        "attempts": 1,
+        "lease_id": "other_worker",
+        "lease_expires_at": iso(lease_offset),
+        "received_at": iso(-600)
+    })
+    return item
+
+class TestWebhookInboxClaim:
+    """Test that an item is only worked on by one worker at a time"""
+
+    @pytest.fixture
+    def db(self):
+        return MemoryDB()
+
+    def test_live_lease_not_claimed(self, db):
+        """An item another worker holds should be left alone"""
+        inbox = WebhookInbox(db)
+        calls = []
+
+        async def handler(payload):
+            calls.append(payload)
+
+        inbox.register("tracking", handler)
+        db.webhook_inbox.docs.append(leased_item(inbox, "inb_live", 60))
+        asyncio.run(inbox._process({"inbox_id": "inb_live"}))
+        assert calls == []
+        assert db.webhook_inbox.docs[0]["lease_id"] == "other_worker"
+
+    def test_expired_lease_claimed(self, db):
+        """An item whose worker died should be processed"""
+        inbox = WebhookInbox(db)
+        calls = []
+
+        async def handler(payload):
+            calls.append(payload)
+
+        inbox.register("tracking", handler)
+        db.webhook_inbox.docs.append(leased_item(inbox, "inb_dead", -1))
+        asyncio.run(inbox._process({"inbox_id": "inb_dead"}))
+        assert calls == [{"n": "inb_dead"}]
+        doc = db.webhook_inbox.docs[0]
+        assert doc["status"] == "processed"
+        assert doc["attempts"] == 2
+        assert doc["lease_id"] is None
+
+    def test_recover_selects_expired_leases(self, db):
+        """Recovery should dispatch expired leases and old received items only"""
+        inbox = WebhookInbox(db)
+        fresh = inbox._new_item("tracking", "tracking:TRK2", {})
+        old = inbox._new_item("tracking", "tracking:TRK3", {})
+        old["received_at"] = iso(-600)
+        db.webhook_inbox.docs.extend([
+            leased_item(inbox, "inb_live", 60),
+            leased_item(inbox, "inb_dead", -1),
+            fresh,
+            old
+        ])
+
+        async def run():
+            inbox._queues = [asyncio.Queue()]
+            count = await inbox._recover()
+            queued = [inbox._queues[0].get_nowait()["inbox_id"] for _ in range(count)]
+            return queued
+
+        assert sorted(asyncio.run(run())) == sorted(["inb_dead", old["inbox_id"]])
+
+    def test_lease_expiring_while_running_is_recovered(self, db, monkeypatch):
+        """A lease that runs out after startup should be picked up without a restart"""
+        monkeypatch.setattr(webhook_inbox, "WEBHOOK_RECOVERY_SECONDS", 0.01)
+        inbox = WebhookInbox(db, concurrency=1)
+        calls = []
+
+        async def handler(payload):
+            calls.append(payload["n"])
+
+        inbox.register("tracking", handler)
+        db.webhook_inbox.docs.append(leased_item(inbox, "inb_dying", 0.05))
+
+        async def run():
+            await inbox.start()
+            assert calls == [], "The lease is still live at startup"
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if calls:
+                    break
+            await inbox.stop()
+
+        asyncio.run(run())
+        assert calls == ["inb_dying"]
+        assert db.webhook_inbox.docs[0]["status"] == "processed"
+
+    def test_queued_item_not_dispatched_twice(self, db):
+        """Recovery should not queue again an item still waiting for its worker"""
+        inbox = WebhookInbox(db)
+        old = inbox._new_item("tracking", "tracking:TRK3", {})
+        old["received_at"] = iso(-600)
+        db.webhook_inbox.docs.append(old)
+
+        async def run():
+            inbox._queues = [asyncio.Queue()]
+            await inbox._recover()
+            await inbox._recover()
+            return inbox._queues[0].qsize()
+
+        assert asyncio.run(run()) == 1
+
+class TestWebhookInboxRetry:
+    """Test that retries keep per-key order"""
+
+    @pytest.fixture
+    def db(self, monkeypatch):
+        monkeypatch.setattr(webhook_inbox, "WEBHOOK_RETRY_BACKOFF_SECONDS", 0.001)
+        return MemoryDB()
+
+    def test_retry_in_place_keeps_order(self, db):
+        """A failing item should succeed on retry before the next item with its key runs"""
+        inbox = WebhookInbox(db, concurrency=1)
+        calls = []
+
+        async def handler(payload):
+            calls.append(payload["n"])
+            if payload["n"] == 1 and calls.count(1) == 1:
+                raise RuntimeError("shipment not written yet")
+
+        inbox.register("tracking", handler)
+
+        async def run():
+            await inbox.start()
+            await inbox.record_many("tracking", [
+                {"ordering_key": "tracking:TRK1", "payload": {"n": 1}},
+                {"ordering_key": "tracking:TRK1", "payload": {"n": 2}}
+            ])
+            await asyncio.wait_for(inbox._queues[0].join(), 1)
+            await inbox.stop()
+
+        asyncio.run(run())
+        assert calls == [1, 1, 2]
+        first = db.webhook_inbox.docs[0]
+        assert first["status"] == "processed"
+        assert first["attempts"] == 2
+        assert first["last_error"] is None
+
+    def test_gives_up_after_max_attempts(self, db):
+        """An item failing every attempt should be marked failed"""
+        inbox = WebhookInbox(db, concurrency=1)
+
+        async def handler(payload):
+            raise RuntimeError("always")
+
+        inbox.register("tracking", handler)
+
+        async def run():
+            await inbox.start()
+            await inbox.record("tracking", "tracking:TRK1", {"n": 1})
+            await asyncio.wait_for(inbox._queues[0].join(), 1)
+            await inbox.stop()
+
+        asyncio.run(run())
+        doc = db.webhook_inbox.docs[0]
+        assert doc["status"] == "failed"
+        assert doc["attempts"] == webhook_inbox.WEBHOOK_MAX_ATTEMPTS
+        assert doc["last_error"] == "always"
+        assert doc["lease_id"] is None
+
+class TestWebhookInboxReplay:
+    """Test that replay does not take items away from a live worker"""
+
+    @pytest.fixture
+    def db(self):
+        return MemoryDB()
+
+    def test_live_lease_not_replayed(self, db):
+        """Replaying by id should skip an item still leased and reset the rest"""
+        inbox = WebhookInbox(db)
+        failed = inbox._new_item("tracking", "tracking:TRK4", {})
+        failed.update({"status": "failed", "attempts": 3, "last_error": "boom"})
+        db.webhook_inbox.docs.extend([leased_item(inbox, "inb_live", 60), leased_item(inbox, "inb_dead", -1), failed])
+
+        async def run():
+            inbox._queues = [asyncio.Queue()]
+            count = await inbox.replay(inbox_ids=["inb_live", "inb_dead", failed["inbox_id"]])
+            queued = [inbox._queues[0].get_nowait()["inbox_id"] for _ in range(inbox._queues[0].qsize())]
+            return count, queued
+
+        count, queued = asyncio.run(run())
+        assert count == 2
+        assert sorted(queued) == sorted(["inb_dead", failed["inbox_id"]])
+        live = db.webhook_inbox.docs[0]
+        assert live["status"] == "processing"
+        assert live["lease_id"] == "other_worker"
+        assert live["attempts"] == 1
+        assert db.webhook_inbox.docs[2]["status"] == "received"
+        assert db.webhook_inbox.docs[2]["attempts"] == 0
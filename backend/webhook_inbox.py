@@ -0,0 +1,309 @@
+"""
+ReLocal Webhook Inbox
+Webhooks are persisted raw and acknowledged immediately; an asyncio worker
+pool drains the inbox in the background
+"""
+
+import os
+import uuid
+import zlib
+import logging
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from datetime import datetime, timezone, timedelta
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# ============= CONFIGURATION =============
+
+WEBHOOK_WORKER_CONCURRENCY = int(os.environ.get('WEBHOOK_WORKER_CONCURRENCY', '4'))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '3'))
+# A claimed item is leased to its worker; if the process dies the lease expires
+WEBHOOK_LEASE_SECONDS = int(os.environ.get('WEBHOOK_LEASE_SECONDS', '120'))
+# Failed attempts are retried in place after base * 2^(attempt - 1) seconds
+WEBHOOK_RETRY_BACKOFF_SECONDS = float(os.environ.get('WEBHOOK_RETRY_BACKOFF_SECONDS', '1'))
+# Recovery runs at startup and then every this many seconds; items left in
+# received longer than this are picked up again, expired leases right away
+WEBHOOK_RECOVERY_SECONDS = int(os.environ.get('WEBHOOK_RECOVERY_SECONDS', '60'))
+
+# Inbox statuses: received -> processing -> processed
+#                                        \-> failed (after WEBHOOK_MAX_ATTEMPTS, replayable)
+
+InboxHandler = Callable[[Dict], Awaitable[None]]
+
+# ============= INBOX =============
+
+class WebhookInbox:
+    """
+    Durable webhook inbox stored in the `webhook_inbox` collection
+    Items with the same ordering_key (shipment tracking number, Stripe session)
+    always go to the same worker, so they are applied in arrival order while
+    different keys are processed concurrently. A failed item is retried by
+    its worker after a backoff before the worker moves on, so a retry never
+    lets a later item with the same key overtake it.
+    """
+
+    def __init__(self, db, concurrency: int = WEBHOOK_WORKER_CONCURRENCY):
+        self.db = db
+        self.concurrency = concurrency
+        self.handlers: Dict[str, InboxHandler] = {}
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._recovery_task: Optional[asyncio.Task] = None
+        # Items waiting in or held by this process's workers, not dispatched again
+        self._queued: Set[str] = set()
+
+    def register(self, source: str, handler: InboxHandler) -> None:
+        self.handlers[source] = handler
+
+    async def ensure_indexes(self) -> None:
+        await self.db.webhook_inbox.create_index("inbox_id", unique=True)
+        await self.db.webhook_inbox.create_index([("status", 1), ("received_at", 1)])
+        await self.db.webhook_inbox.create_index([("status", 1), ("lease_expires_at", 1)])
+
+    def _new_item(self, source: str, ordering_key: str, payload: Dict) -> Dict:
+        return {
+            "inbox_id": f"inb_{uuid.uuid4().hex[:16]}",
+            "source": source,
+            "ordering_key": ordering_key,
+            "payload": payload,
+            "status": "received",
+            "attempts": 0,
+            "lease_expires_at": None,
+            "lease_id": None,
+            "last_error": None,
+            "received_at": datetime.now(timezone.utc).isoformat(),
+            "processed_at": None
+        }
+
+    async def record(self, source: str, ordering_key: str, payload: Dict) -> str:
+        """
+        Persist one webhook payload and schedule it, returns its inbox_id
+        """
+
+        item = self._new_item(source, ordering_key, payload)
+        await self.db.webhook_inbox.insert_one(item)
+        item.pop("_id", None)
+        self._dispatch(item)
+        return item["inbox_id"]
+
+    async def record_many(self, source: str, items: List[Dict]) -> List[str]:
+        """
+        Persist several {ordering_key, payload} items with one insert_many
+        """
+
+        docs = [self._new_item(source, item["ordering_key"], item["payload"]) for item in items]
+        if not docs:
+            return []
+        await self.db.webhook_inbox.insert_many(docs)
+        for doc in docs:
+            doc.pop("_id", None)
+            self._dispatch(doc)
+        return [doc["inbox_id"] for doc in docs]
+
+    def _dispatch(self, item: Dict) -> None:
+        if not self._queues:
+            # Workers not running (e.g. during shutdown) - recovered on next start
+            return
+        if item["inbox_id"] in self._queued:
+            return
+        self._queued.add(item["inbox_id"])
+        partition = zlib.crc32(item["ordering_key"].encode("utf-8")) % len(self._queues)
+        self._queues[partition].put_nowait(item)
+
+    # ============= WORKERS =============
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue() for _ in range(self.concurrency)]
+        self._tasks = [
+            asyncio.create_task(self._worker(queue))
+            for queue in self._queues
+        ]
+        recovered = await self._recover()
+        self._recovery_task = asyncio.create_task(self._recover_periodically())
+        logger.info(f"Started {self.concurrency} webhook workers, recovered {recovered} inbox items")
+
+    async def stop(self) -> None:
+        tasks = self._tasks + ([self._recovery_task] if self._recovery_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._recovery_task = None
+        self._queues = []
+        self._queued = set()
+
+    async def _recover_periodically(self) -> None:
+        # Leases held by a worker that died mid-item expire while we run, not
+        # only across restarts
+        while True:
+            await asyncio.sleep(WEBHOOK_RECOVERY_SECONDS)
+            try:
+                recovered = await self._recover()
+                if recovered:
+                    logger.info(f"Recovered {recovered} webhook inbox items")
+            except Exception as e:
+                logger.error(f"Webhook inbox recovery failed: {e}")
+
+    async def _recover(self) -> int:
+        """
+        Re-dispatch items accepted but never finished, by any process
+        Received items left over WEBHOOK_RECOVERY_SECONDS, and processing items
+        whose lease has expired however recently; items still leased belong to
+        a live worker.
+        """
+
+        now = datetime.now(timezone.utc)
+        cutoff = (now - timedelta(seconds=WEBHOOK_RECOVERY_SECONDS)).isoformat()
+        count = 0
+        async for item in self.db.webhook_inbox.find(
+            {"$or": [
+                {"status": "received", "received_at": {"$lte": cutoff}},
+                {"status": "processing", "lease_expires_at": {"$lte": now.isoformat()}}
+            ]},
+            {"_id": 0}
+        ).sort("received_at", 1):
+            self._dispatch(item)
+            count += 1
+        return count
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            try:
+                await self._process(item)
+            except Exception as e:
+                logger.error(f"Webhook inbox worker error on {item['inbox_id']}: {e}")
+            finally:
+                self._queued.discard(item["inbox_id"])
+                queue.task_done()
+
+    async def _claim(self, query: Dict) -> Optional[Dict]:
+        """
+        Lease a matching item to this worker for one attempt
+        """
+        now = datetime.now(timezone.utc)
+        return await self.db.webhook_inbox.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": "processing",
+                    "lease_expires_at": (now + timedelta(seconds=WEBHOOK_LEASE_SECONDS)).isoformat(),
+                    "lease_id": uuid.uuid4().hex
+                },
+                "$inc": {"attempts": 1}
+            },
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _process(self, item: Dict) -> None:
+        # Claim only items nobody holds, so an item dispatched twice (recovery,
+        # replay) runs once at a time
+        now_iso = datetime.now(timezone.utc).isoformat()
+        claimed = await self._claim({
+            "inbox_id": item["inbox_id"],
+            "$or": [
+                {"status": "received"},
+                {"status": "processing", "lease_expires_at": {"$lte": now_iso}}
+            ]
+        })
+
+        while claimed:
+            handler = self.handlers.get(claimed["source"])
+            try:
+                if handler is None:
+                    raise ValueError(f"No handler for webhook source {claimed['source']}")
+                await handler(claimed["payload"])
+            except Exception as e:
+                logger.warning(f"Webhook {claimed['source']} {claimed['inbox_id']} failed (attempt {claimed['attempts']}): {e}")
+                if claimed["attempts"] >= WEBHOOK_MAX_ATTEMPTS or handler is None:
+                    await self._finish(claimed, {"status": "failed", "last_error": str(e)})
+                    return
+
+                # Hold the lease through the backoff, then retry before the
+                # partition's next item
+                backoff = WEBHOOK_RETRY_BACKOFF_SECONDS * (2 ** (claimed["attempts"] - 1))
+                lease_until = datetime.now(timezone.utc) + timedelta(seconds=backoff + WEBHOOK_LEASE_SECONDS)
+                await self._finish(claimed, {"last_error": str(e), "lease_expires_at": lease_until.isoformat()})
+                await asyncio.sleep(backoff)
+                claimed = await self._claim(
+                    {"inbox_id": claimed["inbox_id"], "status": "processing", "lease_id": claimed["lease_id"]}
+                )
+                continue
+
+            await self._finish(claimed, {
+                "status": "processed",
+                "last_error": None,
+                "processed_at": datetime.now(timezone.utc).isoformat()
+            })
+            return
+
+    async def _finish(self, claimed: Dict, fields: Dict) -> None:
+        """
+        Record an attempt's outcome, only while this worker still holds the lease
+        """
+        if "status" in fields:
+            fields = {**fields, "lease_expires_at": None, "lease_id": None}
+        await self.db.webhook_inbox.update_one(
+            {"inbox_id": claimed["inbox_id"], "status": "processing", "lease_id": claimed["lease_id"]},
+            {"$set": fields}
+        )
+
+    # ============= REPLAY =============
+
+    async def replay(
+        self,
+        inbox_ids: Optional[List[str]] = None,
+        source: Optional[str] = None,
+        status: str = "failed"
+    ) -> int:
+        """
+        Re-run stored webhooks, by id or all with a given source/status
+        Items a worker holds under a live lease are left to it; returns how
+        many items were reset and dispatched
+        """
+
+        query: Dict = {"inbox_id": {"$in": inbox_ids}} if inbox_ids else {"status": status}
+        if source:
+            query["source"] = source
+        query["$or"] = [
+            {"status": {"$ne": "processing"}},
+            {"lease_expires_at": {"$lte": datetime.now(timezone.utc).isoformat()}}
+        ]
+
+        items = await self.db.webhook_inbox.find(query, {"_id": 0, "inbox_id": 1}).to_list(None)
+        if not items:
+            return 0
+
+        # The lease filter again, a worker may have claimed an item since the find
+        reset_ids = [item["inbox_id"] for item in items]
+        await self.db.webhook_inbox.update_many(
+            {"inbox_id": {"$in": reset_ids}, "$or": query["$or"]},
+            {"$set": {"status": "received", "attempts": 0, "lease_expires_at": None, "lease_id": None}}
+        )
+
+        # Dispatch only what the update reset
+        replayed = await self.db.webhook_inbox.find(
+            {"inbox_id": {"$in": reset_ids}, "status": "received"},
+            {"_id": 0}
+        ).sort("received_at", 1).to_list(None)
+        for item in replayed:
+            self._dispatch(item)
+        return len(replayed)
+
+    async def stats(self) -> Dict:
+        counts = {"received": 0, "processing": 0, "processed": 0, "failed": 0}
+        async for row in self.db.webhook_inbox.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]):
+            counts[row["_id"]] = row["count"]
+        return {
+            **counts,
+            "workers": len(self._tasks),
+            "queued_in_process": sum(queue.qsize() for queue in self._queues)
+        }
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { API } from '@/App';
@@ -27,6 +27,12 @@ export default function Checkout() {
   });
   const [loading, setLoading] = useState(false);
   const [totalWeight, setTotalWeight] = useState(0);
+  // Sent as Idempotency-Key so retrying the same checkout never creates a second order
+  const checkoutAttempt = useRef(crypto.randomUUID());
+
+  useEffect(() => {
+    checkoutAttempt.current = crypto.randomUUID();
+  }, [cart, deliveryType, shipAfterTrip, tripEndDate, address]);
 
   useEffect(() => {
     fetchUserAndCart();
@@ -98,7 +104,8 @@ export default function Checkout() {
       };
 
       const orderResponse = await axios.post(`${API}/orders`, orderData, {
-        withCredentials: true
+        withCredentials: true,
+        headers: { 'Idempotency-Key': `order-${checkoutAttempt.current}` }
       });
 
       const orderId = orderResponse.data.order_id;
@@ -107,7 +114,10 @@ export default function Checkout() {
       const checkoutResponse = await axios.post(
         `${API}/checkout/session`,
         { order_id: orderId, origin_url: originUrl },
-        { withCredentials: true }
+        {
+          withCredentials: true,
+          headers: { 'Idempotency-Key': `checkout-${checkoutAttempt.current}` }
+        }
       );
 
       window.location.href = checkoutResponse.data.url;
@@ -26,37 +26,71 @@ export default function CheckoutSuccess() {
       return;
     }
 
-    pollPaymentStatus(sessionId);
+    waitForPayment(sessionId);
   }, [location, navigate]);
 
-  const pollPaymentStatus = async (sessionId, attempts = 0) => {
-    const maxAttempts = 5;
-    const pollInterval = 2000;
+  // Returns true once the session has reached a final state
+  const checkPaymentStatus = async (sessionId) => {
+    const response = await axios.get(`${API}/checkout/status/${sessionId}`, {
+      withCredentials: true
+    });
 
-    if (attempts >= maxAttempts) {
-      setStatus('timeout');
-      return;
+    if (response.data.payment_status === 'paid') {
+      setStatus('success');
+      localStorage.removeItem('cart');
+      return true;
+    } else if (response.data.status === 'expired') {
+      setStatus('failed');
+      return true;
     }
+    return false;
+  };
 
-    try {
-      const response = await axios.get(`${API}/checkout/status/${sessionId}`, {
-        withCredentials: true
-      });
+  // Waits for the order event pushed by the Stripe webhook instead of polling
+  const waitForPayment = (sessionId) => {
+    const maxWait = 10000;
+    const events = new EventSource(`${API}/events/orders`, { withCredentials: true });
+    let done = false;
 
-      if (response.data.payment_status === 'paid') {
-        setStatus('success');
-        localStorage.removeItem('cart');
-        return;
-      } else if (response.data.status === 'expired') {
+    const finish = () => {
+      done = true;
+      clearTimeout(timer);
+      events.close();
+    };
+
+    const timer = setTimeout(async () => {
+      finish();
+      try {
+        if (!(await checkPaymentStatus(sessionId))) {
+          setStatus('timeout');
+        }
+      } catch (error) {
+        console.error('Error checking payment status:', error);
         setStatus('failed');
-        return;
       }
+    }, maxWait);
 
-      setTimeout(() => pollPaymentStatus(sessionId, attempts + 1), pollInterval);
-    } catch (error) {
-      console.error('Error checking payment status:', error);
-      setStatus('failed');
-    }
+    // Check once after subscribing, in case the payment was confirmed before we connected
+    events.addEventListener('ready', async () => {
+      try {
+        if (!done && (await checkPaymentStatus(sessionId))) {
+          finish();
+        }
+      } catch (error) {
+        console.error('Error checking payment status:', error);
+        finish();
+        setStatus('failed');
+      }
+    });
+
+    events.addEventListener('order_status', (event) => {
+      const data = JSON.parse(event.data);
+      if (!done && data.session_id === sessionId && data.payment_status === 'paid') {
+        finish();
+        setStatus('success');
+        localStorage.removeItem('cart');
+      }
+    });
   };
 
   return (